@@ -1,12 +1,15 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file,
+                   abort, Response, stream_with_context)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from preprocessing import preprocess_text
-from rabin_karp import detect_plagiarism
-from models import db, User
-from database import init_db, get_db_stats
+from preprocessing import get_stem_cache_stats
+from models import db, User, Check
+from database import init_db, get_db_stats, ENGINE_OPTIONS
+from job_queue import JobQueue, start_workers, record_cache_stats
+from batch_store import BatchStore
+from functools import wraps
+import json
 import os
-import uuid
-import time
+import shutil
 
 app = Flask(__name__)
 
@@ -14,6 +17,46 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///plagiarism.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = ENGINE_OPTIONS
+
+# Winnowing window for fingerprint selection (0 = compare every k-gram)
+app.config['WINNOW_WINDOW'] = int(os.environ.get('WINNOW_WINDOW', 0))
+
+# Fingerprint index of every checked document (one-vs-all lookups)
+app.config['CORPUS_INDEX_PATH'] = os.environ.get('CORPUS_INDEX_PATH', 'corpus_index.db')
+
+# Batch comparison: MinHash/LSH candidate pruning for large cohorts.
+# Off by default because pruning loses recall: a pair is only scored when the
+# estimated k-gram containment or word Jaccard reaches ~(1/LSH_BANDS)^(1/LSH_ROWS)
+# (~0.088 with 128x2, which keeps >99% of pairs at BATCH_DETAIL_THRESHOLD=20%,
+# see verify_lsh_recall.py). Pairs below that, or just above it with unlucky
+# samples, are reported as 0% and never get details.
+app.config['BATCH_USE_LSH'] = os.environ.get('BATCH_USE_LSH', '0') == '1'
+app.config['LSH_BANDS'] = int(os.environ.get('LSH_BANDS', 128))
+app.config['LSH_ROWS'] = int(os.environ.get('LSH_ROWS', 2))
+app.config['BATCH_DETAIL_THRESHOLD'] = float(os.environ.get('BATCH_DETAIL_THRESHOLD', 20))
+app.config['PREPROCESS_WORKERS'] = int(os.environ.get('PREPROCESS_WORKERS', 0)) or None
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 500 if app.config['BATCH_USE_LSH'] else 30))
+
+# Background checks: queue database and worker processes started by the app
+# (0 = run `python job_queue.py` separately)
+app.config['JOB_QUEUE_PATH'] = os.environ.get('JOB_QUEUE_PATH', 'jobs.db')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+
+# Multi Compare results (the session only keeps the batch ID)
+app.config['BATCH_STORE_PATH'] = os.environ.get('BATCH_STORE_PATH', 'batches.db')
+
+# Highlighted batch pages, rendered on demand and cached on disk
+app.config['HIGHLIGHT_CACHE_DIR'] = os.environ.get('HIGHLIGHT_CACHE_DIR', 'highlight_cache')
+app.config['HIGHLIGHT_MAX_AGE'] = int(os.environ.get('HIGHLIGHT_MAX_AGE', 86400))
+
+# Content-addressed page images and word boxes (limits: see upload_store)
+app.config['UPLOAD_STORE_PATH'] = os.environ.get('UPLOAD_STORE_PATH', 'uploads.db')
+
+# JSON API: files are extracted (and OCR'd) inside the request, not through
+# the job queue, so each uploaded file is capped in size and pages
+app.config['API_MAX_FILE_MB'] = int(os.environ.get('API_MAX_FILE_MB', 10))
+app.config['API_MAX_PAGES'] = int(os.environ.get('API_MAX_PAGES', 20))
 
 # Initialize extensions
 db.init_app(app)
@@ -28,6 +71,60 @@ init_db(app)
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+@login_manager.request_loader
+def load_user_from_request(request):
+    """HTTP Basic auth (email and password) for API clients without a session."""
+    auth = request.authorization
+    if not auth or not request.path.startswith('/api/'):
+        return None
+    user = User.query.filter_by(email=auth.username).first()
+    return user if user and user.check_password(auth.password) else None
+
+def get_job_queue():
+    return JobQueue(app.config['JOB_QUEUE_PATH'])
+
+def get_check_options():
+    """Detection settings passed along with every background job."""
+    return {
+        'window': app.config['WINNOW_WINDOW'],
+        'corpus_index_path': app.config['CORPUS_INDEX_PATH'],
+        'batch_use_lsh': app.config['BATCH_USE_LSH'],
+        'lsh_bands': app.config['LSH_BANDS'],
+        'lsh_rows': app.config['LSH_ROWS'],
+        'batch_detail_threshold': app.config['BATCH_DETAIL_THRESHOLD'],
+        'preprocess_workers': app.config['PREPROCESS_WORKERS'],
+        'batch_store_path': app.config['BATCH_STORE_PATH'],
+        'upload_store_path': app.config['UPLOAD_STORE_PATH'],
+        'highlight_cache_dir': app.config['HIGHLIGHT_CACHE_DIR'],
+        'database_uri': app.config['SQLALCHEMY_DATABASE_URI']
+    }
+
+def enqueue_job(kind, payload):
+    # Workers are started on first use so the reloader parent process never
+    # spawns any; later calls replace workers that died
+    start_workers(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_PATH'])
+    return get_job_queue().enqueue(kind, payload, user_id=current_user.id)
+
+def get_batch_store():
+    return BatchStore(app.config['BATCH_STORE_PATH'])
+
+def get_batch_results():
+    """Overview of the user's last batch (its ID is kept in the session)."""
+    batch_id = session.get('batch_id')
+    if not batch_id:
+        return None
+    results = get_batch_store().summary(batch_id)
+    if results is None or (results['user_id'] != current_user.id and not current_user.is_admin()):
+        return None
+    return results
+
+def get_own_job(job_id):
+    """Job status if it belongs to the current user (or the user is an admin)."""
+    job = get_job_queue().status(job_id)
+    if job is None or (job['user_id'] != current_user.id and not current_user.is_admin()):
+        return None
+    return job
+
 # ==================== PUBLIC ROUTES ====================
 
 @app.route('/')
@@ -120,112 +217,99 @@ def logout():
 @app.route('/dashboard', methods=['GET', 'POST'])
 @login_required
 def dashboard():
-    result = None
-    suspect_images = []
-    source_images = []
-    suspect_highlighted = ""
-    source_highlighted = ""
-    suspect_original = ""
-    source_original = ""
-    
     if request.method == 'POST':
-        from file_parser import extract_text_and_images_from_file
-        from highlight_visualizer import highlight_plagiarism_in_images, save_highlighted_image
-        from text_highlighter import highlight_text_matches
+        from checks import save_uploads
         
-        # Extract text and images from both files
-        suspect_data = None
-        source_data = None
+        payload = {
+            'suspect_text': request.form.get('suspect_text', ''),
+            'source_text': request.form.get('source_text', ''),
+            'options': get_check_options()
+        }
         
-        # Handle Suspect Input
-        if 'suspect_file' in request.files and request.files['suspect_file'].filename != '':
-            suspect_data = extract_text_and_images_from_file(request.files['suspect_file'])
-        else:
-            suspect_text = request.form.get('suspect_text', '')
-            if suspect_text:
-                suspect_data = {'text': suspect_text, 'images': [], 'filename': 'manual_input'}
-        
-        # Handle Source Input
-        if 'source_file' in request.files and request.files['source_file'].filename != '':
-            source_data = extract_text_and_images_from_file(request.files['source_file'])
-        else:
-            source_text = request.form.get('source_text', '')
-            if source_text:
-                source_data = {'text': source_text, 'images': [], 'filename': 'manual_input'}
-        
-        if suspect_data and source_data and suspect_data['text'] and source_data['text']:
-            # Store original texts for display
-            suspect_original = suspect_data['text']
-            source_original = source_data['text']
-            
-            # Preprocess
-            suspect_processed = preprocess_text(suspect_data['text'])
-            source_processed = preprocess_text(source_data['text'])
-            
-            print(f"DEBUG: Suspect Processed Length: {len(suspect_processed)}")
-            print(f"DEBUG: Source Processed Length: {len(source_processed)}")
-            
-            if not suspect_processed or not source_processed:
-                flash('Teks tidak terbaca dari file.', 'error')
-                result = None
-            else:
-                # Detect plagiarism
-                result = detect_plagiarism(suspect_processed, source_processed, k=3)
-                
-                # Generate highlighted text for visual comparison
-                if result['matches']:
-                    suspect_highlighted = highlight_text_matches(suspect_original, result['matches'])
-                    source_highlighted = highlight_text_matches(source_original, result['matches'])
-                else:
-                    from html import escape
-                    suspect_highlighted = escape(suspect_original)
-                    source_highlighted = escape(source_original)
-                
-                # Generate unique session ID for this check
-                session_id = str(uuid.uuid4())[:8]
-                timestamp = int(time.time())
-                
-                # Highlight images if available
-                if suspect_data['images'] and result['matches']:
-                    print(f"DEBUG: Highlighting {len(suspect_data['images'])} suspect images...")
-                    highlighted_suspect = highlight_plagiarism_in_images(
-                        suspect_data['images'], 
-                        result['matches']
-                    )
-                    
-                    # Save highlighted images
-                    for idx, img in enumerate(highlighted_suspect):
-                        filename = f"suspect_{session_id}_{timestamp}_page_{idx+1}.png"
-                        filepath = os.path.join('static', 'uploads', 'highlighted', filename)
-                        save_highlighted_image(img, filepath)
-                        suspect_images.append(f"uploads/highlighted/{filename}")
-                
-                if source_data['images'] and result['matches']:
-                    print(f"DEBUG: Highlighting {len(source_data['images'])} source images...")
-                    highlighted_source = highlight_plagiarism_in_images(
-                        source_data['images'],
-                        result['matches']
-                    )
-                    
-                    # Save highlighted images
-                    for idx, img in enumerate(highlighted_source):
-                        filename = f"source_{session_id}_{timestamp}_page_{idx+1}.png"
-                        filepath = os.path.join('static', 'uploads', 'highlighted', filename)
-                        save_highlighted_image(img, filepath)
-                        source_images.append(f"uploads/highlighted/{filename}")
-        else:
-            flash('Mohon masukkan teks atau unggah file untuk kedua kolom.', 'error')
-            if not suspect_data or not suspect_data['text']:
-                flash('Gagal mengekstrak teks dari Suspect File.', 'error')
-            if not source_data or not source_data['text']:
-                flash('Gagal mengekstrak teks dari Source File.', 'error')
+        # Uploaded files take precedence over pasted text
+        uploads = [(side, request.files[f'{side}_file']) for side in ('suspect', 'source')
+                   if f'{side}_file' in request.files and request.files[f'{side}_file'].filename != '']
+        if uploads:
+            upload_dir, saved = save_uploads([f for _, f in uploads])
+            payload['upload_dir'] = upload_dir
+            for (side, _), upload in zip(uploads, saved):
+                payload[f'{side}_file'] = upload
         
+        job_id = enqueue_job('compare', payload)
+        return redirect(url_for('job_page', job_id=job_id))
+    
     return render_template('dashboard.html', 
-                         result=result, 
-                         suspect_images=suspect_images,
-                         source_images=source_images,
-                         suspect_highlighted=suspect_highlighted,
-                         source_highlighted=source_highlighted)
+                         result=None, 
+                         suspect_images=[],
+                         source_images=[],
+                         suspect_highlighted="",
+                         source_highlighted="",
+                         corpus_matches=[])
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_page(job_id):
+    job = get_own_job(job_id)
+    if job is None:
+        flash('Job not found.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if job['status'] == 'failed':
+        flash(f"Pemeriksaan gagal: {job['error']}", 'error')
+        return redirect(url_for('batch_comparison' if job['kind'] == 'batch' else 'dashboard'))
+    
+    if job['status'] != 'done':
+        return render_template('job_status.html', job=job)
+    
+    output = get_job_queue().result(job_id)
+    for category, message in output.pop('messages', []):
+        flash(message, category)
+    
+    if job['kind'] == 'batch':
+        if output['batch_id']:
+            session['batch_id'] = output['batch_id']
+        return redirect(url_for('batch_comparison'))
+    
+    return render_template('dashboard.html', **output)
+
+@app.route('/jobs/<job_id>/status')
+@login_required
+def job_status(job_id):
+    job = get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({
+        'status': job['status'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'error': job['error'],
+        'result_url': url_for('job_page', job_id=job_id)
+    })
+
+@app.route('/history')
+@login_required
+def history():
+    from history import get_history
+    
+    checks = get_history(current_user.id)
+    return render_template('history.html', checks=checks)
+
+@app.route('/history/<int:check_id>')
+@login_required
+def history_detail(check_id):
+    from history import get_check_result
+    
+    check = Check.query.get_or_404(check_id)
+    if check.user_id != current_user.id and not current_user.is_admin():
+        flash('Access denied.', 'error')
+        return redirect(url_for('history'))
+    
+    if check.kind == 'batch':
+        session['batch_id'] = check.batch_id
+        return redirect(url_for('batch_comparison'))
+    
+    return render_template('dashboard.html', **get_check_result(check))
 
 @app.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -315,12 +399,50 @@ def admin_toggle_role(user_id):
     flash(f'User {user.email} role changed to {user.role}.', 'success')
     return redirect(url_for('admin_users'))
 
+@app.route('/admin/metrics')
+@login_required
+def admin_metrics():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    from file_parser import get_extraction_cache_stats
+    from upload_store import UploadStore, directory_usage
+    
+    # Hit/miss counters are the totals of all workers (plus this process);
+    # sizes are those of this process
+    queue = get_job_queue()
+    record_cache_stats(queue)
+    shared = queue.cache_stats()
+    extraction_stats = get_extraction_cache_stats()
+    if extraction_stats:
+        extraction_stats.update(shared.get('extraction', {}))
+    stem_stats = get_stem_cache_stats()
+    stem_stats.update(shared.get('stem', {}))
+    
+    highlight_files, highlight_bytes = directory_usage(app.config['HIGHLIGHT_CACHE_DIR'])
+    return jsonify({
+        'extraction_cache': extraction_stats,
+        'stem_cache': stem_stats,
+        'uploads': UploadStore(app.config['UPLOAD_STORE_PATH']).stats(),
+        'highlight_cache': {'files': highlight_files, 'bytes': highlight_bytes}
+    })
+
+@app.route('/admin/uploads/sweep', methods=['POST'])
+@login_required
+def admin_sweep_uploads():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    from checks import collect_uploads
+    
+    return jsonify(collect_uploads(get_check_options(), force=True))
+
 # ==================== BATCH COMPARISON ====================
 
 @app.route('/batch', methods=['GET', 'POST'])
 @login_required
 def batch_comparison():
-    from batch_comparison import compare_all_pairs, get_suspicious_pairs, get_comparison_stats
+    from batch_comparison import get_suspicious_pairs, get_comparison_stats
     
     results = None
     stats = None
@@ -329,65 +451,33 @@ def batch_comparison():
     doc_names = None
     
     if request.method == 'POST':
-        from file_parser import extract_text_and_images_from_file
+        from checks import save_uploads
         
-        files = request.files.getlist('documents')
+        files = [f for f in request.files.getlist('documents') if f.filename]
         
         if len(files) < 2:
             flash('Please upload at least 2 documents to compare.', 'error')
             return render_template('batch.html')
         
-        if len(files) > 30:
-            flash('Maximum 30 documents allowed.', 'error')
-            return render_template('batch.html')
-        
-        # Extract text from all files
-        documents = []
-        batch_id = str(uuid.uuid4())[:8]
-        
-        for idx, f in enumerate(files):
-            if f.filename:
-                data = extract_text_and_images_from_file(f)
-                if data and data['text']:
-                    # Save images to files if present
-                    image_paths = []
-                    if data.get('images'):
-                        for img_idx, img in enumerate(data['images']):
-                            img_filename = f'batch_{batch_id}_{idx}_{img_idx}.png'
-                            img_path = os.path.join('static', 'uploads', img_filename)
-                            os.makedirs(os.path.dirname(img_path), exist_ok=True)
-                            img.save(img_path, 'PNG')
-                            image_paths.append(f'uploads/{img_filename}')
-                    
-                    documents.append({
-                        'name': f.filename,
-                        'text': data['text'],
-                        'images': image_paths  # Store paths, not PIL objects
-                    })
-                else:
-                    flash(f'Could not extract text from: {f.filename}', 'error')
-        
-        if len(documents) < 2:
-            flash('Need at least 2 valid documents with extractable text.', 'error')
+        if len(files) > app.config['BATCH_MAX_FILES']:
+            flash(f"Maximum {app.config['BATCH_MAX_FILES']} documents allowed.", 'error')
             return render_template('batch.html')
         
-        # Run cross-comparison
-        results = compare_all_pairs(documents)
-        stats = get_comparison_stats(results['pairs'])
+        upload_dir, uploads = save_uploads(files)
+        job_id = enqueue_job('batch', {
+            'upload_dir': upload_dir,
+            'uploads': uploads,
+            'options': get_check_options()
+        })
+        return redirect(url_for('job_page', job_id=job_id))
+    
+    # Show the results of the last finished batch job
+    results = get_batch_results()
+    if results:
+        stats = get_comparison_stats(results['pairs'], results['pruned_pairs'])
         suspicious = get_suspicious_pairs(results['pairs'], threshold=50)
         matrix = results['matrix']
         doc_names = results['document_names']
-        
-        # Store results in session for detail view and back navigation
-        session['batch_results'] = results
-    else:
-        # GET request - try to load results from session
-        results = session.get('batch_results')
-        if results:
-            stats = get_comparison_stats(results['pairs'])
-            suspicious = get_suspicious_pairs(results['pairs'], threshold=50)
-            matrix = results['matrix']
-            doc_names = results['document_names']
     
     return render_template('batch.html',
                          results=results,
@@ -396,62 +486,246 @@ def batch_comparison():
                          matrix=matrix,
                          doc_names=doc_names)
 
+def may_view_batch(store, batch_id):
+    """Whether the current user owns the batch (or is an admin)."""
+    owner = store.owner(batch_id)
+    return owner is not None and (owner == current_user.id or current_user.is_admin())
+
+def load_batch_pair(batch_id, pair_index):
+    """
+    Load one pair of a batch the current user may see, computing its
+    matches first if it was scored without details.
+    """
+    store = get_batch_store()
+    if not may_view_batch(store, batch_id):
+        return None
+    
+    pair = store.get_pair(batch_id, pair_index)
+    if pair and pair['matches'] is None:
+        from batch_comparison import ensure_pair_details
+        
+        # Below the detail threshold: compute matches once and keep them
+        ensure_pair_details(pair, window=app.config['WINNOW_WINDOW'])
+        store.save_pair_details(batch_id, pair_index, pair)
+    return pair
+
 @app.route('/batch/detail/<int:pair_index>')
 @login_required
 def batch_detail(pair_index):
-    from text_highlighter import highlight_text_matches
-    from highlight_visualizer import highlight_plagiarism_in_images
-    from PIL import Image
+    from text_highlighter import highlight_text_spans
     
-    results = session.get('batch_results')
-    if not results or pair_index >= len(results['pairs']):
+    batch_id = session.get('batch_id')
+    pair = load_batch_pair(batch_id, pair_index) if batch_id else None
+    if not pair:
         flash('Comparison data not found. Please run batch comparison again.', 'error')
         return redirect(url_for('batch_comparison'))
     
-    pair = results['pairs'][pair_index]
-    
     # Generate highlighted text
-    suspect_highlighted = highlight_text_matches(pair['doc1_text'], pair['matches'])
-    source_highlighted = highlight_text_matches(pair['doc2_text'], pair['matches'])
+    suspect_highlighted = highlight_text_spans(pair['doc1_text'], pair['spans'], 'suspect', pair['matches'])
+    source_highlighted = highlight_text_spans(pair['doc2_text'], pair['spans'], 'source', pair['matches'])
     
-    # Generate highlighted images if raw images exist
-    doc1_highlighted = []
-    doc2_highlighted = []
-    
-    raw_doc1_images = pair.get('doc1_images', [])
-    raw_doc2_images = pair.get('doc2_images', [])
-    matches = pair.get('matches', [])
-    
-    if raw_doc1_images and matches:
-        # Load raw images, apply highlights, save highlighted versions
-        pil_images = [Image.open(os.path.join('static', path)) for path in raw_doc1_images]
-        highlighted = highlight_plagiarism_in_images(pil_images, matches)
-        
-        for idx, img in enumerate(highlighted):
-            filename = f'highlighted_d1_{pair_index}_{idx}.png'
-            path = os.path.join('static', 'uploads', filename)
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            img.save(path, 'PNG')
-            doc1_highlighted.append(f'uploads/{filename}')
-    
-    if raw_doc2_images and matches:
-        pil_images = [Image.open(os.path.join('static', path)) for path in raw_doc2_images]
-        highlighted = highlight_plagiarism_in_images(pil_images, matches)
-        
-        for idx, img in enumerate(highlighted):
-            filename = f'highlighted_d2_{pair_index}_{idx}.png'
-            path = os.path.join('static', 'uploads', filename)
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            img.save(path, 'PNG')
-            doc2_highlighted.append(f'uploads/{filename}')
+    # Page images are highlighted lazily by batch_page_image when the browser loads them
+    page_urls = {}
+    for doc in (1, 2):
+        raw_images = pair.get(f'doc{doc}_images', [])
+        if pair['matches']:
+            page_urls[doc] = [url_for('batch_page_image', batch_id=batch_id, pair_index=pair_index,
+                                      doc=doc, page=page)
+                              for page in range(len(raw_images))]
+        else:
+            # Downscaled display renditions (batches stored before they existed only have raw pages)
+            display_images = pair.get(f'doc{doc}_display_images') or raw_images
+            page_urls[doc] = [url_for('static', filename=path) for path in display_images]
     
     return render_template('batch_detail.html',
                          pair=pair,
                          pair_index=pair_index,
                          suspect_highlighted=suspect_highlighted,
                          source_highlighted=source_highlighted,
-                         doc1_images=doc1_highlighted if doc1_highlighted else raw_doc1_images,
-                         doc2_images=doc2_highlighted if doc2_highlighted else raw_doc2_images)
+                         doc1_images=page_urls[1],
+                         doc2_images=page_urls[2])
+
+@app.route('/batch/<batch_id>/pair/<int:pair_index>/page/<int:doc>/<int:page>')
+@login_required
+def batch_page_image(batch_id, pair_index, doc, page):
+    from highlight_visualizer import get_highlighted_page, highlighted_page_key, load_word_boxes
+    from image_encoding import DISPLAY_IMAGE_FORMAT, DISPLAY_MIMETYPES
+    
+    # Only the page path, word box file and matches are read, not the texts
+    store = get_batch_store()
+    page_data = store.get_page(batch_id, pair_index, doc, page) \
+        if doc in (1, 2) and may_view_batch(store, batch_id) else None
+    if page_data is None:
+        abort(404)
+    if page_data['matches'] is None:
+        # Pair scored without details: compute (and store) them once
+        page_data['matches'] = load_batch_pair(batch_id, pair_index)['matches']
+    
+    image_path = os.path.join('static', page_data['image'])
+    matches = page_data['matches'] or []
+    
+    try:
+        # Revalidation: answer from the ETag alone when the browser has this version
+        etag = highlighted_page_key(image_path, matches)
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            boxes_path = page_data['word_boxes_path']
+            
+            def load_page_boxes():
+                pages = load_word_boxes(boxes_path) if boxes_path else None
+                return pages[page] if pages and page < len(pages) else None
+            
+            path, etag = get_highlighted_page(image_path, matches, load_page_boxes,
+                                              cache_dir=app.config['HIGHLIGHT_CACHE_DIR'])
+            response = send_file(os.path.abspath(path), mimetype=DISPLAY_MIMETYPES[DISPLAY_IMAGE_FORMAT],
+                                 conditional=False, etag=False)
+    except FileNotFoundError:
+        # The raw page file is gone (e.g. removed by the upload sweep)
+        abort(404)
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"private, max-age={app.config['HIGHLIGHT_MAX_AGE']}"
+    return response
+
+# ==================== API ====================
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Authentication required'}), 401, {'WWW-Authenticate': 'Basic realm="api"'}
+        return view(*args, **kwargs)
+    return wrapper
+
+def get_api_input():
+    """
+    JSON body of an API request, or the form fields for multipart uploads.
+    None if a JSON body is not an object.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        return data if isinstance(data, dict) else None
+    return request.form
+
+def check_api_upload(upload):
+    """Error message if an API upload is over the size or page limit, else None."""
+    from file_parser import count_pages
+    
+    upload.stream.seek(0, os.SEEK_END)
+    size = upload.stream.tell()
+    upload.stream.seek(0)
+    if size > app.config['API_MAX_FILE_MB'] * 1024 * 1024:
+        return f"{upload.filename} is larger than {app.config['API_MAX_FILE_MB']} MB"
+    pages = count_pages(upload)
+    if pages > app.config['API_MAX_PAGES']:
+        return f"{upload.filename} has {pages} pages (maximum {app.config['API_MAX_PAGES']})"
+    return None
+
+@app.route('/api/compare', methods=['POST'])
+@api_login_required
+def api_compare():
+    """
+    Compare two documents and return the result as JSON.
+    
+    Accepts multipart uploads (suspect_file, source_file) or raw text
+    (suspect_text, source_text) as form fields or a JSON body.
+    """
+    from checks import api_compare as run_api_compare, extract_document, save_uploads
+    from file_parser import allowed_file
+    
+    data = get_api_input()
+    if data is None:
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    uploads = {side: request.files[f'{side}_file'] for side in ('suspect', 'source')
+               if f'{side}_file' in request.files and request.files[f'{side}_file'].filename != ''}
+    for upload in uploads.values():
+        if not allowed_file(upload.filename):
+            return jsonify({'error': f'Unsupported file type: {upload.filename}'}), 400
+        error = check_api_upload(upload)
+        if error:
+            return jsonify({'error': error}), 413
+    for side in ('suspect', 'source'):
+        if side not in uploads and not data.get(f'{side}_text'):
+            return jsonify({'error': f'Missing {side}_file or {side}_text'}), 400
+        if side not in uploads and not isinstance(data[f'{side}_text'], str):
+            return jsonify({'error': f'{side}_text must be a string'}), 400
+    
+    upload_dir, saved = save_uploads(list(uploads.values())) if uploads else (None, [])
+    saved = dict(zip(uploads, saved))
+    try:
+        sides = [extract_document(saved[side]) if side in saved
+                 else extract_document(text=data[f'{side}_text'], name=data.get(f'{side}_name', side))
+                 for side in ('suspect', 'source')]
+        return jsonify(run_api_compare(sides[0], sides[1], get_check_options()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 422
+    finally:
+        if upload_dir:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+@app.route('/api/batch', methods=['POST'])
+@api_login_required
+def api_batch():
+    """
+    Compare all pairs of documents, streaming the results as NDJSON.
+    
+    Accepts multipart uploads ('documents') and/or a JSON body
+    {"documents": [{"name": ..., "text": ...}]}. Optional 'detail_threshold'
+    (query parameter) overrides the minimum similarity for pairs to include
+    matches. One JSON record per line: 'document' (or 'error') records while
+    extracting, a 'pair' record per comparison as soon as it is scored, and
+    a final 'summary'. Results are not stored in the history.
+    """
+    from checks import iter_api_batch, save_uploads
+    from file_parser import allowed_file
+    
+    files = [f for f in request.files.getlist('documents') if f.filename]
+    texts = []
+    data = get_api_input() if request.is_json else {}
+    if data is None:
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    if not isinstance(data.get('documents') or [], list):
+        return jsonify({'error': '"documents" must be a list'}), 400
+    for idx, doc in enumerate(data.get('documents') or []):
+        if not isinstance(doc, dict) or not isinstance(doc.get('text'), str):
+            return jsonify({'error': f'documents[{idx}] needs a "text" string'}), 400
+        texts.append((str(doc.get('name') or f'document_{idx + 1}'), None, doc['text']))
+    
+    unsupported = [f.filename for f in files if not allowed_file(f.filename)]
+    if unsupported:
+        return jsonify({'error': f"Unsupported file type: {', '.join(unsupported)}"}), 400
+    document_count = len(files) + len(texts)
+    if document_count < 2:
+        return jsonify({'error': 'At least 2 documents are required'}), 400
+    if document_count > app.config['BATCH_MAX_FILES']:
+        return jsonify({'error': f"Maximum {app.config['BATCH_MAX_FILES']} documents allowed"}), 400
+    for upload in files:
+        error = check_api_upload(upload)
+        if error:
+            return jsonify({'error': error}), 413
+    
+    try:
+        detail_threshold = float(request.args.get('detail_threshold', app.config['BATCH_DETAIL_THRESHOLD']))
+    except ValueError:
+        return jsonify({'error': 'detail_threshold must be a number'}), 400
+    
+    # Uploads are saved first: the request's files are closed once streaming starts
+    upload_dir, saved = save_uploads(files) if files else (None, [])
+    sources = [(upload['filename'], upload, None) for upload in saved] + texts
+    options = get_check_options()
+    
+    def generate():
+        try:
+            for record in iter_api_batch(sources, options, detail_threshold):
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+        finally:
+            if upload_dir:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -5,26 +5,231 @@ Provides functions to compare multiple documents against each other
 and generate a similarity matrix.
 """
 
-from itertools import combinations
-from rabin_karp import detect_plagiarism
-from preprocessing import preprocess_text
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from rabin_karp import prepare_document, compare_documents, token_id
+from preprocessing import preprocess_text, save_stem_cache, stem_cache
+from minhash_lsh import minhash_signature, lsh_candidate_pairs, lsh_threshold, containment_candidate_pairs
+from batch_matrix import iter_pair_scores
 
 
-def compare_all_pairs(documents):
+def _preprocess_and_prepare(text, k, window):
+    """Worker for prepare_documents (must be top-level to be picklable)."""
+    processed = preprocess_text(text)
+    return processed, prepare_document(processed, k, window)
+
+
+def _preprocess_and_prepare_task(text, k, window):
+    """
+    Pool task: _preprocess_and_prepare plus the child's stem cache upkeep.
+
+    Pool children never run atexit hooks, so the stem cache is saved here
+    and the cache counters are handed back to the parent.
+    """
+    processed, prepared = _preprocess_and_prepare(text, k, window)
+    save_stem_cache()
+    return processed, prepared, stem_cache.take_counts()
+
+
+def prepare_documents(documents, k=3, window=None, max_workers=None):
+    """
+    Preprocess and fingerprint every document exactly once.
+    
+    Stemming is pure-Python and CPU-bound, so documents that still need
+    preprocessing are fanned out across a process pool. Results keep the
+    input order.
+    
+    Args:
+        documents: List of dicts with a 'text' key (and optionally 'processed')
+        k: K-gram size
+        window: Optional winnowing window
+        max_workers: Process pool size (None = CPU count, 1 = no pool)
+        
+    Returns:
+        The same list; each dict gains 'processed' (str) and 'prepared'
+        (the tokenized fingerprint profile from rabin_karp.prepare_document).
+    """
+    pending = [doc for doc in documents if 'processed' not in doc]
+    
+    if max_workers == 1 or len(pending) < 2:
+        outputs = [_preprocess_and_prepare(doc['text'], k, window) for doc in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            outputs = []
+            for processed, prepared, counts in executor.map(_preprocess_and_prepare_task,
+                                                            [doc['text'] for doc in pending],
+                                                            repeat(k), repeat(window)):
+                stem_cache.add_counts(*counts)
+                outputs.append((processed, prepared))
+    
+    for doc, (processed, prepared) in zip(pending, outputs):
+        doc['processed'] = processed
+        doc['prepared'] = prepared
+    
+    for doc in documents:
+        if 'prepared' not in doc:
+            doc['prepared'] = prepare_document(doc['processed'], k, window)
+    
+    return documents
+
+
+def find_candidate_pairs(prepared_docs, bands=128, rows=2):
+    """
+    Select pairs worth scoring, using the two measures of the final score.
+    
+    A pair is a candidate when one document's fingerprints are estimated to
+    be contained in the other's (bottom-k sample, see
+    containment_candidate_pairs), or when MinHash/LSH banding over the word
+    sets finds it (paraphrases with few shared k-grams). Both use the
+    threshold lsh_threshold(bands, rows).
+    
+    Args:
+        prepared_docs: List of profiles from rabin_karp.prepare_document
+        bands: Number of LSH bands
+        rows: Rows per LSH band
+        
+    Returns:
+        set of (i, j) document index pairs with i < j
+    """
+    num_perm = bands * rows
+    threshold = lsh_threshold(bands, rows)
+    
+    candidates = containment_candidate_pairs([prepared['fingerprints'] for prepared in prepared_docs],
+                                             sample_size=num_perm, threshold=threshold)
+    
+    word_ids = {}
+    signatures = []
+    for prepared in prepared_docs:
+        ids = {word_ids.setdefault(word, token_id(word)) for word in prepared['word_set']}
+        signatures.append(minhash_signature(ids, num_perm=num_perm))
+    candidates |= lsh_candidate_pairs(signatures, bands=bands, rows=rows)
+    
+    print(f"DEBUG: LSH kept {len(candidates)} candidate pairs "
+          f"(threshold ~{threshold:.2f} containment / word Jaccard)")
+    return candidates
+
+
+def get_pair_details(prepared1, prepared2):
+    """
+    Run the exact per-pair comparison to get matched phrases and spans.
+    
+    Returns:
+        dict with 'matches', 'spans' and 'longest_match'
+    """
+    result = compare_documents(prepared1, prepared2, return_spans=True)
+    return {
+        'matches': result['matches'],
+        'spans': result['spans'],
+        'longest_match': result['longest_match']
+    }
+
+
+def ensure_pair_details(pair, window=None):
+    """
+    Fill in matches and spans for a pair that was scored without details.
+    
+    Args:
+        pair: Pair result from compare_all_pairs
+        window: Winnowing window used for the batch
+        
+    Returns:
+        The same pair dict
+    """
+    if pair.get('matches') is None:
+        processed1 = pair.get('doc1_processed') or preprocess_text(pair['doc1_text'])
+        processed2 = pair.get('doc2_processed') or preprocess_text(pair['doc2_text'])
+        prepared1 = prepare_document(processed1, 3, window)
+        prepared2 = prepare_document(processed2, 3, window)
+        pair.update(get_pair_details(prepared1, prepared2))
+    return pair
+
+
+def iter_pair_results(documents, window=None, use_lsh=False, lsh_bands=128, lsh_rows=2,
+                      max_workers=None, detail_threshold=0, stats=None):
+    """
+    Compare all pairs of documents, yielding each pair result as soon as it
+    is ready (see compare_all_pairs for the arguments).
+    
+    Documents are preprocessed up front; scores are computed a block of
+    pairs at a time and details (matches, spans) per pair while iterating,
+    so consumers can stream results without holding all n² pairs in memory.
+    
+    Args:
+        stats: Optional dict, filled with 'pair_count' and 'pruned_pairs'
+               before the first pair is yielded
+        
+    Yields:
+        dict: Pair result (same shape as compare_all_pairs 'pairs' entries)
+    """
+    n = len(documents)
+    
+    # Preprocess and fingerprint every document once
+    prepare_documents(documents, k=3, window=window, max_workers=max_workers)
+    
+    prepared_docs = [doc['prepared'] for doc in documents]
+    total_pairs = n * (n - 1) // 2
+    if use_lsh:
+        # Only candidates are scored at all; the others keep a similarity of 0
+        index_pairs = sorted(find_candidate_pairs(prepared_docs, bands=lsh_bands, rows=lsh_rows))
+    else:
+        index_pairs = None
+    
+    if stats is not None:
+        stats['pair_count'] = total_pairs if index_pairs is None else len(index_pairs)
+        stats['pruned_pairs'] = 0 if index_pairs is None else total_pairs - len(index_pairs)
+    
+    # Scored a block at a time with sparse matrix products
+    for i, j, score in iter_pair_scores(prepared_docs, pairs=index_pairs):
+        doc1, doc2 = documents[i], documents[j]
+        similarity = round(score, 2)
+        
+        pair_result = {
+            'doc1_name': doc1['name'],
+            'doc2_name': doc2['name'],
+            'doc1_index': i,
+            'doc2_index': j,
+            'doc1_text': doc1['text'],
+            'doc2_text': doc2['text'],
+            'doc1_images': doc1.get('images', []),
+            'doc2_images': doc2.get('images', []),
+            'doc1_word_boxes': doc1.get('word_boxes_path'),
+            'doc2_word_boxes': doc2.get('word_boxes_path'),
+            'similarity': similarity,
+            'matches': None,
+            'spans': None,
+            'longest_match': None
+        }
+        if similarity >= detail_threshold:
+            pair_result.update(get_pair_details(doc1['prepared'], doc2['prepared']))
+        yield pair_result
+
+
+def compare_all_pairs(documents, window=None, use_lsh=False, lsh_bands=128, lsh_rows=2,
+                      max_workers=None, detail_threshold=0):
     """
     Compare all pairs of documents and return similarity results.
     
     Args:
-        documents: List of dicts with 'name', 'text', and optional 'images' keys
+        documents: List of dicts with 'name', 'text', and optional 'images' keys.
+                   'processed' and 'prepared' keys are filled in (see prepare_documents).
+        window: Optional winnowing window used for fingerprint selection
+        use_lsh: Only score the candidate pairs found by MinHash/LSH.
+                 Pruned pairs are never scored and keep a similarity of 0
+                 in the matrix (they are not in 'pairs').
+        lsh_bands: Number of LSH bands (more bands = higher recall)
+        lsh_rows: Rows per LSH band (more rows = more pruning)
+        max_workers: Process pool size for the preprocessing stage
+        detail_threshold: Only pairs scoring at least this much get 'matches',
+                          'spans' and 'longest_match' (None for the others,
+                          see ensure_pair_details)
         
     Returns:
         dict with:
             - 'matrix': 2D dict of similarity scores
             - 'pairs': List of all pair comparisons with details
             - 'suspicious': List of pairs with similarity > threshold
+            - 'pruned_pairs': Number of pairs skipped by LSH
     """
-    n = len(documents)
-    
     # Initialize matrix
     matrix = {}
     for doc in documents:
@@ -35,36 +240,23 @@ def compare_all_pairs(documents):
             else:
                 matrix[doc['name']][doc2['name']] = 0
     
-    # Compare all unique pairs
+    stats = {}
     pairs = []
-    for doc1, doc2 in combinations(documents, 2):
-        # Preprocess texts
-        text1_processed = preprocess_text(doc1['text'])
-        text2_processed = preprocess_text(doc2['text'])
-        
-        # Run plagiarism detection
-        result = detect_plagiarism(text1_processed, text2_processed, k=3)
-        
-        pair_result = {
-            'doc1_name': doc1['name'],
-            'doc2_name': doc2['name'],
-            'doc1_text': doc1['text'],
-            'doc2_text': doc2['text'],
-            'doc1_images': doc1.get('images', []),
-            'doc2_images': doc2.get('images', []),
-            'similarity': result['similarity_score'],
-            'matches': result['matches']
-        }
+    for pair_result in iter_pair_results(documents, window=window, use_lsh=use_lsh,
+                                         lsh_bands=lsh_bands, lsh_rows=lsh_rows,
+                                         max_workers=max_workers, detail_threshold=detail_threshold,
+                                         stats=stats):
         pairs.append(pair_result)
         
         # Update matrix (symmetric)
-        matrix[doc1['name']][doc2['name']] = result['similarity_score']
-        matrix[doc2['name']][doc1['name']] = result['similarity_score']
+        matrix[pair_result['doc1_name']][pair_result['doc2_name']] = pair_result['similarity']
+        matrix[pair_result['doc2_name']][pair_result['doc1_name']] = pair_result['similarity']
     
     return {
         'matrix': matrix,
         'pairs': pairs,
-        'document_names': [doc['name'] for doc in documents]
+        'document_names': [doc['name'] for doc in documents],
+        'pruned_pairs': stats['pruned_pairs']
     }
 
 
@@ -83,17 +275,21 @@ def get_suspicious_pairs(pairs, threshold=50):
     return sorted(suspicious, key=lambda x: x['similarity'], reverse=True)
 
 
-def get_comparison_stats(pairs):
+def get_comparison_stats(pairs, pruned_pairs=0):
     """
     Calculate statistics from comparison results.
     
+    Pairs skipped by LSH were not scored; they count as 0% so the statistics
+    cover all n(n-1)/2 pairs of the batch.
+    
     Args:
         pairs: List of pair comparison results
+        pruned_pairs: Number of pairs skipped by LSH
         
     Returns:
         dict with statistics
     """
-    if not pairs:
+    if not pairs and not pruned_pairs:
         return {
             'total_comparisons': 0,
             'avg_similarity': 0,
@@ -104,10 +300,10 @@ def get_comparison_stats(pairs):
             'low_risk_count': 0
         }
     
-    similarities = [p['similarity'] for p in pairs]
+    similarities = [p['similarity'] for p in pairs] + [0.0] * pruned_pairs
     
     return {
-        'total_comparisons': len(pairs),
+        'total_comparisons': len(similarities),
         'avg_similarity': round(sum(similarities) / len(similarities), 1),
         'max_similarity': max(similarities),
         'min_similarity': min(similarities),
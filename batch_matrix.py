@@ -0,0 +1,280 @@
+"""
+Batch Similarity Matrix Module
+
+Scores every document pair of a batch at once with sparse matrix products
+instead of comparing pairs one by one in Python.
+"""
+
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Dense float64 values per scoring block (~32 MB for each of the three arrays)
+SCORE_BLOCK_CELLS = int(os.environ.get('SCORE_BLOCK_CELLS', 4_000_000))
+
+
+def _incidence(rows, keys, n_docs, binary=False):
+    """
+    Build a CSR document x feature matrix.
+
+    Args:
+        rows: Document index per entry
+        keys: Feature key (hash or word ID) per entry, duplicates allowed
+        n_docs: Number of documents (matrix rows)
+        binary: Store 1 per (doc, feature) instead of occurrence counts
+
+    Returns:
+        scipy.sparse.csr_matrix
+    """
+    if len(keys):
+        _, cols = np.unique(keys, return_inverse=True)
+        n_cols = int(cols.max()) + 1
+    else:
+        cols = np.zeros(0, dtype=np.int64)
+        n_cols = 0
+
+    matrix = csr_matrix((np.ones(len(cols), dtype=np.int64), (rows, cols)),
+                        shape=(n_docs, n_cols))
+    matrix.sum_duplicates()
+    if binary:
+        matrix.data[:] = 1
+    return matrix
+
+
+def matrix_features(prepared_docs):
+    """
+    Sparse document x feature matrices shared by all scoring functions.
+
+    Args:
+        prepared_docs: List of profiles from rabin_karp.prepare_document
+
+    Returns:
+        dict: 'counts' (fingerprint occurrences), 'presence' (fingerprint
+        present), 'totals' (fingerprints per document), 'words' (distinct
+        words), 'long_words' (distinct words longer than 3 chars), 'sizes'
+        (distinct words per document)
+    """
+    n = len(prepared_docs)
+
+    # Fingerprints: counts for the suspect side, presence for the source side
+    fp_rows = np.repeat(np.arange(n), [len(p['fingerprints']) for p in prepared_docs])
+    fp_keys = np.concatenate([np.frombuffer(p['fingerprints'], dtype=np.uint64) for p in prepared_docs]
+                             or [np.zeros(0, dtype=np.uint64)])
+    counts = _incidence(fp_rows, fp_keys, n)
+    presence = counts.copy()
+    presence.data[:] = 1
+
+    # Words: all distinct words for the union, long words for the intersection
+    vocabulary = {}
+    word_rows, word_keys, long_rows, long_keys = [], [], [], []
+    for idx, prepared in enumerate(prepared_docs):
+        for word in prepared['word_set']:
+            word_id = vocabulary.setdefault(word, len(vocabulary))
+            word_rows.append(idx)
+            word_keys.append(word_id)
+            if len(word) > 3:
+                long_rows.append(idx)
+                long_keys.append(word_id)
+
+    words = _incidence(np.array(word_rows, dtype=np.int64), np.array(word_keys, dtype=np.int64), n, binary=True)
+    long_words = _incidence(np.array(long_rows, dtype=np.int64), np.array(long_keys, dtype=np.int64), n, binary=True)
+
+    return {
+        'counts': counts,
+        'presence': presence,
+        'totals': np.asarray(counts.sum(axis=1), dtype=np.float64).ravel(),
+        'words': words,
+        'long_words': long_words,
+        'sizes': np.asarray(words.sum(axis=1), dtype=np.float64).ravel()
+    }
+
+
+def _combine(matched, totals, shared_words, shared_long, union):
+    """Rabin-Karp, Jaccard and final similarity from the raw counts (any matching shapes)."""
+    has_fingerprints = np.broadcast_to(totals > 0, matched.shape)
+    rk = np.zeros(matched.shape)
+    rk[has_fingerprints] = (matched / np.where(totals > 0, totals, 1))[has_fingerprints] * 100
+
+    jaccard = np.zeros(matched.shape)
+    nonempty = union > 0
+    jaccard[nonempty] = (shared_long[nonempty] / union[nonempty]) * 100
+
+    similarity = np.maximum(rk, jaccard)
+    similarity[~has_fingerprints] = 0.0
+    return {
+        'rk': rk,
+        'jaccard': jaccard,
+        'similarity': similarity
+    }
+
+
+def score_block(features, suspects=slice(None), sources=slice(None)):
+    """
+    Scores of a block of suspect rows against a block of source columns.
+
+    Args:
+        features: Output of matrix_features
+        suspects: Row selection (slice or index array)
+        sources: Column selection (slice or index array)
+
+    Returns:
+        dict of dense float64 arrays (suspects x sources): 'rk', 'jaccard', 'similarity'
+    """
+    matched = (features['counts'][suspects] @ features['presence'][sources].T).toarray().astype(np.float64)
+    words, long_words, sizes = features['words'], features['long_words'], features['sizes']
+    shared_words = (words[suspects] @ words[sources].T).toarray().astype(np.float64)
+    shared_long = (long_words[suspects] @ long_words[sources].T).toarray().astype(np.float64)
+    union = sizes[suspects][:, None] + sizes[sources][None, :] - shared_words
+    return _combine(matched, features['totals'][suspects][:, None], shared_words, shared_long, union)
+
+
+def score_pairs(features, pairs, block_cells=SCORE_BLOCK_CELLS):
+    """
+    Scores of selected (suspect, source) pairs only.
+
+    Pairs are grouped by blocks of suspect rows; each block is multiplied
+    once against the sources its pairs need (about block_cells dense
+    values), and only the requested cells are kept.
+
+    Args:
+        features: Output of matrix_features
+        pairs: Sequence of (i, j) document index pairs
+        block_cells: Dense values per block
+
+    Returns:
+        dict of 1-D float64 arrays aligned with pairs: 'rk', 'jaccard', 'similarity'
+    """
+    scores = {key: np.zeros(len(pairs)) for key in ('rk', 'jaccard', 'similarity')}
+    if not len(pairs):
+        return scores
+    pair_array = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    suspects, sources = pair_array[:, 0], pair_array[:, 1]
+
+    n = features['counts'].shape[0]
+    block_rows = max(1, block_cells // max(1, n))
+    order = np.argsort(suspects, kind='stable')
+    sorted_suspects = suspects[order]
+    for start in range(0, n, block_rows):
+        stop = min(n, start + block_rows)
+        lo, hi = np.searchsorted(sorted_suspects, [start, stop])
+        if lo == hi:
+            continue
+        selected = order[lo:hi]
+        columns = np.unique(sources[selected])
+        block = score_block(features, slice(start, stop), columns)
+        rows, cols = suspects[selected] - start, np.searchsorted(columns, sources[selected])
+        for key in scores:
+            scores[key][selected] = block[key][rows, cols]
+    return scores
+
+
+def iter_pair_scores(prepared_docs, pairs=None, block_cells=SCORE_BLOCK_CELLS):
+    """
+    Final similarity of document pairs, computed a block at a time.
+
+    Every pair i < j (or only `pairs`) is scored in blocks of suspect rows
+    of about block_cells dense values, so memory stays bounded for large
+    batches.
+
+    Args:
+        prepared_docs: List of profiles from rabin_karp.prepare_document
+        pairs: Optional sorted sequence of (i, j) pairs with i < j
+        block_cells: Dense values per block
+
+    Yields:
+        tuple: (i, j, similarity) in row-major order (not rounded)
+    """
+    n = len(prepared_docs)
+    features = matrix_features(prepared_docs)
+
+    if pairs is None:
+        block_rows = max(1, block_cells // max(1, n))
+        for start in range(0, n, block_rows):
+            stop = min(n, start + block_rows)
+            similarity = score_block(features, slice(start, stop), slice(start, n))['similarity']
+            for i in range(start, stop):
+                row = similarity[i - start]
+                for j in range(i + 1, n):
+                    yield i, j, float(row[j - start])
+        return
+
+    for (i, j), value in zip(pairs, score_pairs(features, pairs, block_cells)['similarity']):
+        yield i, j, float(value)
+
+
+def iter_similarity_rows(prepared_docs, pairs=None, block_cells=SCORE_BLOCK_CELLS):
+    """
+    Rows of the symmetric similarity matrix of a batch, a block of rows at
+    a time (about block_cells dense values per array).
+
+    Cell (i, j) is similarity[min(i, j), max(i, j)], the value
+    compare_all_pairs reports for the pair. With `pairs`, only the columns
+    of those pairs are scored and every other cell is 0.
+
+    Args:
+        prepared_docs: List of profiles from rabin_karp.prepare_document
+        pairs: Optional sequence of (i, j) pairs with i < j
+        block_cells: Dense values per block
+
+    Yields:
+        tuple: (i, float64 array of n values, NaN at i), in row order
+    """
+    n = len(prepared_docs)
+    features = matrix_features(prepared_docs)
+    block_rows = max(1, block_cells // max(1, n))
+
+    neighbours = None
+    if pairs is not None:
+        neighbours = [[] for _ in range(n)]
+        for i, j in pairs:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+
+    for start in range(0, n, block_rows):
+        stop = min(n, start + block_rows)
+        rows = np.arange(start, stop)
+        if neighbours is None:
+            columns = slice(None)
+            column_ids = np.arange(n)
+        else:
+            column_ids = np.unique(np.fromiter((j for i in rows for j in neighbours[i]), dtype=np.int64))
+            columns = column_ids
+
+        # Upper triangle from the block's rows, lower from its columns
+        block = np.zeros((stop - start, n))
+        if len(column_ids):
+            upper = score_block(features, slice(start, stop), columns)['similarity']
+            lower = score_block(features, columns, slice(start, stop))['similarity'].T
+            values = np.where(column_ids[None, :] > rows[:, None], upper, lower)
+            if neighbours is None:
+                block = values
+            else:
+                for i in rows:
+                    kept = np.asarray(neighbours[i], dtype=np.int64)
+                    block[i - start, kept] = values[i - start, np.searchsorted(column_ids, kept)]
+        block[np.arange(stop - start), rows] = np.nan
+
+        for offset, row in enumerate(block):
+            yield start + offset, row
+
+
+def score_matrix(prepared_docs):
+    """
+    Compute the Rabin-Karp, Jaccard and final similarity for all pairs.
+
+    Same formulas as rabin_karp.compare_documents:
+        - rk[i, j]: share of i's fingerprints (with repeats) found in j
+        - jaccard[i, j]: shared words longer than 3 chars / all distinct words
+        - similarity[i, j]: max of both, 0 if i has no fingerprints
+
+    Holds n x n dense arrays; large batches should use iter_pair_scores.
+
+    Args:
+        prepared_docs: List of profiles from rabin_karp.prepare_document
+
+    Returns:
+        dict of n x n float64 arrays: 'rk', 'jaccard', 'similarity'
+        (row = suspect, column = source; not rounded)
+    """
+    return score_block(matrix_features(prepared_docs))
@@ -0,0 +1,277 @@
+"""
+Batch Store Module
+
+Server-side storage of Multi Compare results. Each document of a batch is
+stored once and pairs only reference document positions, so a pair can be
+loaded on its own without reading the whole batch.
+"""
+
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+from database import apply_sqlite_pragmas
+
+DEFAULT_STORE_PATH = 'batches.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    document_count INTEGER NOT NULL,
+    pruned_pairs INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batch_documents (
+    batch_id TEXT NOT NULL REFERENCES batches(id) ON DELETE CASCADE,
+    doc_index INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    text TEXT NOT NULL,
+    processed TEXT,
+    images TEXT NOT NULL,
+    display_images TEXT,
+    word_boxes_path TEXT,
+    PRIMARY KEY (batch_id, doc_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS batch_pairs (
+    batch_id TEXT NOT NULL REFERENCES batches(id) ON DELETE CASCADE,
+    pair_index INTEGER NOT NULL,
+    doc1_index INTEGER NOT NULL,
+    doc2_index INTEGER NOT NULL,
+    similarity REAL NOT NULL,
+    matches TEXT,
+    spans TEXT,
+    longest_match INTEGER,
+    PRIMARY KEY (batch_id, pair_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_batches_user ON batches (user_id, created_at);
+"""
+
+
+def _dumps(value):
+    return None if value is None else json.dumps(value)
+
+
+def _loads(value):
+    return None if value is None else json.loads(value)
+
+
+class BatchStore:
+    """SQLite-backed store of batch comparison results."""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Stores created before display renditions existed
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(batch_documents)')}
+            if 'display_images' not in columns:
+                conn.execute('ALTER TABLE batch_documents ADD COLUMN display_images TEXT')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            apply_sqlite_pragmas(conn)
+            conn.execute('PRAGMA foreign_keys = ON')
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def save(self, documents, results, user_id=None):
+        """
+        Store a batch.
+
+        Args:
+            documents: Documents passed to compare_all_pairs (with 'processed')
+            results: Output of compare_all_pairs
+            user_id: Owner of the batch
+
+        Returns:
+            str: Batch ID
+        """
+        batch_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO batches (id, user_id, document_count, pruned_pairs, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (batch_id, user_id, len(documents), results.get('pruned_pairs', 0), time.time())
+            )
+            conn.executemany(
+                'INSERT INTO batch_documents (batch_id, doc_index, name, text, processed, images, '
+                'display_images, word_boxes_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((batch_id, idx, doc['name'], doc['text'], doc.get('processed'),
+                  json.dumps(doc.get('images', [])), json.dumps(doc.get('display_images', [])),
+                  doc.get('word_boxes_path'))
+                 for idx, doc in enumerate(documents))
+            )
+            conn.executemany(
+                'INSERT INTO batch_pairs (batch_id, pair_index, doc1_index, doc2_index, similarity, '
+                'matches, spans, longest_match) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((batch_id, idx, pair['doc1_index'], pair['doc2_index'], pair['similarity'],
+                  _dumps(pair['matches']), _dumps(pair['spans']), pair['longest_match'])
+                 for idx, pair in enumerate(results['pairs']))
+            )
+        return batch_id
+
+    def summary(self, batch_id):
+        """
+        Load a batch for the overview page, without document texts or matches.
+
+        Returns:
+            dict shaped like compare_all_pairs output ('matrix', 'pairs',
+            'document_names', 'pruned_pairs'; pairs only carry names and
+            similarity), or None for unknown batches.
+        """
+        with self._connect() as conn:
+            batch = conn.execute(
+                'SELECT user_id, pruned_pairs FROM batches WHERE id = ?', (batch_id,)
+            ).fetchone()
+            if batch is None:
+                return None
+            names = [row[0] for row in conn.execute(
+                'SELECT name FROM batch_documents WHERE batch_id = ? ORDER BY doc_index', (batch_id,)
+            )]
+            rows = conn.execute(
+                'SELECT doc1_index, doc2_index, similarity FROM batch_pairs '
+                'WHERE batch_id = ? ORDER BY pair_index', (batch_id,)
+            ).fetchall()
+
+        matrix = {name: {other: (None if name == other else 0) for other in names} for name in names}
+        pairs = []
+        for doc1_index, doc2_index, similarity in rows:
+            doc1_name, doc2_name = names[doc1_index], names[doc2_index]
+            matrix[doc1_name][doc2_name] = similarity
+            matrix[doc2_name][doc1_name] = similarity
+            pairs.append({
+                'doc1_name': doc1_name,
+                'doc2_name': doc2_name,
+                'doc1_index': doc1_index,
+                'doc2_index': doc2_index,
+                'similarity': similarity
+            })
+
+        return {
+            'user_id': batch[0],
+            'matrix': matrix,
+            'pairs': pairs,
+            'document_names': names,
+            'pruned_pairs': batch[1]
+        }
+
+    def owner(self, batch_id):
+        """User ID of a batch's owner, or None for unknown batches."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT user_id FROM batches WHERE id = ?', (batch_id,)).fetchone()
+        return row[0] if row else None
+
+    def batch_ids(self):
+        """IDs of every stored batch."""
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute('SELECT id FROM batches')}
+
+    def delete_older_than(self, cutoff):
+        """
+        Delete batches created before `cutoff` (epoch seconds), with their
+        documents and pairs.
+
+        Returns:
+            list: IDs of the deleted batches
+        """
+        with self._connect() as conn:
+            batch_ids = [row[0] for row in conn.execute(
+                'SELECT id FROM batches WHERE created_at < ?', (cutoff,)
+            )]
+            conn.executemany('DELETE FROM batches WHERE id = ?', ((batch_id,) for batch_id in batch_ids))
+        return batch_ids
+
+    def get_pair(self, batch_id, pair_index):
+        """
+        Load one pair with both documents, in the shape of a compare_all_pairs
+        pair (plus 'doc1_processed'/'doc2_processed' and the display
+        renditions 'doc1_display_images'/'doc2_display_images').
+
+        Returns:
+            dict, or None if the pair does not exist
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT doc1_index, doc2_index, similarity, matches, spans, longest_match '
+                'FROM batch_pairs WHERE batch_id = ? AND pair_index = ?', (batch_id, pair_index)
+            ).fetchone()
+            if row is None:
+                return None
+            doc1_index, doc2_index, similarity, matches, spans, longest_match = row
+            docs = {
+                idx: (name, text, processed, json.loads(images), _loads(display_images) or [], word_boxes_path)
+                for idx, name, text, processed, images, display_images, word_boxes_path in conn.execute(
+                    'SELECT doc_index, name, text, processed, images, display_images, word_boxes_path '
+                    'FROM batch_documents WHERE batch_id = ? AND doc_index IN (?, ?)',
+                    (batch_id, doc1_index, doc2_index)
+                )
+            }
+
+        pair = {
+            'doc1_index': doc1_index,
+            'doc2_index': doc2_index,
+            'similarity': similarity,
+            'matches': _loads(matches),
+            'spans': _loads(spans),
+            'longest_match': longest_match
+        }
+        for prefix, idx in (('doc1', doc1_index), ('doc2', doc2_index)):
+            name, text, processed, images, display_images, word_boxes_path = docs[idx]
+            pair.update({
+                f'{prefix}_name': name,
+                f'{prefix}_text': text,
+                f'{prefix}_processed': processed,
+                f'{prefix}_images': images,
+                f'{prefix}_display_images': display_images,
+                f'{prefix}_word_boxes': word_boxes_path
+            })
+        return pair
+
+    def get_page(self, batch_id, pair_index, doc, page):
+        """
+        What highlighting one page image of a pair needs, without loading
+        the document texts.
+
+        Args:
+            doc: 1 for the pair's first document, 2 for the second
+            page: Page index
+
+        Returns:
+            dict with 'image' (raw page path), 'word_boxes_path' and 'matches'
+            (None if the pair has no details yet), or None if the pair,
+            document or page does not exist
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT p.matches, d.images, d.word_boxes_path FROM batch_pairs p '
+                'JOIN batch_documents d ON d.batch_id = p.batch_id '
+                'AND d.doc_index = CASE ? WHEN 1 THEN p.doc1_index ELSE p.doc2_index END '
+                'WHERE p.batch_id = ? AND p.pair_index = ?', (doc, batch_id, pair_index)
+            ).fetchone()
+        if row is None:
+            return None
+        matches, images, word_boxes_path = row
+        images = json.loads(images)
+        if not 0 <= page < len(images):
+            return None
+        return {
+            'image': images[page],
+            'word_boxes_path': word_boxes_path,
+            'matches': _loads(matches)
+        }
+
+    def save_pair_details(self, batch_id, pair_index, pair):
+        """Persist matches/spans computed later for a pair (see ensure_pair_details)."""
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE batch_pairs SET matches = ?, spans = ?, longest_match = ? '
+                'WHERE batch_id = ? AND pair_index = ?',
+                (_dumps(pair['matches']), _dumps(pair['spans']), pair['longest_match'], batch_id, pair_index)
+            )
@@ -0,0 +1,106 @@
+"""
+Benchmark of the text highlighter on a large document.
+
+Compares the former regex-alternation highlighter with the word-set scan in
+text_highlighter.highlight_text_matches (output must be identical) and with
+the span highlighter (highlight_text_spans) used by the app.
+
+Usage: python benchmark_highlighter.py [number_of_words]
+"""
+
+import contextlib
+import io
+import random
+import re
+import sys
+import time
+from html import escape
+
+from preprocessing import preprocess_with_offsets
+from rabin_karp import detect_plagiarism
+from text_highlighter import highlight_text_matches, highlight_text_spans, merge_overlapping_ranges
+
+SYLLABLES = ['ba', 'ka', 'ma', 'ta', 'ra', 'si', 'li', 'ni', 'tu', 'ru', 'lo', 'no', 'de', 'ge', 'pa', 'ja']
+
+
+def regex_highlight_text_matches(original_text, matches):
+    """The previous implementation: one big \\b(w1|w2|...)\\b alternation."""
+    matched_words = set()
+    for match in matches:
+        matched_words.update(match.lower().split())
+    if not matched_words:
+        return escape(original_text)
+
+    pattern_words = '|'.join(re.escape(word) for word in matched_words)
+    pattern = rf'\b({pattern_words})\b'
+    highlights = [(m.start(), m.end()) for m in re.finditer(pattern, original_text, re.IGNORECASE)]
+    highlights = merge_overlapping_ranges(highlights)
+
+    result = []
+    last_end = 0
+    for start, end in sorted(highlights):
+        if start > last_end:
+            result.append(escape(original_text[last_end:start]))
+        result.append(f'<mark class="plagiarism-highlight">{escape(original_text[start:end])}</mark>')
+        last_end = end
+    if last_end < len(original_text):
+        result.append(escape(original_text[last_end:]))
+    return ''.join(result)
+
+
+def build_texts(n_words, seed=42):
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(20000)]
+
+    def sentence_words(n):
+        words = [rng.choice(vocabulary) for _ in range(n)]
+        words[0] = words[0].capitalize()
+        return words
+
+    suspect = []
+    while len(suspect) < n_words:
+        suspect.extend(sentence_words(rng.randint(8, 20)))
+        suspect[-1] += '.'
+    # The source copies every third sentence-sized chunk of the suspect
+    source = []
+    for start in range(0, len(suspect), 45):
+        source.extend(suspect[start:start + 15])
+        source.extend(sentence_words(15))
+    return ' '.join(suspect), ' '.join(source)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = func(*args)
+    return value, time.perf_counter() - start
+
+
+def main():
+    n_words = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    suspect, source = build_texts(n_words)
+
+    suspect_preprocessed, preprocess_time = timed(preprocess_with_offsets, suspect)
+    suspect_tokens = suspect_preprocessed[0]
+    source_tokens, _ = preprocess_with_offsets(source)
+    result, _ = timed(detect_plagiarism, ' '.join(suspect_tokens), ' '.join(source_tokens), 3, None, True)
+    matched_words = {w for m in result['matches'] for w in m.split()}
+    print(f"{len(suspect.split())} words, {len(result['matches'])} matched k-grams, "
+          f"{len(matched_words)} distinct matched words, {len(result['spans'])} spans")
+
+    regex_html, regex_time = timed(regex_highlight_text_matches, suspect, result['matches'])
+    scan_html, scan_time = timed(highlight_text_matches, suspect, result['matches'])
+    spans_html, spans_time = timed(highlight_text_spans, suspect, result['spans'], 'suspect',
+                                   result['matches'], suspect_preprocessed)
+
+    print(f"regex alternation:             {regex_time:8.3f}s")
+    print(f"word-set scan:                 {scan_time:8.3f}s  (identical output: {scan_html == regex_html})")
+    print(f"token spans (preprocessed):    {spans_time:8.3f}s  "
+          f"({spans_html.count('<mark')} highlighted passages)")
+    print(f"  preprocess_with_offsets:     {preprocess_time:8.3f}s  (done once per check anyway)")
+    if scan_html != regex_html:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
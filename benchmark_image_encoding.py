@@ -0,0 +1,82 @@
+"""
+Benchmark of page image encoding.
+
+Compares the former synchronous full-resolution PNG save per page with the
+ImageEncoder thread pool (full-resolution PNG plus a display rendition), on
+synthetic 200-DPI A4 pages with text-like content.
+
+Usage: python benchmark_image_encoding.py [pages] [threads]
+"""
+
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageChops, ImageDraw
+
+from image_encoding import DISPLAY_IMAGE_FORMAT, DISPLAY_IMAGE_WIDTH, IMAGE_ENCODE_THREADS, ImageEncoder
+from upload_store import UploadStore
+
+PAGE_SIZE = (1654, 2339)  # A4 at 200 DPI
+
+
+def build_page(seed):
+    rng = random.Random(seed)
+    page = Image.new('RGB', PAGE_SIZE, 'white')
+    draw = ImageDraw.Draw(page)
+    for y in range(150, PAGE_SIZE[1] - 150, 42):
+        x = 150
+        while x < PAGE_SIZE[0] - 250:
+            width = rng.randint(30, 140)
+            draw.rectangle((x, y, x + width, y + 22), fill=(rng.randint(0, 60),) * 3)
+            x += width + rng.randint(12, 24)
+    # Paper grain, as in real scans, keeps the page from compressing unrealistically well
+    grain = Image.effect_noise(PAGE_SIZE, 6).convert('RGB')
+    return ImageChops.subtract(page, grain, 1, 0)
+
+
+def main():
+    n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else IMAGE_ENCODE_THREADS
+    pages = [build_page(seed) for seed in range(n_pages)]
+    tmp_dir = tempfile.mkdtemp()
+
+    start = time.perf_counter()
+    png_bytes = 0
+    for idx, page in enumerate(pages):
+        path = os.path.join(tmp_dir, f'page_{idx}.png')
+        page.save(path, 'PNG')
+        png_bytes += os.path.getsize(path)
+    sync_time = time.perf_counter() - start
+
+    store = UploadStore(os.path.join(tmp_dir, 'uploads.db'), static_dir=tmp_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        with ImageEncoder(store, max_workers=threads) as encoder:
+            futures = []
+            for page in pages:
+                futures.append(encoder.submit(page))
+                futures.append(encoder.submit(page, display=True))
+            # What the job itself waits for: only submitting (the pool bounds memory)
+            submit_time = time.perf_counter() - start
+        paths = [future.result() for future in futures]
+        pool_time = time.perf_counter() - start
+    stats = encoder.stats()
+
+    print(f"{n_pages} pages of {PAGE_SIZE[0]}x{PAGE_SIZE[1]}, {threads} encoding threads, "
+          f"display rendition {DISPLAY_IMAGE_FORMAT} at {DISPLAY_IMAGE_WIDTH}px")
+    print(f"synchronous PNG saves:        {sync_time:8.3f}s  {png_bytes / n_pages / 1024:8.0f} KB/page")
+    print(f"thread pool (PNG + display):  {pool_time:8.3f}s  "
+          f"({stats['encode_seconds']:.3f}s thread time, job blocked {submit_time:.3f}s while submitting)")
+    print(f"  display rendition:          {stats['display_bytes'] / n_pages / 1024:17.0f} KB/page "
+          f"({stats['display_bytes'] / max(1, stats['full_bytes']) * 100:.1f}% of the PNG)")
+    if len(set(paths)) != 2 * n_pages:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Concurrent-writer benchmark for the SQLite connection settings.
+
+Several processes update rows (like last_login, job progress and check
+results do) while others read, once with SQLite's defaults (rollback
+journal, synchronous=FULL, 5 s lock timeout) and once with the tuned
+settings from database.SQLITE_PRAGMAS.
+
+Usage: python benchmark_sqlite.py [writers] [readers] [seconds]
+"""
+
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from database import apply_sqlite_pragmas
+
+ROWS = 1000
+
+
+def setup(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE jobs (id INTEGER PRIMARY KEY, progress REAL, message TEXT, updated_at REAL)')
+    conn.executemany('INSERT INTO jobs VALUES (?, 0, ?, 0)', ((i, 'queued') for i in range(ROWS)))
+    conn.commit()
+    conn.close()
+
+
+def connect(path, tuned):
+    conn = sqlite3.connect(path, timeout=30 if tuned else 5)
+    if tuned:
+        apply_sqlite_pragmas(conn)
+    return conn
+
+
+def writer(path, tuned, seconds, seed, results):
+    conn = connect(path, tuned)
+    done = errors = 0
+    i = seed
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        i = (i * 7919 + 1) % ROWS
+        try:
+            conn.execute('UPDATE jobs SET progress = progress + 1, message = ?, updated_at = ? WHERE id = ?',
+                         ('running', time.time(), i))
+            conn.commit()
+            done += 1
+        except sqlite3.OperationalError:
+            # "database is locked"
+            conn.rollback()
+            errors += 1
+    conn.close()
+    results.put(('write', done, errors))
+
+
+def reader(path, tuned, seconds, results):
+    conn = connect(path, tuned)
+    done = errors = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        try:
+            conn.execute('SELECT COUNT(*), SUM(progress) FROM jobs WHERE message = ?', ('running',)).fetchone()
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    conn.close()
+    results.put(('read', done, errors))
+
+
+def run(tuned, writers, readers, seconds):
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'bench.db')
+    setup(path)
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer, args=(path, tuned, seconds, n, results))
+                 for n in range(writers)]
+    processes += [multiprocessing.Process(target=reader, args=(path, tuned, seconds, results))
+                  for _ in range(readers)]
+    for p in processes:
+        p.start()
+    totals = {'write': [0, 0], 'read': [0, 0]}
+    for _ in processes:
+        kind, done, errors = results.get()
+        totals[kind][0] += done
+        totals[kind][1] += errors
+    for p in processes:
+        p.join()
+
+    label = 'tuned  ' if tuned else 'default'
+    print(f"{label}: {totals['write'][0] / seconds:9.0f} writes/s ({totals['write'][1]} lock errors), "
+          f"{totals['read'][0] / seconds:9.0f} reads/s ({totals['read'][1]} lock errors)")
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f"{writers} writer and {readers} reader processes, {seconds:g}s each")
+    run(False, writers, readers, seconds)
+    run(True, writers, readers, seconds)
+
+
+if __name__ == '__main__':
+    main()
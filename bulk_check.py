@@ -0,0 +1,248 @@
+"""
+Bulk Checker
+
+Command-line Multi Compare for whole directories, without the web server
+or the /batch upload limit. Files are extracted and preprocessed across a
+process pool, all pairs are scored with the batch engine, and the
+similarity matrix and suspicious pairs are written to CSV and JSON. The
+matrix is scored in row blocks and written row by row, so memory does not
+grow with the square of the number of files.
+
+Extraction results (including the preprocessed text) go through the
+extraction cache, so an interrupted or repeated run skips OCR and
+stemming for every file it has already seen.
+
+Usage:
+    python bulk_check.py submissions/ -o reports/2024-ganjil
+    python bulk_check.py "submissions/**/*.pdf" --threshold 40 --workers 8 --lsh
+"""
+
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.datastructures import FileStorage
+
+
+def find_files(patterns, recursive=True):
+    """
+    Files matched by directories or glob patterns, with unique display names.
+
+    Returns:
+        list of (path, name) sorted by name; names are relative to the
+        directory (or glob base) they were found in
+    """
+    from file_parser import allowed_file
+
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            base = pattern
+            paths = glob.glob(os.path.join(pattern, '**', '*') if recursive else os.path.join(pattern, '*'),
+                              recursive=recursive)
+        else:
+            base = os.path.dirname(pattern.split('*', 1)[0]) or '.'
+            paths = glob.glob(pattern, recursive=True)
+        for path in paths:
+            if os.path.isfile(path) and allowed_file(path):
+                found.setdefault(os.path.abspath(path), os.path.relpath(path, base))
+
+    # Same relative name under two inputs: fall back to the full path
+    name_counts = Counter(found.values())
+    return sorted(((path, path if name_counts[name] > 1 else name) for path, name in found.items()),
+                  key=lambda item: item[1])
+
+
+def _extract_and_preprocess(path, name):
+    """Worker: extraction (cached) plus preprocessing, stored back into the cache."""
+    from file_parser import extract_text_and_images_from_file, cache_processed_text
+    from preprocessing import preprocess_text, save_stem_cache
+
+    try:
+        with open(path, 'rb') as stream:
+            data = extract_text_and_images_from_file(FileStorage(stream=stream, filename=os.path.basename(path)))
+        processed = data.get('processed')
+        if data['text'] and processed is None:
+            processed = preprocess_text(data['text'])
+            cache_processed_text(data, processed)
+    except Exception as e:
+        return {'name': name, 'error': str(e)}
+    finally:
+        # Pool children never run atexit hooks
+        save_stem_cache()
+
+    return {
+        'name': name,
+        'text': data['text'],
+        'processed': processed,
+        'cache_hit': data.get('cache_hit', False)
+    }
+
+
+def extract_all(files, workers=None, progress_every=25):
+    """
+    Extract and preprocess files in a process pool, keeping input order.
+
+    Returns:
+        tuple: (documents for compare_all_pairs, list of skipped {'name', 'error'},
+                number of extraction cache hits)
+    """
+    documents = []
+    skipped = []
+    cache_hits = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_extract_and_preprocess, [path for path, _ in files], [name for _, name in files])
+        for count, result in enumerate(results, 1):
+            if result.get('error') or not result.get('processed'):
+                skipped.append({'name': result['name'], 'error': result.get('error') or 'No extractable text'})
+            else:
+                cache_hits += result['cache_hit']
+                documents.append({'name': result['name'], 'text': result['text'],
+                                  'processed': result['processed']})
+            if count % progress_every == 0 or count == len(files):
+                elapsed = time.perf_counter() - start
+                print(f"[extract] {count}/{len(files)} files, {count / elapsed:.1f} docs/s, "
+                      f"{cache_hits} cached", file=sys.stderr)
+
+    return documents, skipped, cache_hits
+
+
+def write_pairs_csv(path, pairs):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['doc1', 'doc2', 'similarity', 'longest_match', 'match_count'])
+        for pair in pairs:
+            writer.writerow([pair['doc1_name'], pair['doc2_name'], pair['similarity'],
+                             pair['longest_match'], len(pair['matches'] or [])])
+
+
+def run(args):
+    if args.cache_dir:
+        # Read by file_parser at import time, in this process and the workers
+        os.environ['EXTRACTION_CACHE_DIR'] = args.cache_dir
+
+    from batch_comparison import prepare_documents, find_candidate_pairs, get_pair_details, get_suspicious_pairs
+    from batch_matrix import iter_similarity_rows
+
+    started = time.perf_counter()
+    files = find_files(args.inputs, recursive=not args.no_recursive)
+    if len(files) < 2:
+        print(f"Need at least 2 supported files, found {len(files)}.", file=sys.stderr)
+        return 1
+    print(f"[extract] {len(files)} files with {args.workers or os.cpu_count()} processes", file=sys.stderr)
+
+    documents, skipped, cache_hits = extract_all(files, workers=args.workers)
+    extract_seconds = time.perf_counter() - started
+    for doc in skipped:
+        print(f"[skip] {doc['name']}: {doc['error']}", file=sys.stderr)
+    if len(documents) < 2:
+        print('Need at least 2 documents with extractable text.', file=sys.stderr)
+        return 1
+
+    compare_start = time.perf_counter()
+    n = len(documents)
+    names = [doc['name'] for doc in documents]
+    prepare_documents(documents, k=3, window=args.window or None, max_workers=args.workers)
+    prepared = [doc['prepared'] for doc in documents]
+    total_pairs = n * (n - 1) // 2
+    index_pairs = sorted(find_candidate_pairs(prepared, bands=args.lsh_bands, rows=args.lsh_rows)) \
+        if args.lsh else None
+    pair_count = total_pairs if index_pairs is None else len(index_pairs)
+
+    # The matrix is scored in row blocks and written row by row; only pairs
+    # at or above the threshold are kept in memory
+    os.makedirs(args.output, exist_ok=True)
+    suspicious = []
+    with contextlib.ExitStack() as outputs:
+        matrix_csv = results_json = None
+        if args.format in ('csv', 'both'):
+            matrix_csv = csv.writer(outputs.enter_context(
+                open(os.path.join(args.output, 'matrix.csv'), 'w', newline='', encoding='utf-8')))
+            matrix_csv.writerow([''] + names)
+        if args.format in ('json', 'both'):
+            results_json = outputs.enter_context(
+                open(os.path.join(args.output, 'results.json'), 'w', encoding='utf-8'))
+            results_json.write(f'{{"document_names": {json.dumps(names, ensure_ascii=False)}, "matrix": [')
+
+        for i, row in iter_similarity_rows(prepared, pairs=index_pairs):
+            values = [None if j == i else round(float(value), 2) for j, value in enumerate(row)]
+            if matrix_csv:
+                matrix_csv.writerow([names[i]] + ['' if value is None else value for value in values])
+            if results_json:
+                results_json.write((', ' if i else '') + json.dumps(values))
+            for j in range(i + 1, n):
+                if values[j] >= args.threshold:
+                    suspicious.append({'doc1_name': names[i], 'doc2_name': names[j],
+                                       'doc1_index': i, 'doc2_index': j, 'similarity': values[j]})
+
+        # Only suspicious pairs need matches (for longest_match)
+        suspicious = get_suspicious_pairs(suspicious, threshold=args.threshold)
+        for pair in suspicious:
+            pair.update(get_pair_details(prepared[pair['doc1_index']], prepared[pair['doc2_index']]))
+        compare_seconds = time.perf_counter() - compare_start
+        total_seconds = time.perf_counter() - started
+
+        summary = {
+            'files': len(files),
+            'documents': n,
+            'skipped': skipped,
+            'extraction_cache_hits': cache_hits,
+            'pairs': pair_count,
+            'pruned_pairs': total_pairs - pair_count,
+            'suspicious_pairs': len(suspicious),
+            'threshold': args.threshold,
+            'extract_seconds': round(extract_seconds, 3),
+            'compare_seconds': round(compare_seconds, 3),
+            'total_seconds': round(total_seconds, 3),
+            'docs_per_second': round(len(files) / total_seconds, 2)
+        }
+
+        if matrix_csv:
+            write_pairs_csv(os.path.join(args.output, 'suspicious_pairs.csv'), suspicious)
+        if results_json:
+            results_json.write('], "summary": ' + json.dumps(summary, ensure_ascii=False) + ', "suspicious": ')
+            json.dump([{
+                'doc1': pair['doc1_name'],
+                'doc2': pair['doc2_name'],
+                'similarity': pair['similarity'],
+                'longest_match': pair['longest_match'],
+                'matches': pair['matches']
+            } for pair in suspicious], results_json, ensure_ascii=False)
+            results_json.write('}')
+
+    print(f"[done] {n} documents ({cache_hits} from cache, {len(skipped)} skipped), "
+          f"{pair_count} pairs, {len(suspicious)} suspicious (>= {args.threshold}%)", file=sys.stderr)
+    print(f"[done] extract {extract_seconds:.1f}s ({len(files) / extract_seconds:.1f} docs/s), "
+          f"compare {compare_seconds:.1f}s, total {total_seconds:.1f}s "
+          f"({summary['docs_per_second']} docs/s) -> {args.output}", file=sys.stderr)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare every pair of documents in a directory.')
+    parser.add_argument('inputs', nargs='+', help='Directories or glob patterns (quote globs)')
+    parser.add_argument('-o', '--output', default='bulk_check_output', help='Output directory')
+    parser.add_argument('--format', choices=('csv', 'json', 'both'), default='both')
+    parser.add_argument('--threshold', type=float, default=50, help='Minimum similarity of suspicious pairs')
+    parser.add_argument('--workers', type=int, default=None, help='Processes (default: CPU count)')
+    parser.add_argument('--window', type=int, default=int(os.environ.get('WINNOW_WINDOW', 0)),
+                        help='Winnowing window (0 = every k-gram)')
+    parser.add_argument('--lsh', action='store_true', help='Only score MinHash/LSH candidate pairs')
+    parser.add_argument('--lsh-bands', type=int, default=128)
+    parser.add_argument('--lsh-rows', type=int, default=2)
+    parser.add_argument('--cache-dir', help='Extraction cache directory (default: EXTRACTION_CACHE_DIR)')
+    parser.add_argument('--no-recursive', action='store_true', help='Do not descend into subdirectories')
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,556 @@
+"""
+Checks Module
+
+The actual work behind the Compare and Multi Compare pages: extraction,
+preprocessing, detection, corpus lookups and image highlighting. Runs in
+the background job workers (see job_queue), outside the web request.
+"""
+
+import os
+import shutil
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from html import escape
+
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+from preprocessing import preprocess_with_offsets
+from rabin_karp import detect_plagiarism
+from corpus_index import CorpusIndex
+from upload_store import UPLOAD_GC_INTERVAL
+
+JOB_UPLOAD_DIR = os.environ.get('JOB_UPLOAD_DIR', os.path.join('uploads', 'jobs'))
+
+# Batches and history checks older than this are deleted by the upload
+# sweep, which then frees their page images (0 = keep forever)
+RESULT_RETENTION_DAYS = float(os.environ.get('RESULT_RETENTION_DAYS', 90))
+
+
+def save_uploads(file_storages):
+    """
+    Save uploaded files so a worker process can read them later.
+
+    Returns:
+        tuple: (upload_dir, list of {'path', 'filename'} in upload order)
+    """
+    upload_dir = os.path.join(JOB_UPLOAD_DIR, uuid.uuid4().hex)
+    os.makedirs(upload_dir, exist_ok=True)
+
+    saved = []
+    for idx, f in enumerate(file_storages):
+        path = os.path.join(upload_dir, f"{idx}_{secure_filename(f.filename) or 'upload'}")
+        f.save(path)
+        saved.append({'path': path, 'filename': f.filename})
+    return upload_dir, saved
+
+
+def _extract_upload(upload):
+    from file_parser import extract_text_and_images_from_file
+
+    with open(upload['path'], 'rb') as stream:
+        return extract_text_and_images_from_file(FileStorage(stream=stream, filename=upload['filename']))
+
+
+def _truncation_warning(data):
+    """Flash message for a document cut off at OCR_MAX_PAGES, or None."""
+    if not (data and data.get('truncated')):
+        return None
+    return ('warning', f"{data['filename']}: hanya {len(data['images'])} halaman pertama dari "
+                       f"{data['total_pages']} halaman yang diperiksa (batas halaman per dokumen).")
+
+
+def _get_corpus_index(options):
+    return CorpusIndex(options['corpus_index_path'], k=3, window=options['window'])
+
+
+def _no_progress(percent, message=None):
+    pass
+
+
+def _preprocess(data):
+    """
+    Preprocessed text of an extraction result, plus the (tokens, offsets)
+    from preprocess_with_offsets (None when the preprocessed text came from
+    the cache).
+    """
+    if data.get('processed'):
+        return data['processed'], None
+    preprocessed = preprocess_with_offsets(data['text'])
+    return ' '.join(preprocessed[0]), preprocessed
+
+
+def _app_context(options):
+    """Application context for using the models from a worker process."""
+    from database import get_worker_app
+    return get_worker_app(options['database_uri']).app_context()
+
+
+def _report_encoding(encoder):
+    stats = encoder.stats()
+    pages = stats['full_pages'] + stats['display_pages']
+    if pages:
+        print(f"DEBUG: Encoded {pages} page images in {stats['encode_seconds']}s of thread time "
+              f"({stats['wall_seconds']}s wall, {stats['wait_seconds']}s waiting for the pool): "
+              f"{stats['full_bytes'] / 1024:.0f} KB full resolution, "
+              f"{stats['display_bytes'] / 1024:.0f} KB display")
+    return stats
+
+
+def run_compare(suspect_data, source_data, user_id, options, progress=_no_progress, job_id=None):
+    """
+    Compare a suspect document against a source document.
+
+    Args:
+        suspect_data, source_data: Extraction results (or {'text', 'images',
+                                   'filename'} for pasted text)
+        user_id: Owner of the check
+        options: Detection settings from the app config
+        progress: Callback(percent, message)
+        job_id: Queue job running the check (stored with it)
+
+    Returns:
+        dict: Template context for dashboard.html plus 'messages', a list of
+              (category, message) to flash.
+    """
+    from file_parser import cache_processed_text
+    from highlight_visualizer import iter_highlighted_images
+    from text_highlighter import highlight_text_spans
+    from image_encoding import ImageEncoder
+    from upload_store import UploadStore, check_owner
+
+    context = {
+        'result': None,
+        'suspect_images': [],
+        'source_images': [],
+        'suspect_highlighted': '',
+        'source_highlighted': '',
+        'corpus_matches': [],
+        'messages': []
+    }
+
+    if not (suspect_data and source_data and suspect_data['text'] and source_data['text']):
+        context['messages'].append(('error', 'Mohon masukkan teks atau unggah file untuk kedua kolom.'))
+        if not suspect_data or not suspect_data['text']:
+            context['messages'].append(('error', 'Gagal mengekstrak teks dari Suspect File.'))
+        if not source_data or not source_data['text']:
+            context['messages'].append(('error', 'Gagal mengekstrak teks dari Source File.'))
+        return context
+
+    for data in (suspect_data, source_data):
+        warning = _truncation_warning(data)
+        if warning:
+            context['messages'].append(warning)
+
+    # Store original texts for display
+    suspect_original = suspect_data['text']
+    source_original = source_data['text']
+
+    # Preprocess (skipped for files whose preprocessed text is cached)
+    progress(70, 'Memproses teks...')
+    suspect_processed, suspect_tokens = _preprocess(suspect_data)
+    source_processed, source_tokens = _preprocess(source_data)
+    cache_processed_text(suspect_data, suspect_processed)
+    cache_processed_text(source_data, source_processed)
+
+    print(f"DEBUG: Suspect Processed Length: {len(suspect_processed)}")
+    print(f"DEBUG: Source Processed Length: {len(source_processed)}")
+
+    if not suspect_processed or not source_processed:
+        context['messages'].append(('error', 'Teks tidak terbaca dari file.'))
+        return context
+
+    # Detect plagiarism
+    progress(80, 'Mendeteksi kemiripan...')
+    result = detect_plagiarism(suspect_processed, source_processed, k=3,
+                               window=options['window'],
+                               return_spans=True)
+    context['result'] = result
+
+    # Check the suspect against every earlier submission, then index both documents
+    corpus_index = _get_corpus_index(options)
+    context['corpus_matches'] = corpus_index.query(suspect_processed)
+    corpus_index.add_document(suspect_data['filename'], suspect_processed, owner_id=user_id)
+    corpus_index.add_document(source_data['filename'], source_processed, owner_id=user_id)
+
+    # Generate highlighted text for visual comparison
+    if result['matches']:
+        context['suspect_highlighted'] = highlight_text_spans(suspect_original, result['spans'], 'suspect',
+                                                              result['matches'], suspect_tokens)
+        context['source_highlighted'] = highlight_text_spans(source_original, result['spans'], 'source',
+                                                             result['matches'], source_tokens)
+    else:
+        context['suspect_highlighted'] = escape(suspect_original)
+        context['source_highlighted'] = escape(source_original)
+
+    # Highlight images if available; pages are encoded as display renditions
+    # in background threads while the next page is being highlighted
+    store = UploadStore(options['upload_store_path'])
+    with ImageEncoder(store) as encoder:
+        pending = {'suspect_images': [], 'source_images': []}
+        for prefix, data, key in (('suspect', suspect_data, 'suspect_images'),
+                                  ('source', source_data, 'source_images')):
+            if not (data['images'] and result['matches']):
+                continue
+            progress(90, 'Menandai halaman dokumen...')
+            print(f"DEBUG: Highlighting {len(data['images'])} {prefix} images...")
+            highlighted = iter_highlighted_images(
+                data['images'],
+                result['matches'],
+                word_boxes=data.get('word_boxes')
+            )
+            for img in highlighted:
+                pending[key].append(encoder.submit(img, display=True))
+    for key, futures in pending.items():
+        context[key] = [future.result() for future in futures]
+    _report_encoding(encoder)
+
+    # Keep the check so it can be reopened from the history page
+    from history import save_documents, record_check
+    with _app_context(options):
+        suspect_doc, source_doc = save_documents(user_id, [
+            {'name': suspect_data['filename'], 'text': suspect_original, 'processed': suspect_processed},
+            {'name': source_data['filename'], 'text': source_original, 'processed': source_processed}
+        ], k=3, window=options['window'])
+        check = record_check(user_id, 'compare', f"{suspect_data['filename']} vs {source_data['filename']}",
+                             similarity_score=result['similarity_score'],
+                             result={key: value for key, value in context.items() if key != 'messages'},
+                             suspect_document=suspect_doc, source_document=source_doc, job_id=job_id)
+        store.add_references(check_owner(check.id), context['suspect_images'] + context['source_images'])
+
+    return context
+
+
+def run_batch(uploads, user_id, options, progress=_no_progress, job_id=None):
+    """
+    Extract every uploaded document and compare all pairs.
+
+    Args:
+        uploads: List of {'path', 'filename'} from save_uploads
+        user_id: Owner of the check
+        options: Detection settings from the app config
+        progress: Callback(percent, message)
+        job_id: Queue job running the check (stored with it)
+
+    Returns:
+        dict: 'batch_id' (results saved in the batch store, or None if fewer
+              than two documents had text) and 'messages' to flash.
+    """
+    from batch_comparison import compare_all_pairs
+    from batch_store import BatchStore
+    from file_parser import cache_processed_text
+    from highlight_visualizer import dump_word_boxes
+    from image_encoding import ImageEncoder
+    from upload_store import UploadStore, batch_owner
+
+    messages = []
+    documents = []
+    extracted = []
+    store = UploadStore(options['upload_store_path'])
+    # Page images are encoded in background threads while the next upload is extracted
+    with ImageEncoder(store) as encoder:
+        for idx, upload in enumerate(uploads):
+            progress(idx / len(uploads) * 70, f"Mengekstrak {upload['filename']} ({idx + 1}/{len(uploads)})...")
+            data = _extract_upload(upload)
+            if not (data and data['text']):
+                messages.append(('error', f"Could not extract text from: {upload['filename']}"))
+                continue
+            warning = _truncation_warning(data)
+            if warning:
+                messages.append(warning)
+
+            # Save images to files if present (re-uploaded documents reuse their
+            # files): full resolution for highlighting, plus a display rendition
+            image_paths = []
+            display_paths = []
+            boxes_path = None
+            if data.get('images'):
+                for img in data['images']:
+                    image_paths.append(encoder.submit(img))
+                    display_paths.append(encoder.submit(img, display=True))
+
+                # Keep the OCR word boxes so detail views never re-run Tesseract
+                if data.get('word_boxes'):
+                    boxes_path = store.fs_path(store.put_bytes(dump_word_boxes(data['word_boxes']), '.json'))
+
+            doc = {
+                'name': upload['filename'],
+                'text': data['text'],
+                'images': image_paths,  # Store paths (futures until encoded), not PIL objects
+                'display_images': display_paths,
+                'word_boxes_path': boxes_path
+            }
+            if data.get('processed'):
+                # Cached upload: skip preprocessing in compare_all_pairs
+                doc['processed'] = data['processed']
+            documents.append(doc)
+            extracted.append(data)
+
+    for doc in documents:
+        doc['images'] = [future.result() for future in doc['images']]
+        doc['display_images'] = [future.result() for future in doc['display_images']]
+    _report_encoding(encoder)
+
+    if len(documents) < 2:
+        messages.append(('error', 'Need at least 2 valid documents with extractable text.'))
+        return {'batch_id': None, 'messages': messages}
+
+    # Run cross-comparison
+    progress(75, 'Membandingkan dokumen...')
+    results = compare_all_pairs(documents,
+                                window=options['window'],
+                                use_lsh=options['batch_use_lsh'],
+                                lsh_bands=options['lsh_bands'],
+                                lsh_rows=options['lsh_rows'],
+                                max_workers=options['preprocess_workers'],
+                                detail_threshold=options['batch_detail_threshold'])
+
+    # Add every document to the corpus index for later one-vs-all checks
+    progress(90, 'Menyimpan ke indeks korpus...')
+    corpus_index = _get_corpus_index(options)
+    for doc, data in zip(documents, extracted):
+        corpus_index.add_document(doc['name'], doc['processed'], owner_id=user_id)
+        cache_processed_text(data, doc['processed'])
+
+    # Documents are stored once; pairs only reference them
+    stored_id = BatchStore(options['batch_store_path']).save(documents, results, user_id=user_id)
+    store.add_references(batch_owner(stored_id),
+                         [path for doc in documents
+                          for path in doc['images'] + doc['display_images'] + [doc['word_boxes_path']]])
+
+    from history import save_documents, record_check
+    with _app_context(options):
+        save_documents(user_id, documents, k=3, window=options['window'])
+        record_check(user_id, 'batch', ', '.join(doc['name'] for doc in documents),
+                     similarity_score=max((p['similarity'] for p in results['pairs']), default=0),
+                     batch_id=stored_id, job_id=job_id)
+
+    return {'batch_id': stored_id, 'messages': messages}
+
+
+def extract_document(upload=None, text=None, name='manual_input'):
+    """
+    Extraction result for a saved upload (see save_uploads) or raw text.
+
+    Returns:
+        dict with at least 'text', 'images' and 'filename'
+    """
+    if upload is not None:
+        return _extract_upload(upload)
+    return {'text': text or '', 'images': [], 'filename': name}
+
+
+def api_compare(suspect_data, source_data, options):
+    """
+    Compare two documents for the JSON API (no images, history or corpus).
+
+    Returns:
+        dict: Names, 'similarity_score', 'matches', 'spans', 'longest_match',
+              'suspect_truncated'/'source_truncated' (pages past the page
+              limit were not read) and 'elapsed_seconds'
+
+    Raises:
+        ValueError: If a document has no readable text
+    """
+    from file_parser import cache_processed_text
+
+    start = time.time()
+    processed = []
+    for side, data in (('suspect', suspect_data), ('source', source_data)):
+        text, _ = _preprocess(data) if data['text'] else ('', None)
+        if not text:
+            raise ValueError(f"No readable text in the {side} document ({data['filename']}).")
+        cache_processed_text(data, text)
+        processed.append(text)
+
+    result = detect_plagiarism(processed[0], processed[1], k=3, window=options['window'], return_spans=True)
+    return {
+        'suspect': suspect_data['filename'],
+        'source': source_data['filename'],
+        'similarity_score': result['similarity_score'],
+        'matches': result['matches'],
+        'spans': result['spans'],
+        'longest_match': result['longest_match'],
+        'suspect_truncated': bool(suspect_data.get('truncated')),
+        'source_truncated': bool(source_data.get('truncated')),
+        'elapsed_seconds': round(time.time() - start, 3)
+    }
+
+
+def iter_api_batch(sources, options, detail_threshold):
+    """
+    Compare all pairs of documents for the JSON API, as a stream of records.
+
+    Args:
+        sources: List of (name, saved upload or None, text or None)
+        options: Detection settings from the app config
+        detail_threshold: Pairs scoring at least this much include matches
+
+    Yields:
+        dict records with a 'type': 'document' per extracted document (or
+        'error'; 'truncated' marks documents cut off at the page limit),
+        'pair' per compared pair as soon as it is scored, then one 'summary'.
+    """
+    from batch_comparison import iter_pair_results
+    from file_parser import cache_processed_text
+
+    start = time.time()
+    documents = []
+    extracted = []
+    for name, upload, text in sources:
+        data = extract_document(upload, text, name)
+        if not data['text']:
+            yield {'type': 'error', 'document': name, 'error': 'Could not extract text.'}
+            continue
+        doc = {'name': name, 'text': data['text']}
+        if data.get('processed'):
+            doc['processed'] = data['processed']
+        documents.append(doc)
+        extracted.append(data)
+        yield {'type': 'document', 'index': len(documents) - 1, 'name': name,
+               'cached': bool(data.get('cache_hit')), 'truncated': bool(data.get('truncated'))}
+
+    if len(documents) < 2:
+        yield {'type': 'error', 'error': 'Need at least 2 valid documents with extractable text.'}
+        return
+
+    stats = {}
+    suspicious = 0
+    pairs = iter_pair_results(documents,
+                              window=options['window'],
+                              use_lsh=options['batch_use_lsh'],
+                              lsh_bands=options['lsh_bands'],
+                              lsh_rows=options['lsh_rows'],
+                              max_workers=options['preprocess_workers'],
+                              detail_threshold=detail_threshold,
+                              stats=stats)
+    for pair in pairs:
+        suspicious += pair['similarity'] >= 50
+        yield {
+            'type': 'pair',
+            'doc1': pair['doc1_name'],
+            'doc2': pair['doc2_name'],
+            'doc1_index': pair['doc1_index'],
+            'doc2_index': pair['doc2_index'],
+            'similarity': pair['similarity'],
+            'matches': pair['matches'],
+            'spans': pair['spans'],
+            'longest_match': pair['longest_match']
+        }
+
+    for doc, data in zip(documents, extracted):
+        cache_processed_text(data, doc['processed'])
+
+    yield {
+        'type': 'summary',
+        'documents': len(documents),
+        'pairs': stats['pair_count'],
+        'pruned_pairs': stats['pruned_pairs'],
+        'suspicious_pairs': suspicious,
+        'elapsed_seconds': round(time.time() - start, 3)
+    }
+
+
+def expire_results(options, store, max_age_days=RESULT_RETENTION_DAYS):
+    """
+    Delete batches and checks older than max_age_days and release their
+    upload references.
+
+    Returns:
+        tuple: (deleted batches, deleted checks)
+    """
+    from batch_store import BatchStore
+    from history import delete_checks_before
+    from upload_store import batch_owner, check_owner
+
+    if max_age_days <= 0:
+        return 0, 0
+
+    max_age = timedelta(days=max_age_days)
+    batch_ids = BatchStore(options['batch_store_path']).delete_older_than(time.time() - max_age.total_seconds())
+    with _app_context(options):
+        check_ids = delete_checks_before(datetime.utcnow() - max_age)
+
+    for owner in [batch_owner(batch_id) for batch_id in batch_ids] + [check_owner(check_id) for check_id in check_ids]:
+        store.release(owner)
+    if batch_ids or check_ids:
+        print(f"DEBUG: Expired {len(batch_ids)} batches and {len(check_ids)} checks")
+    return len(batch_ids), len(check_ids)
+
+
+def collect_uploads(options, force=False):
+    """
+    Expire old results, then sweep unreferenced upload files and old
+    highlighted pages, at most once per UPLOAD_GC_INTERVAL across all
+    workers (unless forced).
+
+    Returns:
+        dict: Sweep statistics, or None if no sweep was due
+    """
+    from batch_store import BatchStore
+    from history import check_ids
+    from upload_store import UploadStore, batch_owner, check_owner, remove_old_files
+
+    store = UploadStore(options['upload_store_path'])
+    if not store.claim_sweep(interval=0 if force else UPLOAD_GC_INTERVAL):
+        return None
+
+    expired_batches, expired_checks = expire_results(options, store)
+
+    # Owners are read before sweeping; references added after this moment are kept
+    snapshot_time = time.time()
+    live_owners = {batch_owner(batch_id) for batch_id in BatchStore(options['batch_store_path']).batch_ids()}
+    with _app_context(options):
+        live_owners.update(check_owner(check_id) for check_id in check_ids())
+
+    stats = store.sweep(live_owners, snapshot_time)
+    stats['expired_batches'], stats['expired_checks'] = expired_batches, expired_checks
+    stats['highlight_cache_deleted_files'], stats['highlight_cache_deleted_bytes'] = \
+        remove_old_files(options['highlight_cache_dir'], store.max_age)
+    return stats
+
+
+def _collect_after_job(options):
+    try:
+        collect_uploads(options)
+    except Exception:
+        # A failed sweep must never fail the check that triggered it
+        traceback.print_exc()
+
+
+def compare_job(payload, user_id, progress, job_id=None):
+    """Job handler for a dashboard check."""
+    try:
+        sides = []
+        for side, percent in (('suspect', 10), ('source', 40)):
+            upload = payload.get(f'{side}_file')
+            if upload:
+                progress(percent, f"Mengekstrak {upload['filename']}...")
+                sides.append(_extract_upload(upload))
+            elif payload.get(f'{side}_text'):
+                sides.append({'text': payload[f'{side}_text'], 'images': [], 'filename': 'manual_input'})
+            else:
+                sides.append(None)
+
+        return run_compare(sides[0], sides[1], user_id, payload['options'], progress, job_id=job_id)
+    finally:
+        if payload.get('upload_dir'):
+            shutil.rmtree(payload['upload_dir'], ignore_errors=True)
+        _collect_after_job(payload['options'])
+
+
+def batch_job(payload, user_id, progress, job_id=None):
+    """Job handler for a Multi Compare batch."""
+    try:
+        return run_batch(payload['uploads'], user_id, payload['options'], progress, job_id=job_id)
+    finally:
+        shutil.rmtree(payload['upload_dir'], ignore_errors=True)
+        _collect_after_job(payload['options'])
+
+
+JOB_HANDLERS = {
+    'compare': compare_job,
+    'batch': batch_job
+}
@@ -0,0 +1,163 @@
+"""
+Corpus Index Module
+
+Persistent inverted index from k-gram fingerprints to the documents that
+contain them. Lets a new submission be checked against every earlier one
+by looking up only its own fingerprints.
+"""
+
+import hashlib
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from rabin_karp import fingerprint_text, winnow
+from database import apply_sqlite_pragmas
+
+DEFAULT_INDEX_PATH = 'corpus_index.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    owner_id INTEGER,
+    content_hash TEXT NOT NULL,
+    k INTEGER NOT NULL,
+    winnow_window INTEGER NOT NULL,
+    fingerprint_count INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    UNIQUE (content_hash, k, winnow_window)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    fingerprint INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    PRIMARY KEY (fingerprint, doc_id)
+) WITHOUT ROWID;
+"""
+
+
+def _to_signed(h):
+    """Maps an unsigned 64-bit fingerprint onto SQLite's signed INTEGER range."""
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+class CorpusIndex:
+    """
+    SQLite-backed fingerprint index of every previously checked document.
+
+    Fingerprints are the stable 64-bit k-gram hashes from rabin_karp
+    (optionally winnowed), so they stay valid across workers and restarts.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, k=3, window=None):
+        self.path = path
+        self.k = k
+        self.window = window or 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            apply_sqlite_pragmas(conn)
+            conn.execute('PRAGMA foreign_keys = ON')
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def fingerprints(self, processed_text):
+        """Returns the set of (signed) fingerprints used to index a preprocessed text."""
+        _, hashes = fingerprint_text(processed_text, self.k)
+        if self.window:
+            hashes = winnow(hashes, self.window)[1]
+        return {_to_signed(h) for h in hashes}
+
+    def add_document(self, name, processed_text, owner_id=None):
+        """
+        Add a preprocessed document to the index.
+
+        Documents with identical preprocessed content are stored only once.
+
+        Returns:
+            int: ID of the indexed document, or None if it has no k-grams.
+        """
+        fingerprints = self.fingerprints(processed_text)
+        if not fingerprints:
+            return None
+
+        content_hash = hashlib.sha256(processed_text.encode('utf-8')).hexdigest()
+
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id FROM documents WHERE content_hash = ? AND k = ? AND winnow_window = ?',
+                (content_hash, self.k, self.window)
+            ).fetchone()
+            if row:
+                return row[0]
+
+            cursor = conn.execute(
+                'INSERT INTO documents (name, owner_id, content_hash, k, winnow_window, fingerprint_count, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, owner_id, content_hash, self.k, self.window, len(fingerprints), time.time())
+            )
+            doc_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT INTO postings (fingerprint, doc_id) VALUES (?, ?)',
+                ((fp, doc_id) for fp in fingerprints)
+            )
+        return doc_id
+
+    def query(self, processed_text, limit=10, exclude_ids=()):
+        """
+        Rank indexed documents by how much of the query they contain.
+
+        Containment is the share of the query's distinct fingerprints that
+        also occur in the indexed document.
+
+        Returns:
+            list: Dicts with 'doc_id', 'name', 'shared', 'containment' (percent)
+                  and 'created_at', sorted by containment (highest first).
+        """
+        fingerprints = self.fingerprints(processed_text)
+        if not fingerprints:
+            return []
+
+        with self._connect() as conn:
+            conn.execute('CREATE TEMP TABLE query_fingerprints (fingerprint INTEGER PRIMARY KEY)')
+            conn.executemany(
+                'INSERT INTO query_fingerprints (fingerprint) VALUES (?)',
+                ((fp,) for fp in fingerprints)
+            )
+            rows = conn.execute(
+                'SELECT d.id, d.name, d.created_at, COUNT(*) AS shared '
+                'FROM query_fingerprints q '
+                'JOIN postings p ON p.fingerprint = q.fingerprint '
+                'JOIN documents d ON d.id = p.doc_id '
+                'WHERE d.k = ? AND d.winnow_window = ? '
+                'GROUP BY d.id ORDER BY shared DESC',
+                (self.k, self.window)
+            ).fetchall()
+            conn.execute('DROP TABLE query_fingerprints')
+
+        excluded = set(exclude_ids)
+        ranked = []
+        for doc_id, name, created_at, shared in rows:
+            if doc_id in excluded:
+                continue
+            ranked.append({
+                'doc_id': doc_id,
+                'name': name,
+                'shared': shared,
+                'containment': round(shared / len(fingerprints) * 100, 2),
+                'created_at': created_at
+            })
+            if len(ranked) >= limit:
+                break
+        return ranked
+
+    def count(self):
+        """Number of documents in the index."""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
@@ -1,5 +1,56 @@
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from models import db, User
 from datetime import datetime
+import os
+import sqlite3
+
+# SQLite tuning for several gunicorn workers and job workers writing at once:
+# WAL lets readers and the single writer proceed concurrently, busy_timeout
+# makes writers wait for the lock instead of failing with "database is
+# locked", and synchronous=NORMAL is durable in WAL mode except for the last
+# transactions before a power loss.
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 30000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = 16000
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('busy_timeout', SQLITE_BUSY_TIMEOUT_MS),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', SQLITE_MMAP_SIZE),
+    ('cache_size', -SQLITE_CACHE_SIZE_KB),
+    ('temp_store', 'MEMORY'),
+)
+
+# SQLAlchemy engine options (SQLALCHEMY_ENGINE_OPTIONS)
+ENGINE_OPTIONS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 3600,
+    'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+}
+
+_worker_apps = {}
+
+def apply_sqlite_pragmas(conn):
+    """Apply SQLITE_PRAGMAS to a sqlite3 connection (also used by the SQLite stores)."""
+    cursor = conn.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+@event.listens_for(Engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        apply_sqlite_pragmas(dbapi_connection)
+        # SQLite ignores ondelete='CASCADE'/'SET NULL' (and passive_deletes
+        # relies on them) unless enabled per connection
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        cursor.close()
 
 def init_db(app):
     """Initialize database and create tables"""
@@ -10,6 +61,21 @@ def init_db(app):
         # Create default admin if not exists
         create_default_admin()
 
+def get_worker_app(database_uri):
+    """
+    Minimal Flask app bound to the same database, so background job workers
+    can use the models without importing the web application.
+    """
+    app = _worker_apps.get(database_uri)
+    if app is None:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = ENGINE_OPTIONS
+        db.init_app(app)
+        _worker_apps[database_uri] = app
+    return app
+
 def create_default_admin():
     """Create default admin user if it doesn't exist"""
     admin_email = 'admin@plagiarism.local'
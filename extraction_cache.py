@@ -0,0 +1,176 @@
+"""
+Extraction Cache Module
+
+Content-addressed on-disk cache of file extraction results (text, OCR word
+boxes and preprocessed tokens), so re-uploading the same file skips
+extraction, OCR and stemming entirely.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = 'extraction_cache'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Other processes write to the same directory; the running size total of a
+# process is re-read from disk at least this often (seconds)
+SIZE_RESCAN_INTERVAL = 300
+
+# Eviction frees space down to this share of the limit, so the next writes
+# do not trigger another scan right away
+EVICT_TARGET = 0.9
+
+
+def cache_key(file_bytes, settings):
+    """
+    Key for an uploaded file: SHA-256 of its bytes plus the extraction
+    settings, so changing OCR or rendering parameters never returns stale
+    results.
+    """
+    content_hash = hashlib.sha256(file_bytes).hexdigest()
+    settings_hash = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return f"{content_hash}-{settings_hash}"
+
+
+class ExtractionCache:
+    """
+    Size-bounded LRU cache of extraction results, one JSON file per key.
+
+    Recency is the file's modification time (touched on every hit), so the
+    LRU order is shared by every worker process using the same directory.
+    Writes update a running size total; the directory is only scanned when
+    that total goes over the limit (or is older than SIZE_RESCAN_INTERVAL).
+    Hit/miss counters are per process; job workers add them to the shared
+    totals in the job queue (see job_queue.record_cache_stats).
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reported = (0, 0, 0)
+        self._total_bytes = None
+        self._scanned_at = 0.0
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key):
+        """
+        Returns the cached entry (dict) for a key, or None.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """Store an entry, then evict least recently used entries over the size limit."""
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, separators=(',', ':'))
+                size = f.tell()
+            try:
+                size -= os.path.getsize(entry_path)
+            except OSError:
+                pass
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            print(f"DEBUG: Could not write extraction cache entry: {e}")
+            return
+        self._evict(size)
+
+    def update(self, key, **fields):
+        """Add fields (e.g. the preprocessed text) to an existing entry."""
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return
+        entry.update(fields)
+        self.put(key, entry)
+
+    def _entries(self):
+        """(mtime, size, path) of every cache file."""
+        entries = []
+        try:
+            with os.scandir(self.path) as it:
+                for item in it:
+                    if item.name.endswith('.json'):
+                        try:
+                            st = item.stat()
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, item.path))
+        except OSError:
+            pass
+        return entries
+
+    def _evict(self, added):
+        """Account for `added` bytes; scan and evict LRU entries only when over the limit."""
+        with self._lock:
+            if self._total_bytes is not None and time.monotonic() - self._scanned_at < SIZE_RESCAN_INTERVAL:
+                self._total_bytes += added
+                if self._total_bytes <= self.max_bytes:
+                    return
+
+        scanned_at = time.monotonic()
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_TARGET
+            for _, size, entry_path in sorted(entries):
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    continue
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+                if total <= target:
+                    break
+
+        with self._lock:
+            self._total_bytes = total
+            self._scanned_at = scanned_at
+
+    def take_counts(self):
+        """(hits, misses, evictions) since the previous call, for shared metrics."""
+        with self._lock:
+            current = (self.hits, self.misses, self.evictions)
+            deltas = tuple(now - before for now, before in zip(current, self._reported))
+            self._reported = current
+        return deltas
+
+    def stats(self):
+        """Returns hit/miss counters and disk usage."""
+        entries = self._entries()
+        total = self.hits + self.misses
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total * 100, 2) if total else 0.0
+        }
@@ -3,7 +3,15 @@ from pypdf import PdfReader
 from PIL import Image
 import pytesseract
 from pdf2image import convert_from_bytes
+from highlight_visualizer import build_word_to_box_mapping
+from extraction_cache import ExtractionCache, cache_key
+from preprocessing import PREPROCESS_VERSION
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import io
+import math
 import os
+import re
 
 # Configure Tesseract path for Windows
 pytesseract.pytesseract.tesseract_cmd = r'D:\projectpribadi\_installed_tesseract\tesseract.exe'
@@ -14,6 +22,69 @@ POPPLER_PATH = r'D:\projectpribadi\poppler-25.11.0\Library\bin'
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx', 'png', 'jpg', 'jpeg'}
 
+# Tesseract settings: OEM 3 (default engine), PSM 1 (automatic page segmentation with OSD)
+OCR_LANG = 'ind+eng'
+OCR_CONFIG = r'--oem 3 --psm 1'
+
+# Page OCR worker pool size and per-document page budget, so a single huge
+# upload cannot take every core of the server
+OCR_MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', min(4, os.cpu_count() or 1)))
+OCR_MAX_PAGES = int(os.environ.get('OCR_MAX_PAGES', 50))
+
+# PDF pages are rasterized at this resolution for OCR and highlighting
+PDF_DPI = 200
+
+# Pages rendered per pdftoppm call, and the most rendered pages kept in
+# memory per document (a 200 DPI A4 page is ~11 MB as a raw image)
+PDF_RENDER_CHUNK = int(os.environ.get('PDF_RENDER_CHUNK', 4))
+PDF_MAX_RESIDENT_PAGES = int(os.environ.get('PDF_MAX_RESIDENT_PAGES', 8))
+
+# A PDF page whose text layer has fewer characters than this, or whose text
+# covers less than this share of the page area (e.g. only a "Scanned by
+# CamScanner" footer on a scanned page), is OCR'd instead
+TEXT_LAYER_MIN_CHARS = 20
+TEXT_LAYER_MIN_COVERAGE = 0.01
+
+# Average glyph width relative to the font size, used to estimate word boxes
+# from PDF text positions
+AVG_CHAR_WIDTH = 0.5
+
+# Extraction results cache (0 MB disables it)
+EXTRACTION_CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', 'extraction_cache')
+EXTRACTION_CACHE_MAX_MB = int(os.environ.get('EXTRACTION_CACHE_MAX_MB', 512))
+
+# Bump when the extraction output format changes
+EXTRACTION_VERSION = 2
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_MB * 1024 * 1024) \
+    if EXTRACTION_CACHE_MAX_MB > 0 else None
+
+def _extraction_settings(ext):
+    """Everything besides the file bytes that changes the extraction output."""
+    return {
+        'version': EXTRACTION_VERSION,
+        'ext': ext,
+        'ocr_lang': OCR_LANG,
+        'ocr_config': OCR_CONFIG,
+        'dpi': PDF_DPI,
+        'max_pages': OCR_MAX_PAGES,
+        'text_layer_min_chars': TEXT_LAYER_MIN_CHARS,
+        'text_layer_min_coverage': TEXT_LAYER_MIN_COVERAGE,
+        'avg_char_width': AVG_CHAR_WIDTH
+    }
+
+def get_extraction_cache_stats():
+    return extraction_cache.stats() if extraction_cache else None
+
+def cache_processed_text(result, processed):
+    """
+    Store the preprocessed text of an extraction result in its cache entry,
+    so the next upload of the same file also skips preprocessing.
+    """
+    if extraction_cache and result.get('cache_key') and result.get('processed') is None:
+        extraction_cache.update(result['cache_key'], processed=processed, processed_version=PREPROCESS_VERSION)
+        result['processed'] = processed
+
 def _preprocess_image_for_ocr(image):
     """
     Preprocess image to improve OCR accuracy.
@@ -40,10 +111,286 @@ def _preprocess_image_for_ocr(image):
     
     return image
 
+def _text_from_ocr_data(ocr_data):
+    """
+    Rebuild page text from pytesseract.image_to_data output, with one line
+    per OCR line and a blank line between paragraphs (like image_to_string).
+    """
+    paragraphs = []
+    lines = {}
+    for i, word in enumerate(ocr_data['text']):
+        if ocr_data['level'][i] != 5 or not word.strip():
+            continue
+        par_key = (ocr_data['page_num'][i], ocr_data['block_num'][i], ocr_data['par_num'][i])
+        if par_key not in lines:
+            lines[par_key] = {}
+            paragraphs.append(par_key)
+        lines[par_key].setdefault(ocr_data['line_num'][i], []).append(word.strip())
+
+    return '\n\n'.join(
+        '\n'.join(' '.join(words) for words in lines[par_key].values())
+        for par_key in paragraphs
+    )
+
+def _ocr_page(image):
+    """
+    OCR a page image with a single Tesseract pass.
+
+    Returns:
+        tuple: (text, word_boxes) where word_boxes is a list of
+               (word, (x, y, w, h)) in the coordinates of the original image.
+    """
+    processed_image = _preprocess_image_for_ocr(image)
+    ocr_data = pytesseract.image_to_data(
+        processed_image,
+        lang=OCR_LANG,
+        config=OCR_CONFIG,
+        output_type=pytesseract.Output.DICT
+    )
+
+    text = _text_from_ocr_data(ocr_data)
+
+    # Preprocessing may upscale small images; map boxes back to the original
+    scale = image.width / processed_image.width
+    word_boxes = []
+    for word, (x, y, w, h) in build_word_to_box_mapping(ocr_data):
+        if scale != 1:
+            x, y, w, h = (round(v * scale) for v in (x, y, w, h))
+        word_boxes.append((word, (x, y, w, h)))
+
+    return text, word_boxes
+
+def _ocr_worker_init():
+    # Tesseract already runs one page per worker; keep it from spawning
+    # its own OpenMP threads on top of that
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+def _ocr_page_safe(page_number, image):
+    """OCR one page; a failing page yields empty text instead of failing the document."""
+    try:
+        return _ocr_page(image)
+    except Exception as e:
+        print(f"DEBUG: OCR failed on page {page_number}: {e}")
+        return '', []
+
+def _ocr_pages(pages, count, max_workers=None, max_pending=None):
+    """
+    OCR a stream of pages in one bounded process pool per document.
+
+    Pages are submitted as they arrive, with at most `max_pending` in
+    flight, so lazily rendered pages are dropped as soon as they are OCR'd
+    instead of piling up in the pool's queue.
+
+    Args:
+        pages: Iterable of (page index, PIL image)
+        count: Number of pages in the stream (caps the pool size)
+        max_workers: Pool size (defaults to OCR_MAX_WORKERS)
+        max_pending: Pages submitted but not collected yet (defaults to the pool size)
+
+    Yields:
+        tuple: (page index, text, word_boxes), in input order
+    """
+    workers = min(max_workers or OCR_MAX_WORKERS, count)
+    if workers <= 1:
+        for idx, image in pages:
+            yield (idx, *_ocr_page_safe(idx + 1, image))
+        return
+
+    print(f"DEBUG: OCR {count} pages with {workers} workers...")
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_ocr_worker_init) as executor:
+        def collect():
+            idx, future = pending.popleft()
+            try:
+                return (idx, *future.result())
+            except Exception as e:
+                # e.g. a worker process crashed
+                print(f"DEBUG: OCR worker failed on page {idx + 1}: {e}")
+                return idx, '', []
+
+        for idx, image in pages:
+            pending.append((idx, executor.submit(_ocr_page_safe, idx + 1, image)))
+            del image
+            while len(pending) >= (max_pending or workers):
+                yield collect()
+        while pending:
+            yield collect()
+
+class PdfPageImages:
+    """
+    Read-only sequence of PDF page images, rendered only when accessed.
+
+    Pages are rendered in chunks of `chunk_size` with pdf2image's
+    first_page/last_page and at most `max_resident` rendered pages are
+    kept (least recently used pages are dropped and re-rendered if needed
+    again), so memory stays bounded regardless of the page count.
+    """
+
+    def __init__(self, file_bytes, page_count, dpi=PDF_DPI,
+                 chunk_size=PDF_RENDER_CHUNK, max_resident=PDF_MAX_RESIDENT_PAGES):
+        self.file_bytes = file_bytes
+        self.page_count = page_count
+        self.dpi = dpi
+        self.max_resident = max(1, max_resident)
+        self.chunk_size = max(1, min(chunk_size, self.max_resident))
+        self._cache = OrderedDict()
+        self.stats = {
+            'render_calls': 0,
+            'pages_rendered': 0,
+            'peak_resident_pages': 0,
+            'peak_resident_bytes': 0
+        }
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.page_count
+        if not 0 <= index < self.page_count:
+            raise IndexError('page index out of range')
+
+        image = self._cache.get(index)
+        if image is not None:
+            self._cache.move_to_end(index)
+            return image
+
+        # Render ahead: pages are usually read in order
+        last = min(index + self.chunk_size, self.page_count) - 1
+        for page_index, page_image in zip(range(index, last + 1), self._render(index, last)):
+            self._cache[page_index] = page_image
+            while len(self._cache) > self.max_resident:
+                self._cache.popitem(last=False)
+        return self._cache[index]
+
+    def __iter__(self):
+        for index in range(self.page_count):
+            yield self[index]
+
+    def iter_chunks(self, indices):
+        """
+        Render the given pages chunk by chunk without caching them.
+
+        Yields:
+            list of (index, image) per chunk; drop the images before the next
+            chunk to keep memory bounded.
+        """
+        chunk = []
+        for index in sorted(indices):
+            if chunk and (index != chunk[-1] + 1 or len(chunk) >= self.chunk_size):
+                yield list(zip(chunk, self._render(chunk[0], chunk[-1])))
+                chunk = []
+            chunk.append(index)
+        if chunk:
+            yield list(zip(chunk, self._render(chunk[0], chunk[-1])))
+
+    def _render(self, first, last):
+        """Rasterize pages first..last (0-based, inclusive) and update memory stats."""
+        print(f"DEBUG: Rendering PDF pages {first + 1}-{last + 1}...")
+        images = _render_pdf_pages(self.file_bytes, first + 1, last + 1, self.dpi)
+        self.stats['render_calls'] += 1
+        self.stats['pages_rendered'] += len(images)
+
+        resident = list(self._cache.values()) + images
+        resident_bytes = sum(img.width * img.height * len(img.getbands()) for img in resident)
+        self.stats['peak_resident_pages'] = max(self.stats['peak_resident_pages'], len(resident))
+        self.stats['peak_resident_bytes'] = max(self.stats['peak_resident_bytes'], resident_bytes)
+        return images
+
+    def memory_report(self):
+        """Render statistics plus the process' peak RSS (where available)."""
+        report = dict(self.stats)
+        report['peak_resident_mb'] = round(report['peak_resident_bytes'] / (1024 * 1024), 1)
+        try:
+            import resource
+            # ru_maxrss is in KB on Linux
+            report['process_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        except ImportError:
+            pass
+        return report
+
+def _render_pdf_pages(file_bytes, first_page, last_page, dpi=PDF_DPI):
+    """Rasterize a range of PDF pages (1-based, inclusive)."""
+    return convert_from_bytes(file_bytes, poppler_path=POPPLER_PATH, dpi=dpi,
+                              first_page=first_page, last_page=last_page)
+
+def _text_layer_word_boxes(page, dpi=PDF_DPI):
+    """
+    Extract a page's text layer together with estimated word boxes.
+
+    Word positions come from pypdf's text visitor; widths are estimated
+    from the font size, which is good enough to draw highlight boxes.
+
+    Returns:
+        tuple: (text, word_boxes) with word_boxes in pixel coordinates of the
+               page rendered at `dpi`, or None for rotated pages.
+    """
+    scale = dpi / 72
+    box = page.cropbox
+    left, top = float(box.left), float(box.top)
+    word_boxes = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        if not text or not text.strip():
+            return
+        # Text origin in user space: text matrix combined with the CTM
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        size = (font_size or 0) * math.hypot(tm[2], tm[3]) * math.hypot(cm[2], cm[3]) or 10
+        char_width = size * AVG_CHAR_WIDTH
+
+        for line_idx, line in enumerate(text.split('\n')):
+            line_y = y - line_idx * size * 1.2
+            for match in re.finditer(r'\S+', line):
+                x1 = x + match.start() * char_width
+                word_boxes.append((match.group(), (
+                    round((x1 - left) * scale),
+                    round((top - line_y - size * 0.8) * scale),
+                    round(len(match.group()) * char_width * scale),
+                    round(size * scale)
+                )))
+
+    text = page.extract_text(visitor_text=visitor) or ''
+    if page.rotation % 360:
+        return text, None
+    return text, word_boxes
+
+def _has_usable_text_layer(page, text, word_boxes, dpi=PDF_DPI):
+    """
+    Whether a page's text layer can be used instead of OCR: enough
+    characters, and word boxes covering at least TEXT_LAYER_MIN_COVERAGE of
+    the page (a scan with only a footer in its text layer fails this).
+    Rotated pages (no word boxes) are judged by their characters alone.
+    """
+    if len(text.strip()) < TEXT_LAYER_MIN_CHARS:
+        return False
+    if word_boxes is None:
+        return True
+    box = page.cropbox
+    page_area = float(box.width) * float(box.height) * (dpi / 72) ** 2
+    covered = sum(w * h for _, (_, _, w, h) in word_boxes)
+    return page_area > 0 and covered / page_area >= TEXT_LAYER_MIN_COVERAGE
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def count_pages(file_storage):
+    """
+    Number of pages extraction would process (PDF page count, 1 for images,
+    0 for text formats or unreadable PDFs). The stream is rewound.
+    """
+    ext = file_storage.filename.rsplit('.', 1)[-1].lower()
+    try:
+        if ext == 'pdf':
+            return len(PdfReader(file_storage.stream).pages)
+        return 1 if ext in ['png', 'jpg', 'jpeg'] else 0
+    except Exception as e:
+        print(f"DEBUG: Could not count pages of {file_storage.filename}: {e}")
+        return 0
+    finally:
+        file_storage.stream.seek(0)
+
 def extract_text_from_file(file_storage):
     """
     Extracts text from a FileStorage object (Flask upload).
@@ -72,11 +419,23 @@ def extract_text_and_images_from_file(file_storage):
     Extracts both text and images from a FileStorage object.
     Used for visual plagiarism highlighting.
     
+    Results are cached by file content: a re-upload of the same file returns
+    the cached text, word boxes and (if stored) preprocessed text without
+    running extraction or OCR again. Page images are reopened lazily from
+    the uploaded bytes.
+    
     Returns:
         dict: {
             'text': str,
             'images': list of PIL Images (for PDF/images),
-            'filename': str
+            'word_boxes': list (one per image) of OCR (word, (x, y, w, h)) boxes,
+            'filename': str,
+            'processed': preprocessed text from the cache (current
+                         PREPROCESS_VERSION only), or None,
+            'cache_key': str or None,
+            'cache_hit': bool,
+            'total_pages': pages in the document (PDF/images, else 0),
+            'truncated': True if pages past OCR_MAX_PAGES were not extracted
         }
     """
     filename = file_storage.filename
@@ -85,23 +444,55 @@ def extract_text_and_images_from_file(file_storage):
     result = {
         'text': '',
         'images': [],
-        'filename': filename
+        'word_boxes': [],
+        'filename': filename,
+        'processed': None,
+        'cache_key': None,
+        'cache_hit': False,
+        'total_pages': 0,
+        'truncated': False
     }
     
     try:
+        file_bytes = file_storage.read()
+        file_storage.seek(0)
+        
+        if extraction_cache:
+            result['cache_key'] = cache_key(file_bytes, _extraction_settings(ext))
+            entry = extraction_cache.get(result['cache_key'])
+            if entry:
+                print(f"DEBUG: Extraction cache hit for {filename}")
+                result['text'] = entry['text']
+                result['word_boxes'] = [
+                    None if page is None else [(word, tuple(box)) for word, box in page]
+                    for page in entry['word_boxes']
+                ]
+                result['images'] = _reopen_images(ext, file_bytes, entry.get('page_count', 0))
+                result['total_pages'] = entry.get('total_pages', len(result['images']))
+                result['truncated'] = result['total_pages'] > len(result['images'])
+                # Preprocessed text made by another preprocessing version is redone
+                if entry.get('processed_version') == PREPROCESS_VERSION:
+                    result['processed'] = entry.get('processed')
+                result['cache_hit'] = True
+                return result
+        
         if ext == 'pdf':
             # Extract text and images from PDF
             pdf_result = _extract_from_pdf_with_images(file_storage)
             result['text'] = pdf_result['text']
             result['images'] = pdf_result['images']
+            result['word_boxes'] = pdf_result['word_boxes']
+            result['render_stats'] = pdf_result.get('render_stats')
+            result['total_pages'] = pdf_result.get('total_pages', len(result['images']))
+            result['truncated'] = result['total_pages'] > len(result['images'])
         elif ext in ['png', 'jpg', 'jpeg']:
             # For image files, extract text and keep the image
             image = Image.open(file_storage)
-            processed_image = _preprocess_image_for_ocr(image)
-            custom_config = r'--oem 3 --psm 1'
-            text = pytesseract.image_to_string(processed_image, lang='ind+eng', config=custom_config)
+            text, word_boxes = _ocr_page(image)
             result['text'] = text
             result['images'] = [image]  # Keep original image, not preprocessed
+            result['word_boxes'] = [word_boxes]
+            result['total_pages'] = 1
         elif ext == 'docx':
             # DOCX doesn't have images to highlight
             result['text'] = _extract_from_docx(file_storage)
@@ -112,12 +503,30 @@ def extract_text_and_images_from_file(file_storage):
         else:
             result['text'] = ""
             result['images'] = []
+        
+        # Only successful extractions are cached
+        if extraction_cache and result['text']:
+            extraction_cache.put(result['cache_key'], {
+                'text': result['text'],
+                'word_boxes': result['word_boxes'],
+                'page_count': len(result['images']),
+                'total_pages': result['total_pages'],
+                'processed': None
+            })
             
     except Exception as e:
         print(f"Error extracting from {filename}: {e}")
     
     return result
 
+def _reopen_images(ext, file_bytes, page_count):
+    """Page images for a cached extraction, without rendering anything yet."""
+    if ext == 'pdf' and page_count:
+        return PdfPageImages(file_bytes, page_count)
+    if ext in ['png', 'jpg', 'jpeg']:
+        return [Image.open(io.BytesIO(file_bytes))]
+    return []
+
 def _extract_from_docx(file_storage):
     doc = docx.Document(file_storage)
     full_text = []
@@ -160,20 +569,12 @@ def _extract_from_pdf(file_storage):
         file_storage.seek(0)
         file_bytes = file_storage.read()
         
-        # Convert PDF to images
-        images = convert_from_bytes(file_bytes, poppler_path=POPPLER_PATH)
+        # Convert PDF to images (within the page budget)
+        images = convert_from_bytes(file_bytes, poppler_path=POPPLER_PATH, last_page=OCR_MAX_PAGES)
         
-        ocr_text = []
-        for i, image in enumerate(images):
-            print(f"DEBUG: OCR Processing page {i+1}...")
-            # Preprocess image for better OCR
-            processed_image = _preprocess_image_for_ocr(image)
-            # Use PSM 1 (Automatic page segmentation with OSD)
-            custom_config = r'--oem 3 --psm 1'
-            text = pytesseract.image_to_string(processed_image, lang='ind+eng', config=custom_config)
-            ocr_text.append(text)
+        ocr_text = [text for _, text, _ in _ocr_pages(enumerate(images), len(images))]
             
-        return '\\n'.join(ocr_text)
+        return '\n'.join(ocr_text)
     except Exception as e:
         print(f"DEBUG: PDF OCR failed: {e}")
         return ""
@@ -181,43 +582,71 @@ def _extract_from_pdf(file_storage):
 def _extract_from_pdf_with_images(file_storage):
     """
     Extract both text and images from PDF.
-    Returns dict with 'text' and 'images' keys.
+    Returns dict with 'text', 'images' and 'word_boxes' keys.
+
+    Each page is routed separately: pages with a usable text layer use it
+    (with word boxes from the text positions); only image-only pages are
+    rasterized and OCR'd, streamed in small chunks that are dropped once
+    OCR'd. 'images' is a PdfPageImages, so pages are only rendered again
+    if something actually displays them, and never all at once.
     """
-    # Always convert PDF to images for visual highlighting
     try:
         file_storage.seek(0)
         file_bytes = file_storage.read()
         
-        # Convert PDF to images (higher DPI for better quality)
-        images = convert_from_bytes(file_bytes, poppler_path=POPPLER_PATH, dpi=200)
-        print(f"DEBUG: Converted PDF to {len(images)} page images")
+        reader = PdfReader(io.BytesIO(file_bytes))
+        total_pages = len(reader.pages)
+        page_count = min(total_pages, OCR_MAX_PAGES)
+        if total_pages > page_count:
+            print(f"DEBUG: PDF has {total_pages} pages, only the first {page_count} are extracted")
         
-        ocr_text = []
-        for i, image in enumerate(images):
-            print(f"DEBUG: OCR Processing page {i+1}...")
-            # Preprocess image for better OCR
-            processed_image = _preprocess_image_for_ocr(image)
-            # Use PSM 1 (Automatic page segmentation with OSD)
-            custom_config = r'--oem 3 --psm 1'
-            text = pytesseract.image_to_string(processed_image, lang='ind+eng', config=custom_config)
-            ocr_text.append(text)
+        page_texts = [''] * page_count
+        word_boxes = [None] * page_count
+        ocr_pages = []
+        
+        for idx in range(page_count):
+            try:
+                text, boxes = _text_layer_word_boxes(reader.pages[idx])
+            except Exception as e:
+                print(f"DEBUG: Text layer extraction failed on page {idx+1}: {e}")
+                text, boxes = '', None
+            
+            if _has_usable_text_layer(reader.pages[idx], text, boxes):
+                # Join hyphenated words split across lines
+                page_texts[idx] = text.replace('-\n', '')
+                word_boxes[idx] = boxes
+            else:
+                ocr_pages.append(idx)
+        
+        print(f"DEBUG: PDF has {page_count} pages, {len(ocr_pages)} need OCR")
+        
+        # Rasterize only the pages without a text layer, chunk by chunk, and
+        # stream them through one OCR pool for the whole document
+        pages = PdfPageImages(file_bytes, page_count)
+        rendered = (page for chunk in pages.iter_chunks(ocr_pages) for page in chunk)
+        for idx, text, boxes in _ocr_pages(rendered, len(ocr_pages)):
+            page_texts[idx] = text
+            word_boxes[idx] = boxes
+        
+        stats = pages.memory_report()
+        print(f"DEBUG: PDF render stats: {stats}")
         
         return {
-            'text': '\\n'.join(ocr_text),
-            'images': images  # Return original images, not preprocessed ones
+            'text': '\n'.join(page_texts),
+            'images': pages,
+            'word_boxes': word_boxes,
+            'total_pages': total_pages,
+            'render_stats': stats
         }
     except Exception as e:
         print(f"DEBUG: PDF extraction with images failed: {e}")
         return {
             'text': '',
-            'images': []
+            'images': [],
+            'word_boxes': []
         }
 
 def _extract_from_image(file_storage):
     image = Image.open(file_storage)
-    # Preprocess image for better OCR
-    processed_image = _preprocess_image_for_ocr(image)
-    # Use PSM 1 (Automatic page segmentation with OSD)
-    custom_config = r'--oem 3 --psm 1'
-    text = pytesseract.image_to_string(processed_image, lang='ind+eng', config=custom_config)
+    text, _ = _ocr_page(image)
     return text
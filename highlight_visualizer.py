@@ -1,6 +1,15 @@
 import pytesseract
 from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
+import hashlib
+import json
 import os
+import threading
+from image_encoding import (DISPLAY_EXTENSIONS, DISPLAY_IMAGE_FORMAT, RENDITION_TAG,
+                            display_rendition, save_options)
+
+# Highlighted pages rendered on demand, keyed by page content and match set
+HIGHLIGHT_CACHE_DIR = os.environ.get('HIGHLIGHT_CACHE_DIR', 'highlight_cache')
 
 def extract_text_with_boxes(image, lang='ind+eng'):
     """
@@ -62,10 +71,33 @@ def normalize_word(word):
     normalized = re.sub(r'[^a-z0-9\s]', '', word.lower())
     return normalized.strip()
 
+def _fuzzy_positions(phrase_word, positions_by_word):
+    """
+    OCR word positions matching a phrase word: the exact word if the page
+    has it, otherwise any OCR word containing it / contained in it (to
+    handle OCR errors). Only words without an exact hit scan the page
+    vocabulary.
+    """
+    exact = positions_by_word.get(phrase_word)
+    if exact:
+        return set(exact)
+    
+    positions = set()
+    for ocr_word, word_positions in positions_by_word.items():
+        if ocr_word and (phrase_word in ocr_word or ocr_word in phrase_word):
+            positions.update(word_positions)
+    return positions
+
 def find_matched_boxes(word_boxes, matched_phrases):
     """
     Find bounding boxes for matched phrases with fuzzy matching.
     
+    The page's normalized OCR words are indexed once (word -> positions).
+    Every distinct phrase word is then resolved once to the set of OCR
+    positions it matches, and a phrase matches at position i when each of
+    its words matches at i + j, so phrases are checked only where their
+    first word occurs.
+    
     Args:
         word_boxes: List of (word, box) tuples
         matched_phrases: List of matched n-gram strings
@@ -76,9 +108,15 @@ def find_matched_boxes(word_boxes, matched_phrases):
     matched_boxes = []
     
     # Normalize word_boxes for better matching
-    normalized_word_boxes = []
-    for word, box in word_boxes:
-        normalized_word_boxes.append((normalize_word(word), box, word))  # keep original word for debug
+    normalized_words = [normalize_word(word) for word, _ in word_boxes]
+    boxes = [box for _, box in word_boxes]
+    
+    positions_by_word = {}
+    for i, word in enumerate(normalized_words):
+        positions_by_word.setdefault(word, []).append(i)
+    
+    # Phrase word -> matching OCR positions, filled lazily (see _fuzzy_positions)
+    match_table = {}
     
     for phrase in matched_phrases:
         # Normalize and split phrase into words
@@ -86,40 +124,25 @@ def find_matched_boxes(word_boxes, matched_phrases):
         if not phrase_words:
             continue
         
-        # Print for debugging
-        print(f"DEBUG: Looking for phrase: {phrase_words}")
+        word_matches = []
+        for phrase_word in phrase_words:
+            if phrase_word not in match_table:
+                match_table[phrase_word] = _fuzzy_positions(phrase_word, positions_by_word)
+            word_matches.append(match_table[phrase_word])
         
-        # Find consecutive words in word_boxes
-        for i in range(len(normalized_word_boxes) - len(phrase_words) + 1):
-            # Check if words match (allowing for minor differences)
-            words_match = True
-            for j in range(len(phrase_words)):
-                ocr_word = normalized_word_boxes[i + j][0]
-                phrase_word = phrase_words[j]
-                
-                # Exact match or substring match (to handle OCR errors)
-                if not (ocr_word == phrase_word or 
-                        phrase_word in ocr_word or 
-                        ocr_word in phrase_word):
-                    words_match = False
-                    break
-            
-            if words_match:
-                # Get bounding boxes for all words in phrase
-                boxes = [normalized_word_boxes[i + j][1] for j in range(len(phrase_words))]
-                
-                # Debug: print matched words
-                matched_words = [normalized_word_boxes[i + j][2] for j in range(len(phrase_words))]
-                print(f"DEBUG: Matched words: {matched_words}")
+        last_start = len(normalized_words) - len(phrase_words)
+        for i in sorted(word_matches[0]):
+            if i > last_start:
+                break
+            if all(i + j in word_matches[j] for j in range(1, len(phrase_words))):
+                # Merge the boxes of all words in the phrase into one bounding box
+                phrase_boxes = boxes[i:i + len(phrase_words)]
+                min_x = min(box[0] for box in phrase_boxes)
+                min_y = min(box[1] for box in phrase_boxes)
+                max_x = max(box[0] + box[2] for box in phrase_boxes)
+                max_y = max(box[1] + box[3] for box in phrase_boxes)
                 
-                # Merge boxes into one bounding box
-                if boxes:
-                    min_x = min(box[0] for box in boxes)
-                    min_y = min(box[1] for box in boxes)
-                    max_x = max(box[0] + box[2] for box in boxes)
-                    max_y = max(box[1] + box[3] for box in boxes)
-                    
-                    matched_boxes.append((min_x, min_y, max_x, max_y))
+                matched_boxes.append((min_x, min_y, max_x, max_y))
     
     return matched_boxes
 
@@ -162,35 +185,130 @@ def save_highlighted_image(image, output_path):
     image.save(output_path, 'PNG')
     print(f"DEBUG: Saved highlighted image to {output_path}")
 
-def highlight_plagiarism_in_images(images, matched_phrases):
+def dump_word_boxes(word_boxes):
+    """Serialize per-page OCR word boxes to compact JSON bytes."""
+    return json.dumps(word_boxes, separators=(',', ':')).encode('utf-8')
+
+def save_word_boxes(word_boxes, output_path):
+    """
+    Save per-page OCR word boxes as JSON so they can be reused later.
+    
+    Args:
+        word_boxes: List (one per page) of (word, (x, y, w, h)) lists
+        output_path: Path of the JSON file
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(dump_word_boxes(word_boxes))
+
+def load_word_boxes(path):
+    """
+    Load word boxes saved by save_word_boxes.
+    
+    Returns:
+        list: One list of (word, (x, y, w, h)) per page, or None if unavailable
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            pages = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return [[(word, tuple(box)) for word, box in page] for page in pages]
+
+def highlight_plagiarism_in_images(images, matched_phrases, word_boxes=None):
     """
     Process multiple images and highlight plagiarized text.
     
     Args:
         images: List of PIL Image objects (PDF pages)
         matched_phrases: List of matched n-gram strings
+        word_boxes: Optional list (one per image) of OCR word boxes from
+                    extraction. Pages without boxes are OCR'd here.
     
     Returns:
         list: List of highlighted PIL Images
     """
-    highlighted_images = []
-    
+    return list(iter_highlighted_images(images, matched_phrases, word_boxes))
+
+def iter_highlighted_images(images, matched_phrases, word_boxes=None):
+    """
+    Same as highlight_plagiarism_in_images, but yields one highlighted page
+    at a time so callers can save and drop each page before the next one.
+    """
     for page_num, image in enumerate(images, 1):
         print(f"DEBUG: Processing highlights for page {page_num}...")
         
-        # Extract text with bounding boxes
-        ocr_data = extract_text_with_boxes(image)
-        
-        # Build word-to-box mapping
-        word_boxes = build_word_to_box_mapping(ocr_data)
+        if word_boxes and page_num <= len(word_boxes) and word_boxes[page_num - 1] is not None:
+            # Reuse the boxes from the extraction OCR pass
+            page_boxes = word_boxes[page_num - 1]
+        else:
+            # Extract text with bounding boxes
+            ocr_data = extract_text_with_boxes(image)
+            
+            # Build word-to-box mapping
+            page_boxes = build_word_to_box_mapping(ocr_data)
         
         # Find boxes for matched phrases
-        matched_boxes = find_matched_boxes(word_boxes, matched_phrases)
+        matched_boxes = find_matched_boxes(page_boxes, matched_phrases)
         
         print(f"DEBUG: Found {len(matched_boxes)} highlight regions on page {page_num}")
         
         # Draw highlights
-        highlighted_img = draw_highlights(image, matched_boxes)
-        highlighted_images.append(highlighted_img)
+        yield draw_highlights(image, matched_boxes)
+
+@lru_cache(maxsize=4096)
+def _file_hash(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def page_content_hash(path):
+    """SHA-256 of an image file (memoized while the file is unchanged)."""
+    st = os.stat(path)
+    return _file_hash(path, st.st_size, st.st_mtime_ns)
+
+def match_set_hash(matched_phrases):
+    """Order-independent hash of a list of matched phrases."""
+    return hashlib.sha256('\n'.join(sorted(set(matched_phrases))).encode('utf-8')).hexdigest()
+
+def highlighted_page_key(image_path, matched_phrases):
+    """
+    Cache key (and ETag) of a highlighted page: (page content hash, match set
+    hash), plus the display rendition settings.
+    """
+    return f"{page_content_hash(image_path)[:32]}-{match_set_hash(matched_phrases)[:32]}-{RENDITION_TAG}"
+
+def get_highlighted_page(image_path, matched_phrases, load_page_boxes=None, cache_dir=HIGHLIGHT_CACHE_DIR):
+    """
+    Path of the highlighted version of one page image, rendering it only if
+    it is not cached yet.
+    
+    Args:
+        image_path: Raw page image
+        matched_phrases: List of matched n-gram strings
+        load_page_boxes: Optional callable returning the page's word boxes
+                         (only called on a cache miss; OCR is used if None)
+        cache_dir: Directory of rendered pages
     
-    return highlighted_images
+    Returns:
+        tuple: (path of the highlighted display rendition, cache key)
+    """
+    key = highlighted_page_key(image_path, matched_phrases)
+    cached_path = os.path.join(cache_dir, f"{key}{DISPLAY_EXTENSIONS[DISPLAY_IMAGE_FORMAT]}")
+    if os.path.exists(cached_path):
+        return cached_path, key
+    
+    page_boxes = load_page_boxes() if load_page_boxes else None
+    with Image.open(image_path) as image:
+        highlighted = next(iter_highlighted_images([image], matched_phrases, [page_boxes]))
+    
+    # Write under a temporary name so concurrent requests never serve a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    # Highlights are drawn at full resolution (word boxes use its coordinates), then downscaled
+    tmp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    display_rendition(highlighted).save(tmp_path, DISPLAY_IMAGE_FORMAT, **save_options())
+    os.replace(tmp_path, cached_path)
+    return cached_path, key
+
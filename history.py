@@ -0,0 +1,147 @@
+"""
+Check History Module
+
+Saves finished checks together with their documents and packed fingerprints,
+so results can be reopened later without re-running extraction or detection.
+All functions need an application context.
+"""
+
+import hashlib
+import json
+
+from models import db, Document, Fingerprint, Check
+from rabin_karp import fingerprint_text, winnow
+
+
+def document_fingerprints(processed_text, k=3, window=0):
+    """Fingerprint hashes (array('Q')) of a preprocessed text, winnowed if window > 0."""
+    _, hashes = fingerprint_text(processed_text, k)
+    if window:
+        hashes = winnow(hashes, window)[1]
+    return hashes
+
+
+def save_documents(owner_id, documents, k=3, window=0):
+    """
+    Store documents for a user, reusing earlier copies with the same content.
+
+    Every document gets fingerprints for (k, window), including reused
+    documents first saved with other settings; missing rows are written
+    with a single bulk insert.
+
+    Args:
+        owner_id: User ID
+        documents: List of dicts with 'name', 'text' and 'processed'
+        k: K-gram size
+        window: Winnowing window (0 = every k-gram)
+
+    Returns:
+        list: Document objects, in input order
+    """
+    window = window or 0
+    hashes = [hashlib.sha256(doc['processed'].encode('utf-8')).hexdigest() for doc in documents]
+    existing = {
+        d.content_hash: d for d in Document.query.filter(
+            Document.owner_id == owner_id, Document.content_hash.in_(set(hashes))
+        )
+    }
+
+    saved = []
+    for doc, content_hash in zip(documents, hashes):
+        document = existing.get(content_hash)
+        if document is None:
+            document = Document(owner_id=owner_id, name=doc['name'], content_hash=content_hash,
+                                text=doc['text'], processed=doc['processed'])
+            db.session.add(document)
+            existing[content_hash] = document
+        saved.append(document)
+
+    # Assign IDs, then insert the missing fingerprint blobs at once
+    db.session.flush()
+    document_ids = {document.id for document in saved}
+    fingerprinted = {row[0] for row in db.session.query(Fingerprint.document_id).filter(
+        Fingerprint.document_id.in_(document_ids), Fingerprint.k == k, Fingerprint.winnow_window == window
+    )}
+    rows = []
+    for document in existing.values():
+        if document.id in fingerprinted:
+            continue
+        values = document_fingerprints(document.processed, k, window)
+        rows.append({
+            'document_id': document.id,
+            'k': k,
+            'winnow_window': window,
+            'count': len(values),
+            'hashes': Fingerprint.pack(values)
+        })
+    if rows:
+        db.session.execute(db.insert(Fingerprint), rows)
+    db.session.commit()
+    return saved
+
+
+def record_check(user_id, kind, title, similarity_score=None, result=None,
+                 suspect_document=None, source_document=None, batch_id=None, job_id=None):
+    """
+    Save a finished check.
+
+    Args:
+        result: JSON-serializable template context (compare checks)
+        job_id: Queue job that ran the check; a retried job that already
+                recorded its check gets the existing one back
+
+    Returns:
+        Check
+    """
+    if job_id:
+        check = Check.query.filter_by(job_id=job_id).first()
+        if check is not None:
+            return check
+
+    check = Check(
+        user_id=user_id,
+        kind=kind,
+        title=title[:255],
+        similarity_score=similarity_score,
+        result=json.dumps(result) if result is not None else None,
+        suspect_document_id=suspect_document.id if suspect_document else None,
+        source_document_id=source_document.id if source_document else None,
+        batch_id=batch_id,
+        job_id=job_id
+    )
+    db.session.add(check)
+    db.session.commit()
+    return check
+
+
+def check_ids():
+    """IDs of every saved check."""
+    return {row[0] for row in db.session.query(Check.id)}
+
+
+def delete_checks_before(cutoff):
+    """
+    Delete checks created before `cutoff` (UTC datetime).
+
+    Returns:
+        list: IDs of the deleted checks
+    """
+    ids = [row[0] for row in db.session.query(Check.id).filter(Check.created_at < cutoff)]
+    if ids:
+        Check.query.filter(Check.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+    return ids
+
+
+def get_history(user_id, limit=50):
+    """A user's most recent checks (newest first)."""
+    return (Check.query
+            .filter_by(user_id=user_id)
+            .order_by(Check.created_at.desc())
+            .limit(limit)
+            .all())
+
+
+def get_check_result(check):
+    """The stored template context of a compare check."""
+    return json.loads(check.result) if check.result else None
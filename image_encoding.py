@@ -0,0 +1,154 @@
+"""
+Image Encoding Module
+
+Display renditions of page images and a small thread pool that encodes
+pages in the background. Full-resolution PNGs are still kept where the
+page is needed for OCR or highlighting; browsers get a downscaled WebP
+(or JPEG when Pillow has no WebP support) that is a fraction of the size.
+
+Pillow releases the GIL while compressing, so encoding threads overlap
+with extraction and OCR of the next document.
+"""
+
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+# Width in pixels of display renditions (0 = keep the original size)
+DISPLAY_IMAGE_WIDTH = int(os.environ.get('DISPLAY_IMAGE_WIDTH', 1200))
+DISPLAY_IMAGE_FORMAT = os.environ.get('DISPLAY_IMAGE_FORMAT', 'WEBP').upper()
+if DISPLAY_IMAGE_FORMAT == 'WEBP' and not features.check('webp'):
+    DISPLAY_IMAGE_FORMAT = 'JPEG'
+DISPLAY_IMAGE_QUALITY = int(os.environ.get('DISPLAY_IMAGE_QUALITY', 80))
+
+IMAGE_ENCODE_THREADS = int(os.environ.get('IMAGE_ENCODE_THREADS', min(4, os.cpu_count() or 1)))
+
+DISPLAY_EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg', 'PNG': '.png'}
+DISPLAY_MIMETYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+
+# Part of cache keys of rendered display images, so changing the settings
+# never serves renditions made with the old ones
+RENDITION_TAG = f"{DISPLAY_IMAGE_WIDTH}{DISPLAY_IMAGE_FORMAT.lower()}{DISPLAY_IMAGE_QUALITY}"
+
+
+def display_rendition(image, width=DISPLAY_IMAGE_WIDTH):
+    """
+    Downscale a page image for display (never upscales).
+
+    Returns:
+        PIL Image in a mode every display format can store
+    """
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if width and image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        # reducing_gap shrinks by an integer factor first, which is much
+        # faster than a full-size filter pass on 200-DPI scans
+        image = image.resize((width, height), Image.BILINEAR, reducing_gap=2.0)
+    return image
+
+
+def save_options(format=DISPLAY_IMAGE_FORMAT, quality=DISPLAY_IMAGE_QUALITY):
+    """Encoder arguments for Image.save."""
+    if format == 'WEBP':
+        return {'quality': quality, 'method': 2}
+    if format == 'JPEG':
+        return {'quality': quality, 'optimize': True}
+    return {}
+
+
+def encode_image(image, format, **options):
+    """Encode an image to bytes in the given format."""
+    buffer = io.BytesIO()
+    image.save(buffer, format, **options)
+    return buffer.getvalue()
+
+
+class ImageEncoder:
+    """
+    Bounded thread pool storing page images in an UploadStore.
+
+    At most `max_pending` images wait in the pool; submit() blocks beyond
+    that, so lazily rendered PDF pages are not all held in memory at once.
+    Counters cover the lifetime of the encoder.
+
+    Usage:
+        with ImageEncoder(store) as encoder:
+            future = encoder.submit(image, display=True)
+        path = future.result()
+    """
+
+    def __init__(self, store, max_workers=IMAGE_ENCODE_THREADS, max_pending=None):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='encode')
+        self._slots = threading.BoundedSemaphore(max_pending or max(1, max_workers) * 2)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.counters = {
+            'full_pages': 0,
+            'full_bytes': 0,
+            'display_pages': 0,
+            'display_bytes': 0,
+            'encode_seconds': 0.0,
+            'wait_seconds': 0.0
+        }
+
+    def submit(self, image, display=False):
+        """
+        Queue one image: a full-resolution PNG, or a display rendition.
+
+        Returns:
+            Future of the stored path (relative to static/)
+        """
+        wait_start = time.perf_counter()
+        self._slots.acquire()
+        self._count('wait_seconds', time.perf_counter() - wait_start)
+        try:
+            return self._executor.submit(self._encode, image, display)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _encode(self, image, display):
+        try:
+            start = time.perf_counter()
+            if display:
+                data = encode_image(display_rendition(image), DISPLAY_IMAGE_FORMAT, **save_options())
+                rel_path = self.store.put_bytes(data, DISPLAY_EXTENSIONS[DISPLAY_IMAGE_FORMAT])
+            else:
+                data = encode_image(image, 'PNG')
+                rel_path = self.store.put_bytes(data, '.png')
+            kind = 'display' if display else 'full'
+            with self._lock:
+                self.counters[f'{kind}_pages'] += 1
+                self.counters[f'{kind}_bytes'] += len(data)
+                self.counters['encode_seconds'] += time.perf_counter() - start
+            return rel_path
+        finally:
+            self._slots.release()
+
+    def _count(self, key, value):
+        with self._lock:
+            self.counters[key] += value
+
+    def stats(self):
+        """Counters plus wall time since the encoder was created (seconds, rounded)."""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['encode_seconds'] = round(stats['encode_seconds'], 3)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['wall_seconds'] = round(time.perf_counter() - self._started, 3)
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
@@ -0,0 +1,406 @@
+"""
+Job Queue Module
+
+SQLite-backed queue of background checks. Web requests enqueue a job and
+return immediately; worker processes claim jobs, run them and store the
+result, while the browser polls the job status.
+
+Run standalone workers (e.g. next to gunicorn with JOB_WORKERS=0) with:
+    python job_queue.py [number_of_workers]
+"""
+
+import atexit
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+from database import apply_sqlite_pragmas
+
+DEFAULT_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', 'jobs.db')
+
+# A running job whose worker process is gone, or whose heartbeat has not
+# been refreshed for this long, is considered abandoned and picked up again.
+# Workers refresh the heartbeat every JOB_STALE_SECONDS / 3 while a job runs.
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 600))
+
+# Seconds an idle worker waits before polling the queue again
+JOB_POLL_INTERVAL = 0.5
+
+# Seconds between checks for dead workers when run standalone
+WORKER_CHECK_INTERVAL = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id INTEGER,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS cache_stats (
+    name TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    evictions INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Jobs that crashed their worker this many times are failed instead of retried
+MAX_ATTEMPTS = 2
+
+
+def worker_id():
+    """Identifies the current worker process: 'hostname:pid'."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _worker_alive(worker):
+    """
+    False only if the worker ran on this host and its process is gone;
+    workers on other hosts are judged by their heartbeat alone.
+    """
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_abandoned(worker, heartbeat_at, now):
+    return heartbeat_at is None or heartbeat_at < now - JOB_STALE_SECONDS or not _worker_alive(worker)
+
+
+class JobQueue:
+    """
+    Persistent job queue shared by web and worker processes.
+
+    Job states: 'queued' -> 'running' -> 'done' or 'failed'.
+    Payloads and results are stored as JSON.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Queues created before workers recorded heartbeats
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, column_type in (('worker', 'TEXT'), ('heartbeat_at', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            apply_sqlite_pragmas(conn)
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, kind, payload, user_id=None):
+        """
+        Add a job to the queue.
+
+        Returns:
+            str: Job ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, user_id, status, message, payload, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, user_id, 'queued', 'Menunggu antrean...', json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def claim(self):
+        """
+        Atomically take the oldest queued (or abandoned) job.
+
+        A running job is only taken over when its worker process is gone or
+        its heartbeat is older than JOB_STALE_SECONDS, never while it still runs.
+
+        Returns:
+            dict with 'id', 'kind', 'user_id', 'payload', or None if the queue is empty
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT id, kind, user_id, payload, attempts FROM jobs "
+                    "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    row = next((
+                        (job_id, kind, user_id, payload, attempts)
+                        for job_id, kind, user_id, payload, attempts, worker, heartbeat_at in conn.execute(
+                            "SELECT id, kind, user_id, payload, attempts, worker, heartbeat_at FROM jobs "
+                            "WHERE status = 'running' ORDER BY created_at"
+                        )
+                        if _is_abandoned(worker, heartbeat_at, now)
+                    ), None)
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+
+                job_id, kind, user_id, payload, attempts = row
+                if attempts >= MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                        ('Worker stopped while running this job.', now, now, job_id)
+                    )
+                    conn.execute('COMMIT')
+                    return None
+
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, progress = 0, "
+                    "message = ?, worker = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                    ('Memulai...', worker_id(), now, now, job_id)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+        return {'id': job_id, 'kind': kind, 'user_id': user_id, 'payload': json.loads(payload)}
+
+    def update_progress(self, job_id, progress, message=None):
+        """Record progress (0-100) and an optional status message; also serves as heartbeat."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET progress = ?, message = COALESCE(?, message), heartbeat_at = ?, updated_at = ? '
+                'WHERE id = ?',
+                (round(progress, 1), message, now, now, job_id)
+            )
+
+    def heartbeat(self, job_id):
+        """Mark a running job as still alive without changing its progress."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                         (time.time(), job_id))
+
+    def finish(self, job_id, result):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', progress = 100, message = 'Selesai', result = ?, "
+                "updated_at = ?, finished_at = ? WHERE id = ?",
+                (json.dumps(result), now, now, job_id)
+            )
+
+    def fail(self, job_id, error):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                (error, now, now, job_id)
+            )
+
+    def status(self, job_id):
+        """
+        Returns:
+            dict with 'id', 'kind', 'user_id', 'status', 'progress', 'message',
+            'error' (without the result), or None for unknown jobs.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id, kind, user_id, status, progress, message, error FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'kind', 'user_id', 'status', 'progress', 'message', 'error')
+        return dict(zip(keys, row))
+
+    def result(self, job_id):
+        """Returns the stored result of a finished job, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def add_cache_stats(self, name, hits, misses, evictions):
+        """Add one process's cache counters to the totals shared by all workers."""
+        if not (hits or misses or evictions):
+            return
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO cache_stats (name, hits, misses, evictions) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET hits = hits + excluded.hits, '
+                'misses = misses + excluded.misses, evictions = evictions + excluded.evictions',
+                (name, hits, misses, evictions)
+            )
+
+    def cache_stats(self):
+        """
+        Returns:
+            dict: cache name -> {'hits', 'misses', 'evictions', 'hit_rate'}
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT name, hits, misses, evictions FROM cache_stats').fetchall()
+        return {
+            name: {
+                'hits': hits,
+                'misses': misses,
+                'evictions': evictions,
+                'hit_rate': round(hits / (hits + misses) * 100, 2) if hits + misses else 0.0
+            }
+            for name, hits, misses, evictions in rows
+        }
+
+
+def record_cache_stats(queue):
+    """Add this process's stem and extraction cache counters to the queue's shared totals."""
+    from file_parser import extraction_cache
+    from preprocessing import stem_cache
+
+    try:
+        queue.add_cache_stats('stem', *stem_cache.take_counts())
+        if extraction_cache:
+            queue.add_cache_stats('extraction', *extraction_cache.take_counts())
+    except sqlite3.Error as e:
+        print(f"DEBUG: Could not record cache stats: {e}")
+
+
+def run_job(queue, job):
+    """Run one claimed job with its handler and store the outcome."""
+    from checks import JOB_HANDLERS
+
+    job_id = job['id']
+    handler = JOB_HANDLERS.get(job['kind'])
+    if handler is None:
+        queue.fail(job_id, f"Unknown job type: {job['kind']}")
+        return
+
+    def progress(percent, message=None):
+        queue.update_progress(job_id, percent, message)
+
+    # Stages without progress calls (OCR of a long PDF, the preprocessing
+    # pool, pair scoring) can outlast JOB_STALE_SECONDS; the heartbeat keeps
+    # other workers from taking over a job that is still running
+    stop_heartbeat = threading.Event()
+
+    def beat():
+        while not stop_heartbeat.wait(JOB_STALE_SECONDS / 3):
+            try:
+                queue.heartbeat(job_id)
+            except sqlite3.Error as e:
+                print(f"DEBUG: Heartbeat for job {job_id} failed: {e}")
+
+    heartbeat = threading.Thread(target=beat, name=f'heartbeat-{job_id}', daemon=True)
+
+    print(f"DEBUG: Job {job_id} ({job['kind']}) started")
+    start = time.time()
+    heartbeat.start()
+    try:
+        result = handler(job['payload'], job['user_id'], progress, job_id=job_id)
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job_id, str(e))
+        return
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+    queue.finish(job_id, result)
+    print(f"DEBUG: Job {job_id} finished in {time.time() - start:.2f}s")
+
+
+def worker_loop(path=DEFAULT_QUEUE_PATH, stop_when_empty=False):
+    """Claim and run jobs forever (or until the queue is empty)."""
+    from preprocessing import save_stem_cache
+
+    queue = JobQueue(path)
+    while True:
+        job = queue.claim()
+        if job is None:
+            if stop_when_empty:
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        run_job(queue, job)
+        # Worker processes are terminated, so atexit hooks never run here
+        save_stem_cache()
+        record_cache_stats(queue)
+
+
+_workers = []
+
+
+def start_workers(count, path=DEFAULT_QUEUE_PATH):
+    """
+    Keep `count` worker processes running.
+
+    Called on every enqueue: workers that died (crash, OOM kill) are
+    pruned and replaced. Workers are regular (non-daemon) processes because
+    checks use process pools of their own; they are terminated when the
+    parent exits.
+    """
+    if count <= 0:
+        return _workers
+    dead = [process for process in _workers if not process.is_alive()]
+    for process in dead:
+        process.join(timeout=0)
+        _workers.remove(process)
+        print(f"DEBUG: Job worker {process.pid} exited with code {process.exitcode}, restarting")
+
+    missing = count - len(_workers)
+    if missing <= 0:
+        return _workers
+    first_start = not _workers and not dead
+    for _ in range(missing):
+        process = multiprocessing.Process(target=worker_loop, args=(path,), name='job-worker')
+        process.start()
+        _workers.append(process)
+    if first_start:
+        # After start(): multiprocessing's own exit hook, which joins the
+        # workers, must run after this one
+        atexit.register(stop_workers)
+    print(f"DEBUG: Started {missing} job workers")
+    return _workers
+
+
+def stop_workers():
+    for process in _workers:
+        if process.is_alive():
+            process.terminate()
+    for process in _workers:
+        process.join(timeout=5)
+    _workers.clear()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get('JOB_WORKERS', 2))
+    try:
+        while True:
+            start_workers(count)
+            time.sleep(WORKER_CHECK_INTERVAL)
+    except KeyboardInterrupt:
+        stop_workers()
@@ -0,0 +1,173 @@
+"""
+MinHash / LSH Module
+
+Finds candidate document pairs, so batch comparison only runs the exact
+scoring on pairs that are likely to be similar: bottom-k samples estimate
+k-gram containment (a short document copied into a long one) and MinHash
+signatures with LSH banding find pairs with similar word sets.
+"""
+
+from collections import Counter, defaultdict
+from itertools import combinations
+
+import numpy as np
+
+HASH_BITS = 64
+
+# Odd 64-bit constant spreading the occurrence number of repeated fingerprints
+OCCURRENCE_STEP = np.uint64(0x9E3779B97F4A7C15)
+
+
+def minhash_signature(fingerprints, num_perm=128):
+    """
+    Compute a MinHash signature using one-permutation hashing.
+
+    The fingerprints are already uniformly distributed 64-bit hashes, so
+    each one is assigned to a bin by its value modulo num_perm and only the
+    minimum per bin is kept. Empty bins are filled from the next non-empty
+    bin (rotation densification). One pass over the set, instead of one
+    pass per permutation.
+
+    Args:
+        fingerprints: Iterable of unsigned 64-bit k-gram hashes
+        num_perm: Signature length
+
+    Returns:
+        tuple of ints, or None if the document has no fingerprints
+    """
+    empty = 1 << HASH_BITS
+    bins = [empty] * num_perm
+    for fp in fingerprints:
+        slot, value = fp % num_perm, fp // num_perm
+        if value < bins[slot]:
+            bins[slot] = value
+
+    filled = [i for i, v in enumerate(bins) if v != empty]
+    if not filled:
+        return None
+
+    if len(filled) < num_perm:
+        # Densify: every empty bin borrows from the next filled bin (circularly),
+        # offset by the distance so borrowed values stay distinguishable
+        nxt = filled[0] + num_perm
+        for i in range(num_perm - 1, -1, -1):
+            if bins[i] != empty:
+                nxt = i
+            else:
+                bins[i] = bins[nxt % num_perm] + (nxt - i) * empty
+
+    return tuple(bins)
+
+
+def lsh_threshold(bands, rows):
+    """Approximate Jaccard similarity at which a pair has a 50% chance to become a candidate."""
+    return (1 / bands) ** (1 / rows)
+
+
+def lsh_candidate_pairs(signatures, bands=128, rows=2):
+    """
+    Find candidate pairs with LSH banding.
+
+    Each signature is split into `bands` bands of `rows` values. Two documents
+    become candidates when at least one band is identical. More bands / fewer
+    rows favour recall; fewer bands / more rows favour pruning.
+
+    Args:
+        signatures: List of signatures (None for documents without fingerprints)
+        bands: Number of bands
+        rows: Values per band (bands * rows must not exceed the signature length)
+
+    Returns:
+        set of (i, j) index pairs with i < j
+    """
+    candidates = set()
+    for band in range(bands):
+        start = band * rows
+        buckets = defaultdict(list)
+        for idx, sig in enumerate(signatures):
+            if sig is None:
+                continue
+            buckets[sig[start:start + rows]].append(idx)
+
+        for members in buckets.values():
+            if len(members) > 1:
+                candidates.update(combinations(members, 2))
+
+    return candidates
+
+
+def _mix64(values):
+    """splitmix64 finalizer: a bijective remix of uint64 values."""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def occurrence_sample(fingerprints, sample_size=128):
+    """
+    Bottom-k sample of a fingerprint multiset.
+
+    Each occurrence gets its own hash (the fingerprint itself for the first
+    one, a remix of fingerprint and occurrence number for repeats) and the
+    sample_size smallest are kept, so a fingerprint is sampled in
+    proportion to how often it occurs, as the Rabin-Karp score counts it.
+
+    Args:
+        fingerprints: Sequence of unsigned 64-bit hashes, with repeats
+        sample_size: Occurrences to sample
+
+    Returns:
+        list of fingerprints (repeats possible); all of them if there are
+        no more than sample_size
+    """
+    values = np.asarray(fingerprints, dtype=np.uint64)
+    if len(values) <= sample_size:
+        return values.tolist()
+
+    ordered = np.sort(values)
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    occurrence = np.arange(len(ordered)) - np.repeat(starts, np.diff(np.r_[starts, len(ordered)]))
+
+    keys = ordered.copy()
+    repeats = occurrence > 0
+    keys[repeats] = _mix64(ordered[repeats] ^ (occurrence[repeats].astype(np.uint64) * OCCURRENCE_STEP))
+    return ordered[np.argpartition(keys, sample_size - 1)[:sample_size]].tolist()
+
+
+def containment_candidate_pairs(fingerprints, sample_size=256, threshold=0.088):
+    """
+    Find pairs where one document is estimated to be largely contained in the other.
+
+    Each document is represented by a uniform sample of its fingerprint
+    occurrences (see occurrence_sample); the share of that sample found in
+    another document estimates containment with repeats, the measure the
+    Rabin-Karp score uses. Unlike Jaccard-based LSH this keeps short
+    documents copied into long ones. Documents with no more fingerprints
+    than the sample are compared exactly.
+
+    Args:
+        fingerprints: List of fingerprint sequences (one per document, with repeats)
+        sample_size: Occurrences sampled per document
+        threshold: Minimum estimated containment (0-1)
+
+    Returns:
+        set of (i, j) index pairs with i < j
+    """
+    samples = [occurrence_sample(values, sample_size) for values in fingerprints]
+    sampled = set().union(*samples)
+
+    # Which documents contain each sampled value
+    postings = defaultdict(list)
+    for idx, values in enumerate(fingerprints):
+        for value in sampled.intersection(values):
+            postings[value].append(idx)
+
+    candidates = set()
+    for idx, sample in enumerate(samples):
+        if not sample:
+            continue
+        hits = Counter(other for value in sample for other in postings[value] if other != idx)
+        needed = threshold * len(sample)
+        candidates.update((min(idx, other), max(idx, other))
+                          for other, count in hits.items() if count >= needed)
+    return candidates
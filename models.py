@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from array import array
 
 db = SQLAlchemy()
 
@@ -34,3 +35,79 @@ class User(UserMixin, db.Model):
     
     def __repr__(self):
         return f'<User {self.email}>'
+
+
+class Document(db.Model):
+    """A checked document (uploaded file or pasted text) owned by a user"""
+    __tablename__ = 'documents'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the preprocessed text
+    text = db.Column(db.Text, nullable=False)
+    processed = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    fingerprints = db.relationship('Fingerprint', backref='document', cascade='all, delete-orphan',
+                                   passive_deletes=True)
+    
+    __table_args__ = (
+        db.Index('ix_documents_owner_created', 'owner_id', 'created_at'),
+        db.Index('ix_documents_owner_hash', 'owner_id', 'content_hash'),
+    )
+    
+    def __repr__(self):
+        return f'<Document {self.name}>'
+
+
+class Fingerprint(db.Model):
+    """K-gram fingerprints of a document, packed as a native array('Q') blob"""
+    __tablename__ = 'fingerprints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='CASCADE'), nullable=False)
+    k = db.Column(db.Integer, nullable=False)
+    winnow_window = db.Column(db.Integer, nullable=False, default=0)  # 0 = every k-gram
+    count = db.Column(db.Integer, nullable=False)
+    hashes = db.Column(db.LargeBinary, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('document_id', 'k', 'winnow_window'),
+    )
+    
+    @staticmethod
+    def pack(hashes):
+        """Pack 64-bit hashes into bytes (8 bytes each, native byte order)"""
+        return array('Q', hashes).tobytes()
+    
+    def __repr__(self):
+        return f'<Fingerprint doc={self.document_id} k={self.k} n={self.count}>'
+
+
+class Check(db.Model):
+    """A finished plagiarism check, kept so its results can be reopened"""
+    __tablename__ = 'checks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'compare' or 'batch'
+    job_id = db.Column(db.String(32), unique=True)
+    suspect_document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='SET NULL'))
+    source_document_id = db.Column(db.Integer, db.ForeignKey('documents.id', ondelete='SET NULL'))
+    batch_id = db.Column(db.String(32))  # Batch store ID for 'batch' checks
+    title = db.Column(db.String(255), nullable=False)
+    similarity_score = db.Column(db.Float)  # Highest score for batches
+    result = db.Column(db.Text)  # JSON template context for 'compare' checks
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    suspect_document = db.relationship('Document', foreign_keys=[suspect_document_id])
+    source_document = db.relationship('Document', foreign_keys=[source_document_id])
+    
+    __table_args__ = (
+        db.Index('ix_checks_user_created', 'user_id', 'created_at'),
+        db.Index('ix_checks_created', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<Check {self.kind} {self.title}>'
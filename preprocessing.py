@@ -1,14 +1,161 @@
+import atexit
+import json
+import os
 import re
+import threading
+from array import array
+from collections import OrderedDict
+from Sastrawi.Dictionary.ArrayDictionary import ArrayDictionary
+from Sastrawi.Stemmer.Filter import TextNormalizer
+from Sastrawi.Stemmer.Stemmer import Stemmer
 from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
 from Sastrawi.StopWordRemover.StopWordRemoverFactory import StopWordRemoverFactory
 
-# Initialize Sastrawi factories once to avoid overhead
+# Word-level stem cache settings
+STEM_CACHE_SIZE = int(os.environ.get('STEM_CACHE_SIZE', 100000))
+STEM_CACHE_PATH = os.environ.get('STEM_CACHE_PATH', 'stem_cache.json')
+
+# Stored with cached preprocessed text (see file_parser.cache_processed_text);
+# bump when the output of preprocess_text changes so stale copies are redone
+PREPROCESS_VERSION = 1
+
+
+class StemCache:
+    """
+    Bounded LRU cache from surface word to stem.
+
+    One instance is shared by every request handled in a worker. Sastrawi's
+    own CachedStemmer keeps an unbounded dict per stemmer; this replaces it
+    with a size limit, hit-rate statistics and save/load to a local file so
+    new workers start warm.
+    """
+
+    def __init__(self, stem_func, max_size=STEM_CACHE_SIZE):
+        self.stem_func = stem_func
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reported = (0, 0, 0)
+        self._dirty = False
+
+    def stem(self, word):
+        with self._lock:
+            stem = self._entries.get(word)
+            if stem is not None:
+                self._entries.move_to_end(word)
+                self.hits += 1
+                return stem
+            self.misses += 1
+
+        stem = self.stem_func(word)
+
+        with self._lock:
+            self._entries[word] = stem
+            self._dirty = True
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return stem
+
+    def stats(self):
+        """Returns cache size and hit-rate statistics."""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total * 100, 2) if total else 0.0
+        }
+
+    def take_counts(self):
+        """(hits, misses, evictions) since the previous call, for shared metrics."""
+        with self._lock:
+            current = (self.hits, self.misses, self.evictions)
+            deltas = tuple(now - before for now, before in zip(current, self._reported))
+            self._reported = current
+        return deltas
+
+    def add_counts(self, hits, misses, evictions):
+        """Add counts taken in another process (e.g. a pool child)."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def save(self, path):
+        """Write the cache to a JSON file (least recently used first)."""
+        with self._lock:
+            entries = list(self._entries.items())
+            self._dirty = False
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Load entries saved by save(). Missing or unreadable files are ignored."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return 0
+
+        with self._lock:
+            for word, stem in entries[-self.max_size:]:
+                self._entries[word] = stem
+                self._entries.move_to_end(word)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return len(entries)
+
+
+# Initialize Sastrawi once to avoid overhead
 stemmer_factory = StemmerFactory()
-stemmer = stemmer_factory.create_stemmer()
+stemmer = Stemmer(ArrayDictionary(stemmer_factory.get_words()))
 
 stopword_factory = StopWordRemoverFactory()
 stopword_remover = stopword_factory.create_stop_word_remover()
 
+stem_cache = StemCache(stemmer.stem)
+stem_cache.load(STEM_CACHE_PATH)
+
+
+def save_stem_cache(path=STEM_CACHE_PATH):
+    """
+    Persist the stem cache so the next worker starts warm.
+
+    atexit does not run in multiprocessing children, so job workers call
+    this after every job and pool tasks before they return. Does nothing
+    when no word was stemmed since the last save.
+    """
+    if not stem_cache._dirty:
+        return
+    try:
+        stem_cache.save(path)
+    except OSError as e:
+        print(f"DEBUG: Could not save stem cache: {e}")
+
+atexit.register(save_stem_cache)
+
+
+def get_stem_cache_stats():
+    return stem_cache.stats()
+
+
+def stem_text(text):
+    """
+    Stems a text word by word through the shared cache.
+    Same output as Sastrawi's CachedStemmer.stem.
+    """
+    words = TextNormalizer.normalize_text(text).split(' ')
+    return ' '.join(stem_cache.stem(word) for word in words)
+
+
 def preprocess_text(text):
     """
     Preprocesses the input text by:
@@ -31,9 +178,60 @@ def preprocess_text(text):
     text = stopword_remover.remove(text)
 
     # 4. Stemming
-    text = stemmer.stem(text)
+    text = stem_text(text)
 
     # Remove extra whitespace
     text = re.sub(r'\s+', ' ', text).strip()
 
     return text
+
+
+_CHUNK_RE = re.compile(r'[^ ]+')
+_PIECE_RE = re.compile(r'\S+')
+_REMOVED_CHARS_RE = re.compile(r'[^a-z0-9\s]')
+_ALNUM_SPAN_RE = re.compile(r'[A-Za-z0-9](?:.*[A-Za-z0-9])?', re.DOTALL)
+
+
+def preprocess_with_offsets(text):
+    """
+    Same preprocessing as preprocess_text, but keeps track of where every
+    surviving token came from in the original text.
+
+    Returns:
+        tuple: (tokens, offsets)
+            - tokens (list): Processed tokens; ' '.join(tokens) equals
+              preprocess_text(text).
+            - offsets (array): array('I') of 2 * len(tokens) character offsets
+              into `text`; token i spans text[offsets[2*i]:offsets[2*i+1]].
+    """
+    tokens = []
+    offsets = array('I')
+    if not text:
+        return tokens, offsets
+
+    # Stopwords are removed per space-separated chunk, exactly like
+    # Sastrawi's StopWordRemover does on the cleaned text
+    for chunk_match in _CHUNK_RE.finditer(text):
+        chunk = chunk_match.group()
+        cleaned = _REMOVED_CHARS_RE.sub('', chunk.lower())
+        if not cleaned.strip() or stopword_remover.dictionary.contains(cleaned):
+            continue
+
+        chunk_start = chunk_match.start()
+        for piece_match in _PIECE_RE.finditer(chunk):
+            word = _REMOVED_CHARS_RE.sub('', piece_match.group().lower())
+            if not word:
+                continue
+
+            # Trim surrounding punctuation from the highlighted span
+            start, end = piece_match.span()
+            alnum = _ALNUM_SPAN_RE.search(chunk, start, end)
+            if alnum:
+                start, end = alnum.span()
+
+            for stem in stem_cache.stem(word).split():
+                tokens.append(stem)
+                offsets.append(chunk_start + start)
+                offsets.append(chunk_start + end)
+
+    return tokens, offsets
@@ -1,79 +1,316 @@
-def generate_ngrams(text, k):
-    """Generates k-grams (substrings of length k words) from the text."""
+import hashlib
+import heapq
+from array import array
+from collections import deque
+
+# Polynomial rolling hash parameters.
+# Every k-gram is hashed as sum(id_i * BASE^(k-1-i)) mod 2^64, where id_i is a
+# stable 64-bit ID of the i-th word. The values do not depend on PYTHONHASHSEED,
+# so fingerprints are identical across workers and restarts.
+HASH_BASE = 1000003
+HASH_MASK = (1 << 64) - 1
+
+
+def token_id(word):
+    """Returns a stable 64-bit integer ID for a single word."""
+    digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def tokens_to_ids(words):
+    """
+    Converts a list of words into an array of 64-bit token IDs.
+    Each distinct word is hashed only once.
+    """
+    ids = array('Q')
+    seen = {}
+    for word in words:
+        word_id = seen.get(word)
+        if word_id is None:
+            word_id = token_id(word)
+            seen[word] = word_id
+        ids.append(word_id)
+    return ids
+
+def rolling_hashes(ids, k):
+    """
+    Computes the Rabin-Karp rolling hash of every k-gram in a token ID array.
+
+    Args:
+        ids (array): Token IDs as returned by tokens_to_ids.
+        k (int): The length of the k-gram (in tokens).
+
+    Returns:
+        array: array('Q') where item i is the hash of ids[i:i+k].
+    """
+    hashes = array('Q')
+    n = len(ids)
+    if k <= 0 or n < k:
+        return hashes
+
+    # BASE^(k-1), used to remove the outgoing token from the window
+    high = pow(HASH_BASE, k - 1, 1 << 64)
+
+    base = HASH_BASE
+    mask = HASH_MASK
+    h = 0
+    for i in range(k):
+        h = (h * base + ids[i]) & mask
+    hashes.append(h)
+
+    append = hashes.append
+    for outgoing, incoming in zip(ids, ids[k:]):
+        h = ((h - outgoing * high) * base + incoming) & mask
+        append(h)
+    return hashes
+
+def fingerprint_text(text, k):
+    """
+    Tokenizes a preprocessed text once and fingerprints all of its k-grams.
+
+    Returns:
+        tuple: (words, hashes) where hashes[i] fingerprints words[i:i+k].
+    """
     words = text.split()
-    if len(words) < k:
-        return []
-    
-    ngrams = []
-    for i in range(len(words) - k + 1):
-        ngram = " ".join(words[i:i+k])
-        ngrams.append(ngram)
-    return ngrams
+    return words, rolling_hashes(tokens_to_ids(words), k)
+
+def winnow(hashes, window):
+    """
+    Selects fingerprints with MOSS-style (robust) winnowing.
+
+    Keeps the minimum hash of every window of `window` consecutive k-gram
+    hashes, recording each selection once. On ties the previously selected
+    position is kept while it is still in the window; otherwise the
+    rightmost minimum is taken, so runs of equal hashes (repeated text)
+    do not select the same value over and over. Any shared passage of at
+    least window + k - 1 words is guaranteed to share at least one
+    selected fingerprint.
+
+    Args:
+        hashes (array): K-gram hashes as returned by rolling_hashes.
+        window (int): Number of consecutive k-grams per window.
+
+    Returns:
+        tuple: (positions, selected) where selected[i] == hashes[positions[i]].
+    """
+    positions = array('L')
+    selected = array('Q')
+    n = len(hashes)
+    if n == 0:
+        return positions, selected
+
+    # Documents shorter than one window still get their minimum selected
+    window = max(1, min(window, n))
+
+    candidates = deque()  # positions with increasing hash values
+    last = -1
+    for i, h in enumerate(hashes):
+        while candidates and hashes[candidates[-1]] >= h:
+            candidates.pop()
+        candidates.append(i)
+        if candidates[0] <= i - window:
+            candidates.popleft()
+        if i < window - 1:
+            continue
+        minimum = candidates[0]
+        if minimum == last or (last > i - window and hashes[last] == hashes[minimum]):
+            continue
+        last = minimum
+        positions.append(last)
+        selected.append(hashes[last])
+    return positions, selected
+
+def prepare_document(processed_text, k=5, window=None):
+    """
+    Tokenizes and fingerprints a preprocessed text once, so it can be
+    compared against any number of other documents.
+
+    Args:
+        processed_text (str): Preprocessed text.
+        k (int): The length of the k-gram (in words).
+        window (int, optional): Winnowing window size.
 
-def calculate_hash(text):
+    Returns:
+        dict: {
+            'k': int,
+            'words': list of tokens,
+            'word_set': set of distinct tokens,
+            'hashes': array('Q') of every k-gram hash,
+            'positions': k-gram positions of the selected fingerprints,
+            'fingerprints': array('Q') of the selected fingerprints,
+            'fingerprint_set': set of the selected fingerprints
+        }
     """
-    Calculates a simple hash for a string.
-    In a real-world scenario, a rolling hash is more efficient,
-    but for this demo with word-level k-grams, Python's built-in hash is sufficient and robust.
+    words, hashes = fingerprint_text(processed_text, k)
+    if window:
+        positions, fingerprints = winnow(hashes, window)
+    else:
+        positions, fingerprints = range(len(hashes)), hashes
+
+    return {
+        'k': k,
+        'words': words,
+        'word_set': set(words),
+        'hashes': hashes,
+        'positions': positions,
+        'fingerprints': fingerprints,
+        'fingerprint_set': set(fingerprints)
+    }
+
+def find_match_spans(suspect, source):
+    """
+    Finds copied passages as token-position spans in both documents.
+
+    Consecutive matching k-grams on the same diagonal are merged into maximal
+    common runs, then runs are tiled greedily (longest first, similar to
+    greedy string tiling) so that every token is covered at most once on
+    each side. Runs overlapping an earlier tile keep their untiled part
+    when it is still at least k tokens long.
+
+    Args:
+        suspect (dict): Profile from prepare_document.
+        source (dict): Profile from prepare_document (same k).
+
+    Returns:
+        list: Dicts with 'suspect_start', 'suspect_end', 'source_start',
+              'source_end' (token positions, end exclusive) and 'length'
+              (tokens), sorted by suspect position.
     """
-    return hash(text)
+    k = suspect['k']
+
+    source_positions = {}
+    for j, h in enumerate(source['hashes']):
+        source_positions.setdefault(h, []).append(j)
+
+    # active[j] = (i0, j0): a run that currently ends with source k-gram j
+    runs = []
+    active = {}
+    for i, h in enumerate(suspect['hashes']):
+        extended = {}
+        for j in source_positions.get(h, ()):
+            extended[j] = active.pop(j - 1, None) or (i, j)
+        for j, (i0, j0) in active.items():
+            runs.append((i - i0, i0, j0))
+        active = extended
+    end = len(suspect['hashes'])
+    for j, (i0, j0) in active.items():
+        runs.append((end - i0, i0, j0))
 
-def detect_plagiarism(suspect_text, source_text, k=5):
+    # Greedy tiling: longest runs first. A run touching tiled tokens is
+    # clipped to its untiled stretches, which go back into the queue if
+    # they are still at least k tokens long
+    suspect_marked = bytearray(len(suspect['words']))
+    source_marked = bytearray(len(source['words']))
+    queue = [(-(count + k - 1), i0, j0) for count, i0, j0 in runs]
+    heapq.heapify(queue)
+    spans = []
+    while queue:
+        length, i0, j0 = heapq.heappop(queue)
+        length = -length
+        if 1 in suspect_marked[i0:i0 + length] or 1 in source_marked[j0:j0 + length]:
+            start = None
+            for t in range(length + 1):
+                free = t < length and not suspect_marked[i0 + t] and not source_marked[j0 + t]
+                if free and start is None:
+                    start = t
+                elif not free and start is not None:
+                    if t - start >= k:
+                        heapq.heappush(queue, (start - t, i0 + start, j0 + start))
+                    start = None
+            continue
+        suspect_marked[i0:i0 + length] = b'\x01' * length
+        source_marked[j0:j0 + length] = b'\x01' * length
+        spans.append({
+            'suspect_start': i0,
+            'suspect_end': i0 + length,
+            'source_start': j0,
+            'source_end': j0 + length,
+            'length': length
+        })
+
+    spans.sort(key=lambda span: span['suspect_start'])
+    return spans
+
+def detect_plagiarism(suspect_text, source_text, k=5, window=None, return_spans=False):
     """
-    Detects plagiarism using the Rabin-Karp algorithm concept (hashing k-grams).
-    
+    Detects plagiarism using the Rabin-Karp algorithm (rolling hash over k-grams).
+
     Args:
         suspect_text (str): The text to check (preprocessed).
         source_text (str): The original source text (preprocessed).
         k (int): The length of the k-gram (in words).
-        
+        window (int, optional): Winnowing window size. When set, only the
+            winnowed fingerprints of both documents are matched and scored.
+        return_spans (bool): Also return copied passages as token spans.
+
     Returns:
         dict: A dictionary containing:
             - similarity_score (float): Percentage of matching k-grams.
             - matches (list): List of matching k-grams.
+            - spans (list): Only with return_spans, see find_match_spans.
+            - longest_match (int): Only with return_spans, length in tokens
+              of the longest copied passage.
     """
-    suspect_ngrams = generate_ngrams(suspect_text, k)
-    source_ngrams = generate_ngrams(source_text, k)
-    
-    if not suspect_ngrams:
+    return compare_documents(prepare_document(suspect_text, k, window),
+                             prepare_document(source_text, k, window),
+                             return_spans=return_spans)
+
+def compare_documents(suspect, source, return_spans=False):
+    """
+    Scores two documents prepared with prepare_document (same k and window).
+
+    Returns:
+        dict: Same as detect_plagiarism.
+    """
+    result = _score_documents(suspect, source)
+    if return_spans:
+        spans = find_match_spans(suspect, source)
+        result['spans'] = spans
+        result['longest_match'] = max((span['length'] for span in spans), default=0)
+    return result
+
+def _score_documents(suspect, source):
+    k = suspect['k']
+    suspect_words = suspect['words']
+    suspect_hashes = suspect['fingerprints']
+
+    if not suspect_hashes:
         return {"similarity_score": 0.0, "matches": []}
 
-    # Create a set of hashes for the source n-grams for O(1) lookups
-    source_hashes = set(calculate_hash(ngram) for ngram in source_ngrams)
-    
+    source_set = source['fingerprint_set']
+
     matches = []
     match_count = 0
-    
-    for ngram in suspect_ngrams:
-        ngram_hash = calculate_hash(ngram)
-        if ngram_hash in source_hashes:
-            matches.append(ngram)
+
+    for i, ngram_hash in zip(suspect['positions'], suspect_hashes):
+        if ngram_hash in source_set:
+            # Only matching k-grams are ever joined back into strings
+            matches.append(" ".join(suspect_words[i:i+k]))
             match_count += 1
-            
+
     # Calculate similarity score (Rabin-Karp)
-    # Formula: (Matches / Total Suspect N-grams) * 100
-    rk_score = (match_count / len(suspect_ngrams)) * 100 if suspect_ngrams else 0.0
-    
+    # Formula: (Matches / Total Suspect Fingerprints) * 100
+    rk_score = (match_count / len(suspect_hashes)) * 100
+
     # --- HYBRID IMPROVEMENT: JACCARD SIMILARITY ---
     # Calculates word overlap to detect paraphrasing
-    suspect_words = set(suspect_text.split())
-    source_words = set(source_text.split())
-    
+    suspect_word_set = suspect['word_set']
+    source_word_set = source['word_set']
+
     # Filter short words to avoid noise in highlighting
-    intersection = {w for w in suspect_words.intersection(source_words) if len(w) > 3}
-    union = suspect_words.union(source_words)
-    
+    intersection = {w for w in suspect_word_set.intersection(source_word_set) if len(w) > 3}
+    union = suspect_word_set.union(source_word_set)
+
     jaccard_score = (len(intersection) / len(union)) * 100 if union else 0.0
-    
+
     print(f"DEBUG: RK Score: {rk_score:.2f}%, Jaccard Score: {jaccard_score:.2f}%")
-    
+
     # Use the higher of the two scores
     final_score = max(rk_score, jaccard_score)
-    
+
     # If Jaccard is significantly helpful, add individual words to matches for highlighting
     if jaccard_score > rk_score:
         matches.extend(list(intersection))
-    
+
     return {
         "similarity_score": round(final_score, 2),
         "matches": list(set(matches)) # Return unique matches
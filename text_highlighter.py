@@ -8,6 +8,11 @@ for visual plagiarism comparison.
 import re
 from html import escape
 
+from preprocessing import preprocess_with_offsets
+
+
+_WORD_RE = re.compile(r'\w+')
+
 
 def highlight_text_matches(original_text, matches):
     """
@@ -16,6 +21,10 @@ def highlight_text_matches(original_text, matches):
     Since K-gram matches are preprocessed (lowercase, stemmed, no stopwords),
     we need to find and highlight the individual words from matches in the original text.
     
+    The text is scanned once word by word and each word is looked up in the
+    set of matched words (same result as a whole-word, case-insensitive
+    search for every matched word).
+    
     Args:
         original_text (str): The original text to highlight
         matches (list): List of matched phrases (k-grams) from preprocessed text
@@ -32,33 +41,70 @@ def highlight_text_matches(original_text, matches):
         words = match.lower().split()
         matched_words.update(words)
     
-    print(f"DEBUG: Words to highlight: {matched_words}")
+    print(f"DEBUG: {len(matched_words)} words to highlight")
     
-    # Build regex pattern to find these words in original text
-    # Match whole words only, case-insensitive
     if not matched_words:
         return escape(original_text)
     
-    # Create pattern that matches any of the words
-    # We use word boundaries for better matching
-    pattern_words = '|'.join(re.escape(word) for word in matched_words)
-    pattern = rf'\b({pattern_words})\b'
-    
-    # Find all matches and their positions
-    highlights = []
-    for m in re.finditer(pattern, original_text, re.IGNORECASE):
-        highlights.append((m.start(), m.end()))
+    highlights = [m.span() for m in _WORD_RE.finditer(original_text)
+                  if m.group().lower() in matched_words]
     
     print(f"DEBUG: Found {len(highlights)} highlight positions")
     
-    # Merge overlapping highlights
-    highlights = merge_overlapping_ranges(highlights)
+    return render_highlights(original_text, merge_overlapping_ranges(highlights))
+
+
+def highlight_text_spans(original_text, spans, side='suspect', matches=None, preprocessed=None):
+    """
+    Highlight copied passages given as token spans (see rabin_karp.find_match_spans).
+    
+    Each span is projected back onto the original text through the token
+    offsets of preprocessing.preprocess_with_offsets, so inflected words and
+    the stopwords inside a copied passage are highlighted exactly.
+    
+    Args:
+        original_text (str): The original (unprocessed) text
+        spans (list): Span dicts from find_match_spans
+        side (str): 'suspect' or 'source', which positions of the spans to use
+        matches (list, optional): Match list of the same result; its single
+            words (added when the Jaccard score wins) are highlighted wherever
+            their token occurs
+        preprocessed (tuple, optional): (tokens, offsets) from
+            preprocess_with_offsets(original_text), computed here if not given
+        
+    Returns:
+        str: HTML string with copied passages wrapped in <mark> tags
+    """
+    words = {match for match in matches or () if ' ' not in match}
+    if not original_text or not (spans or words):
+        return escape(original_text) if original_text else ""
+    
+    tokens, offsets = preprocessed or preprocess_with_offsets(original_text)
+    
+    n_tokens = len(offsets) // 2
+    highlights = []
+    for span in spans or ():
+        start, end = span[f'{side}_start'], min(span[f'{side}_end'], n_tokens)
+        if start < end:
+            highlights.append((offsets[2 * start], offsets[2 * end - 1]))
+    
+    if words:
+        highlights.extend((offsets[2 * i], offsets[2 * i + 1])
+                          for i, token in enumerate(tokens) if token in words)
+        highlights.sort()
     
-    # Build the highlighted HTML string
+    return render_highlights(original_text, merge_overlapping_ranges(highlights))
+
+
+def render_highlights(original_text, highlights):
+    """
+    Build the escaped HTML for a text with sorted, non-overlapping
+    (start, end) character ranges wrapped in <mark> tags.
+    """
     result = []
     last_end = 0
     
-    for start, end in sorted(highlights):
+    for start, end in highlights:
         # Add non-highlighted text before this match
         if start > last_end:
             result.append(escape(original_text[last_end:start]))
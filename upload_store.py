@@ -0,0 +1,315 @@
+"""
+Upload Store Module
+
+Content-addressed storage of page images and OCR word boxes under
+static/uploads/objects. Files are named by the SHA-256 of their bytes, so
+re-uploading a document (or rendering the same page again) reuses the
+existing file instead of writing a new one.
+
+Batches and checks register the files they use as references. A periodic
+sweep deletes files nobody references any more once they are older than
+UPLOAD_MAX_AGE_HOURS, or sooner when the store is over UPLOAD_STORE_MAX_MB.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from database import apply_sqlite_pragmas
+
+STATIC_DIR = 'static'
+OBJECTS_DIR = os.environ.get('UPLOAD_OBJECTS_DIR', os.path.join('uploads', 'objects'))  # relative to static/
+DEFAULT_STORE_PATH = os.environ.get('UPLOAD_STORE_PATH', 'uploads.db')
+
+# Sweep limits for unreferenced files; referenced files are never deleted
+UPLOAD_STORE_MAX_MB = int(os.environ.get('UPLOAD_STORE_MAX_MB', 2048))
+UPLOAD_MAX_AGE_HOURS = float(os.environ.get('UPLOAD_MAX_AGE_HOURS', 24 * 7))
+
+# Seconds between sweeps, and how long a new file may stay unreferenced
+# (written by a running job that has not registered it yet)
+UPLOAD_GC_INTERVAL = int(os.environ.get('UPLOAD_GC_INTERVAL', 3600))
+UPLOAD_GC_GRACE = int(os.environ.get('UPLOAD_GC_GRACE', 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS refs (
+    digest TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (digest, owner)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_refs_owner ON refs (owner);
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    started_at REAL NOT NULL,
+    duration REAL,
+    deleted_files INTEGER,
+    deleted_bytes INTEGER,
+    dropped_refs INTEGER
+);
+"""
+
+
+def batch_owner(batch_id):
+    return f"batch:{batch_id}"
+
+
+def check_owner(check_id):
+    return f"check:{check_id}"
+
+
+def digest_of(path):
+    """Content hash of a stored file, taken from its name."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class UploadStore:
+    """
+    Deduplicating file store with reference tracking.
+
+    Paths returned by put_bytes are relative to static/ (for url_for('static'));
+    fs_path() turns them into filesystem paths. Dedup counters are per process.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, static_dir=STATIC_DIR, objects_dir=OBJECTS_DIR,
+                 max_bytes=UPLOAD_STORE_MAX_MB * 1024 * 1024, max_age=UPLOAD_MAX_AGE_HOURS * 3600):
+        self.path = path
+        self.static_dir = static_dir
+        self.objects_dir = objects_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.dedup_hits = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            apply_sqlite_pragmas(conn)
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def fs_path(self, rel_path):
+        return os.path.join(self.static_dir, rel_path)
+
+    def put_bytes(self, data, ext):
+        """
+        Store file content once.
+
+        Args:
+            data: File bytes
+            ext: File extension including the dot (e.g. '.png')
+
+        Returns:
+            str: Path relative to static/
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        rel_path = os.path.join(self.objects_dir, digest[:2], f"{digest}{ext}")
+        file_path = self.fs_path(rel_path)
+        now = time.time()
+
+        # Recorded before touching the file: last_used restarts the grace
+        # period, so a concurrent sweep never removes a file being reused
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO blobs (digest, path, size, created_at, last_used) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(digest) DO UPDATE SET last_used = excluded.last_used',
+                (digest, rel_path, len(data), now, now)
+            )
+
+        if os.path.exists(file_path):
+            with self._lock:
+                self.dedup_hits += 1
+        else:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+            with self._lock:
+                self.writes += 1
+
+        return rel_path
+
+    def add_references(self, owner, paths):
+        """Record that `owner` (see batch_owner/check_owner) uses the given files."""
+        now = time.time()
+        rows = {(digest_of(path), owner, now) for path in paths if path}
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany('INSERT OR IGNORE INTO refs (digest, owner, created_at) VALUES (?, ?, ?)', rows)
+
+    def release(self, owner):
+        """Drop every reference of an owner (e.g. a deleted check)."""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM refs WHERE owner = ?', (owner,))
+
+    def claim_sweep(self, interval=UPLOAD_GC_INTERVAL):
+        """
+        Returns True (and records the sweep start) if the last sweep started
+        more than `interval` seconds ago, so only one process sweeps at a time.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT started_at FROM sweeps WHERE id = 1').fetchone()
+            if row and now - row[0] < interval:
+                return False
+            conn.execute('INSERT INTO sweeps (id, started_at) VALUES (1, ?) '
+                         'ON CONFLICT(id) DO UPDATE SET started_at = excluded.started_at', (now,))
+        return True
+
+    def sweep(self, live_owners=None, snapshot_time=None, grace=UPLOAD_GC_GRACE):
+        """
+        Delete unreferenced files that are too old, then the oldest
+        unreferenced ones while the store is over its size limit.
+
+        Args:
+            live_owners: Optional set of owners that still exist; references
+                         of other owners created before snapshot_time are
+                         dropped first (their batch or check was deleted)
+            snapshot_time: When live_owners was read (defaults to now)
+            grace: Files used within this many seconds are always kept
+
+        Returns:
+            dict: 'deleted_files', 'deleted_bytes', 'dropped_refs', 'duration'
+        """
+        start = time.time()
+        snapshot_time = snapshot_time or start
+        dropped_refs = 0
+
+        with self._connect() as conn:
+            if live_owners is not None:
+                stale = [owner for (owner,) in conn.execute(
+                    'SELECT DISTINCT owner FROM refs WHERE created_at < ?', (snapshot_time,)
+                ) if owner not in live_owners]
+                for owner in stale:
+                    dropped_refs += conn.execute(
+                        'DELETE FROM refs WHERE owner = ? AND created_at < ?', (owner, snapshot_time)
+                    ).rowcount
+
+            total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            candidates = conn.execute(
+                'SELECT digest, path, size, last_used FROM blobs '
+                'WHERE last_used < ? AND digest NOT IN (SELECT digest FROM refs) '
+                'ORDER BY last_used', (start - grace,)
+            ).fetchall()
+
+        doomed = []
+        for digest, rel_path, size, last_used in candidates:
+            if start - last_used > self.max_age or total_bytes > self.max_bytes:
+                doomed.append((digest, rel_path, size))
+                total_bytes -= size
+
+        deleted_files = deleted_bytes = 0
+        with self._connect() as conn:
+            for digest, rel_path, size in doomed:
+                # Re-check under the write lock: the file may have been reused meanwhile
+                deleted = conn.execute(
+                    'DELETE FROM blobs WHERE digest = ? AND last_used < ? '
+                    'AND NOT EXISTS (SELECT 1 FROM refs WHERE digest = ?)',
+                    (digest, start - grace, digest)
+                ).rowcount
+                if not deleted:
+                    continue
+                try:
+                    os.remove(self.fs_path(rel_path))
+                except FileNotFoundError:
+                    pass
+                deleted_files += 1
+                deleted_bytes += size
+
+            stats = {
+                'deleted_files': deleted_files,
+                'deleted_bytes': deleted_bytes,
+                'dropped_refs': dropped_refs,
+                'duration': round(time.time() - start, 3)
+            }
+            conn.execute(
+                'UPDATE sweeps SET duration = ?, deleted_files = ?, deleted_bytes = ?, dropped_refs = ? WHERE id = 1',
+                (stats['duration'], stats['deleted_files'], stats['deleted_bytes'], stats['dropped_refs'])
+            )
+
+        print(f"DEBUG: Upload sweep removed {stats['deleted_files']} files "
+              f"({deleted_bytes / 1024 / 1024:.1f} MB) in {stats['duration']}s")
+        return stats
+
+    def stats(self):
+        """Returns disk usage, reference counts and the last sweep."""
+        with self._connect() as conn:
+            files, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            referenced_files, referenced_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs WHERE digest IN (SELECT digest FROM refs)'
+            ).fetchone()
+            owners = conn.execute('SELECT COUNT(DISTINCT owner) FROM refs').fetchone()[0]
+            sweep = conn.execute(
+                'SELECT started_at, duration, deleted_files, deleted_bytes, dropped_refs FROM sweeps WHERE id = 1'
+            ).fetchone()
+
+        return {
+            'files': files,
+            'bytes': total_bytes,
+            'referenced_files': referenced_files,
+            'referenced_bytes': referenced_bytes,
+            'unreferenced_bytes': total_bytes - referenced_bytes,
+            'owners': owners,
+            'max_bytes': self.max_bytes,
+            'max_age_hours': self.max_age / 3600,
+            'writes': self.writes,
+            'dedup_hits': self.dedup_hits,
+            'last_sweep': dict(zip(('started_at', 'duration', 'deleted_files', 'deleted_bytes', 'dropped_refs'),
+                                   sweep)) if sweep else None
+        }
+
+
+def remove_old_files(path, max_age):
+    """
+    Delete files under `path` not modified for `max_age` seconds (for plain
+    caches such as the highlighted page cache).
+
+    Returns:
+        tuple: (deleted files, deleted bytes)
+    """
+    cutoff = time.time() - max_age
+    files = total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            try:
+                st = os.stat(file_path)
+                if st.st_mtime >= cutoff:
+                    continue
+                os.remove(file_path)
+            except OSError:
+                continue
+            files += 1
+            total += st.st_size
+    return files, total
+
+
+def directory_usage(path):
+    """(file count, total bytes) of a directory tree, e.g. a cache directory."""
+    files = total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+            files += 1
+    return files, total
@@ -0,0 +1,85 @@
+"""
+Checks that the sparse-matrix batch scores (batch_matrix.score_matrix) are
+identical to the per-pair scores of rabin_karp.compare_documents.
+
+Usage: python verify_batch_matrix.py [number_of_random_documents]
+"""
+
+import contextlib
+import glob
+import io
+import random
+import sys
+import time
+from itertools import combinations
+
+from batch_matrix import iter_pair_scores, iter_similarity_rows, score_matrix
+from preprocessing import preprocess_text
+from rabin_karp import prepare_document, compare_documents
+
+
+def build_documents(n_random):
+    texts = [open(path, encoding='utf-8').read() for path in sorted(glob.glob('test_files/*.txt'))]
+    processed = [preprocess_text(text) for text in texts]
+
+    # Random documents mixing words of the sample files, with copied passages
+    vocabulary = ' '.join(processed).split()
+    rng = random.Random(42)
+    for _ in range(n_random):
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(0, 300))]
+        if processed and rng.random() < 0.5:
+            source = rng.choice(processed).split()
+            start = rng.randint(0, max(0, len(source) - 20))
+            words[len(words) // 2:len(words) // 2] = source[start:start + 20]
+        processed.append(' '.join(words))
+    return processed
+
+
+def main():
+    n_random = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    processed = build_documents(n_random)
+
+    for window in (None, 4):
+        prepared = [prepare_document(text, 3, window) for text in processed]
+
+        start = time.time()
+        similarity = score_matrix(prepared)['similarity']
+        matrix_time = time.time() - start
+
+        start = time.time()
+        mismatches = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, j in combinations(range(len(prepared)), 2):
+                for a, b in ((i, j), (j, i)):
+                    expected = compare_documents(prepared[a], prepared[b])['similarity_score']
+                    if round(float(similarity[a, b]), 2) != expected:
+                        mismatches += 1
+                        print(f"MISMATCH {a} vs {b}: {similarity[a, b]} != {expected}", file=sys.stderr)
+        loop_time = time.time() - start
+
+        # Blocked and pair-restricted scoring must give the same values
+        all_pairs = list(combinations(range(len(prepared)), 2))
+        for scores in (iter_pair_scores(prepared, block_cells=len(prepared) * 3),
+                       iter_pair_scores(prepared, pairs=all_pairs[::3], block_cells=50)):
+            for i, j, value in scores:
+                if value != similarity[i, j]:
+                    mismatches += 1
+                    print(f"MISMATCH blocked {i} vs {j}: {value} != {similarity[i, j]}", file=sys.stderr)
+        for pairs in (None, all_pairs[::3]):
+            kept = set(all_pairs if pairs is None else pairs)
+            for i, row in iter_similarity_rows(prepared, pairs=pairs, block_cells=len(prepared) * 5):
+                for j, value in enumerate(row):
+                    pair = (min(i, j), max(i, j))
+                    expected = similarity[pair] if pair in kept else 0.0
+                    if i != j and value != expected:
+                        mismatches += 1
+                        print(f"MISMATCH row {i} col {j}: {value} != {expected}", file=sys.stderr)
+
+        print(f"window={window}: {len(prepared)} documents, {mismatches} mismatches, "
+              f"matrix {matrix_time:.3f}s, per-pair loop {loop_time:.3f}s")
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Checks the recall of LSH candidate pruning (batch_comparison.find_candidate_pairs):
+every pair whose exact batch score reaches BATCH_DETAIL_THRESHOLD must be
+kept as a candidate.
+
+Documents are generated with copied passages, paraphrases (shuffled
+words) and repeated passages, so many pairs score close to the threshold.
+
+Usage: python verify_lsh_recall.py [number_of_documents] [lsh_bands] [lsh_rows]
+"""
+
+import contextlib
+import io
+import os
+import random
+import string
+import sys
+import time
+
+from batch_comparison import find_candidate_pairs
+from batch_matrix import score_matrix
+from minhash_lsh import lsh_threshold
+from rabin_karp import prepare_document
+
+DETAIL_THRESHOLD = float(os.environ.get('BATCH_DETAIL_THRESHOLD', 20))
+
+# Minimum share of the pairs above the threshold that must be candidates
+MIN_RECALL = 0.99
+
+
+def build_documents(n, rng):
+    vocabulary = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+                  for _ in range(4000)]
+
+    def filler(count):
+        return [rng.choice(vocabulary) for _ in range(count)]
+
+    documents = []
+    for _ in range(n):
+        kind = rng.random()
+        if not documents or kind < 0.3:
+            words = filler(rng.randint(100, 800))
+        else:
+            source = rng.choice(documents)
+            share = rng.uniform(0.05, 0.6)
+            if kind < 0.65:
+                # Copied passages mixed into new text
+                words = filler(rng.randint(100, 800))
+                length = max(1, int(len(source) * share))
+                start = rng.randint(0, len(source) - length)
+                at = rng.randint(0, len(words))
+                words[at:at] = source[start:start + length]
+            elif kind < 0.85:
+                # Paraphrase: the source's words, reordered, plus new words
+                words = rng.sample(source, int(len(source) * share)) + filler(rng.randint(50, 400))
+                rng.shuffle(words)
+            else:
+                # A short passage repeated several times
+                length = rng.randint(5, 30)
+                start = rng.randint(0, max(0, len(source) - length))
+                words = filler(rng.randint(100, 500))
+                for _ in range(rng.randint(2, 8)):
+                    at = rng.randint(0, len(words))
+                    words[at:at] = source[start:start + length]
+        documents.append(words)
+    return [' '.join(words) for words in documents]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    bands = int(sys.argv[2]) if len(sys.argv) > 2 else int(os.environ.get('LSH_BANDS', 128))
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else int(os.environ.get('LSH_ROWS', 2))
+
+    failed = False
+    for seed in (1, 2, 3):
+        prepared = [prepare_document(text, 3) for text in build_documents(n, random.Random(seed))]
+        similarity = score_matrix(prepared)['similarity']
+
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            candidates = find_candidate_pairs(prepared, bands=bands, rows=rows)
+        lsh_time = time.time() - start
+
+        # The batch reports similarity[i, j] for i < j
+        relevant = [(i, j) for i in range(n) for j in range(i + 1, n)
+                    if round(float(similarity[i, j]), 2) >= DETAIL_THRESHOLD]
+        missed = [pair for pair in relevant if pair not in candidates]
+        recall = 1 - len(missed) / len(relevant) if relevant else 1.0
+        for i, j in missed:
+            print(f"MISSED {i} vs {j}: {similarity[i, j]:.2f}%", file=sys.stderr)
+
+        total = n * (n - 1) // 2
+        print(f"seed={seed}: {n} documents, bands={bands} rows={rows} "
+              f"(threshold ~{lsh_threshold(bands, rows):.3f}), {len(relevant)} pairs >= {DETAIL_THRESHOLD}%, "
+              f"recall {recall:.4f}, {len(candidates)}/{total} candidates, LSH {lsh_time:.2f}s")
+        failed = failed or recall < MIN_RECALL
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
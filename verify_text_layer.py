@@ -0,0 +1,85 @@
+"""
+Checks which PDF pages use their text layer and which are OCR'd
+(file_parser._has_usable_text_layer): a page of real text keeps its text
+layer, while a scanned page whose text layer is only a footer such as
+"Scanned by CamScanner" must be OCR'd.
+
+If Tesseract is installed, the full extraction is run as well and the
+scanned page's text must come from OCR.
+
+Usage: python verify_text_layer.py
+"""
+
+import contextlib
+import io
+import shutil
+import sys
+
+from fpdf import FPDF
+from PIL import Image, ImageDraw, ImageFont
+from pypdf import PdfReader
+from werkzeug.datastructures import FileStorage
+
+from file_parser import _has_usable_text_layer, _text_layer_word_boxes
+
+BODY = ("Algoritma Rabin-Karp merupakan algoritma pencarian string yang memanfaatkan hashing "
+        "untuk efisiensi. Setiap potongan kata dihitung nilai hash-nya lalu dibandingkan. ") * 6
+SCANNED = "Penelitian ini membahas deteksi plagiarisme pada dokumen mahasiswa"
+FOOTER = "Scanned by CamScanner"
+
+
+def build_pdf():
+    """Page 1: a text page. Page 2: a scanned page with only a footer in its text layer."""
+    pdf = FPDF()
+    pdf.set_auto_page_break(False)
+    pdf.set_font("Helvetica", size=12)
+
+    pdf.add_page()
+    pdf.multi_cell(0, 8, text=BODY)
+
+    scan = Image.new('RGB', (1600, 400), 'white')
+    try:
+        font = ImageFont.truetype("DejaVuSans.ttf", 40)
+    except OSError:
+        font = ImageFont.load_default()
+    ImageDraw.Draw(scan).text((40, 150), SCANNED, fill='black', font=font)
+
+    pdf.add_page()
+    pdf.image(scan, x=10, y=20, w=190)
+    pdf.set_font("Helvetica", size=8)
+    pdf.set_y(-15)
+    pdf.cell(0, 5, text=FOOTER, align="C")
+    return bytes(pdf.output())
+
+
+def main():
+    data = build_pdf()
+    reader = PdfReader(io.BytesIO(data))
+
+    failures = 0
+    for idx, expected in ((0, True), (1, False)):
+        page = reader.pages[idx]
+        text, boxes = _text_layer_word_boxes(page)
+        usable = _has_usable_text_layer(page, text, boxes)
+        status = 'ok' if usable == expected else 'FAIL'
+        failures += usable != expected
+        print(f"page {idx + 1}: {len(text.strip())} chars in text layer, "
+              f"{'text layer' if usable else 'OCR'} ({status})")
+
+    if shutil.which('tesseract'):
+        from file_parser import _extract_from_pdf_with_images
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = _extract_from_pdf_with_images(FileStorage(stream=io.BytesIO(data), filename='scan.pdf'))
+        found = 'plagiarisme' in result['text'].lower()
+        failures += not found
+        print(f"extraction: scanned page text {'found' if found else 'MISSING'} in OCR output")
+    else:
+        print("extraction: skipped (tesseract not installed)")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()